@@ -0,0 +1,229 @@
+"""
+Named axes on a PDXC daisy chain, with concurrent per-axis moves.
+
+One serial handle reaches the main controller and up to 11 secondaries. The
+handle cannot carry two commands at once, but most of the time of a move is
+spent waiting for the stage to settle, not talking to the controller. `Chain`
+therefore
+
+* runs every library call on a single worker thread per handle
+  (`HandleScheduler`), so calls sharing the handle are serialized, and
+* waits for each axis in its own thread, so that the settle waits (and the
+  position polls interleaved on the handle) of independent axes overlap.
+
+A multi-axis move takes as long as the slowest axis instead of the sum.
+
+Axes are given as {name: (secondary, channel)}, secondary being the index in
+the chain (0: single mode or main, 1-11: Secondary1-Secondary11) and channel
+the open-loop channel (0: channel 1, 1: channel 2).
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PDXCMotion import MoveCompletion
+from PDXCBinding import PDXCError
+from callstats import charge, propagate
+
+
+class HandleScheduler:
+    """
+    Execute the calls sharing one serial handle, one at a time, on a dedicated thread.
+    """
+
+    def __init__(self, name='pdxc'):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name,
+                                           initializer=self._register)
+        self._worker = None
+        self.calls = 0
+        self.busy_time = 0.
+
+    def _register(self):
+        self._worker = threading.current_thread()
+
+    def _run(self, fn, args, spent=None):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            dt = time.perf_counter() - t0
+            self.calls += 1
+            self.busy_time += dt
+            if spent is not None:
+                spent[0] = dt
+
+    def call(self, fn, *args):
+        """
+        Run fn(*args) on the handle thread and return its result.
+
+        The time fn runs on the handle thread counts as dll time of the current call,
+        the time spent waiting for the handle as wait time (see callstats).
+        """
+        if threading.current_thread() is self._worker:
+            # Already on the handle thread (nested call): timed by the outer call
+            return self._run(fn, args)
+        spent = [0.]
+        t0 = time.perf_counter()
+        try:
+            return self.executor.submit(self._run, fn, args, spent).result()
+        finally:
+            charge('dll', spent[0])
+            charge('wait', time.perf_counter() - t0 - spent[0])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class Axis:
+    """
+    One stage of the chain.
+    """
+
+    def __init__(self, name, secondary, channel, motion):
+        self.name = name
+        self.secondary = secondary
+        self.channel = channel
+        self.motion = motion
+        self.probed = False     # open-loop frequency looked up
+
+
+class Chain:
+    """
+    The named axes of a daisy chain, sharing the serial handle of `device`.
+    """
+
+    def __init__(self, device, axes, tolerance=1e-4, timeout=10., binding=None, name='pdxc'):
+        """
+        Args:
+            device: opened pdxc instance.
+            axes: {name: (secondary, channel)}. The first axis is the default one.
+            tolerance: settle tolerance (mm or °) of every axis.
+            timeout: maximum time (s) to wait for a move to settle.
+            binding: PDXCBinding on the same handle, used for the position polls.
+            name: name of the handle thread (e.g. with the serial number, when a process drives several controllers).
+        """
+        if not axes:
+            raise ValueError('At least one axis is required.')
+        self.device = device
+        self.binding = binding
+        self.port = HandleScheduler(name)
+        self.axes = {}
+        for name, (secondary, channel) in axes.items():
+            # The open-loop frequency is looked up on the first move, not at startup
+            motion = MoveCompletion(lambda secondary=secondary: self.read_position(secondary),
+                                    tolerance=tolerance,
+                                    timeout=timeout)
+            self.axes[name] = Axis(name, secondary, channel, motion)
+        self.default = next(iter(self.axes))
+        self._pool = ThreadPoolExecutor(max_workers=len(self.axes), thread_name_prefix='pdxc-axis')
+
+    def call(self, name, *args):
+        """
+        Call pdxc method `name` on the handle thread.
+        """
+        return self.port.call(getattr(self.device, name), *args)
+
+    def axis(self, name=None):
+        """
+        Axis `name` (the default axis if None).
+        """
+        try:
+            return self.axes[self.default if name is None else name]
+        except KeyError:
+            raise ValueError(f'Unknown axis {name}. Axes are {list(self.axes)}.')
+
+    def read_position(self, secondary):
+        """
+        Current position of `secondary`, or None if it can't be read (e.g. stage without encoder).
+        """
+        if self.binding is not None:
+            try:
+                return self.port.call(self.binding.GetCurrentPosition, secondary)
+            except PDXCError:
+                return None
+        position = [0.]
+        if self.call('GetCurrentPosition', secondary, position) < 0:
+            return None
+        return position[0]
+
+    def read_error(self, secondary):
+        """
+        Error code of `secondary` (GetErrorMessage), or None if it can't be read.
+        """
+        error = [0]
+        if self.call('GetErrorMessage', secondary, error) < 0:
+            return None
+        return error[0]
+
+    def open_loop_frequency(self, secondary, channel=0):
+        """
+        Open-loop pulse frequency (Hz) of the stage on `secondary`, or None if unknown.
+        """
+        stage_type = [0]
+        if self.call('GetSpeedStageType', secondary, stage_type) < 0:
+            return None
+        frequency = [0]
+        if stage_type[0] == 1:  # SMC stage
+            name = 'GetOpenLoopFrequency2' if channel == 1 else 'GetOpenLoopFrequency'
+            ret = self.call(name, secondary, frequency)
+        elif stage_type[0] == 2:  # PD2/PD3 stage
+            ret = self.call('GetOpenLoopFrequency3', secondary, frequency)
+        else:  # PDX stages have an encoder, the position tells us when the move is over
+            return None
+        if ret < 0 or frequency[0] <= 0:
+            return None
+        return frequency[0]
+
+    def move(self, name, pulses):
+        """
+        Open-loop move of `pulses` pulses (negative: back) on axis `name` and wait until it has settled.
+
+        Returns:
+            the move record, or None if the command failed.
+        """
+        axis = self.axis(name)
+        axis.motion.reset()  # from here on, abort interrupts this move
+        return self._move(axis, pulses)
+
+    def _move(self, axis, pulses):
+        if not axis.probed:
+            axis.motion.frequency = self.open_loop_frequency(axis.secondary, axis.channel)
+            axis.probed = True
+        command = 'SetOpenLoopMoveForward' if pulses >= 0 else 'SetOpenLoopMoveBack'
+        start_position = self.read_position(axis.secondary)
+        t0 = time.perf_counter()
+        result = self.call(command, axis.secondary, abs(pulses), axis.channel)
+        if result < 0:
+            print(f"{axis.name}: {command} {abs(pulses)} failed", result)
+            return None
+        print(f"{axis.name}: {command} {abs(pulses)}")
+        record = axis.motion.wait(abs(pulses), t0, start_position)
+        record['axis'] = axis.name
+        return record
+
+    def move_many(self, moves):
+        """
+        Move several axes at the same time.
+
+        Args:
+            moves: {name: pulses}, negative pulses moving back.
+
+        Returns:
+            {name: move record} once all axes have settled.
+        """
+        axes = {name: self.axis(name) for name in moves}
+        for axis in axes.values():
+            axis.motion.reset()  # before the moves are queued: an abort from here on interrupts them
+        futures = {name: self._pool.submit(propagate(self._move), axes[name], pulses) for name, pulses in moves.items()}
+        return {name: f.result() for name, f in futures.items()}
+
+    def abort(self):
+        """
+        Interrupt the settle waits of all axes.
+        """
+        for axis in self.axes.values():
+            axis.motion.abort()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.port.close()
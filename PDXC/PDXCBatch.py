@@ -0,0 +1,134 @@
+"""
+Batched PDXC commands: run a whole sequence in one RPC round trip.
+
+Every call on a proxy client costs a round trip, pickling and, for
+non-blocking calls, a result callback. A sequence of hundreds of small moves is
+dominated by that overhead. `PDXCDriver.batch` receives the whole sequence at
+once and returns the per-command results and timings in one reply.
+
+A command is a tuple (name, args, kwargs) (args and kwargs are optional) where
+name is either
+
+* a method exposed by the driver (`move_forward`, `move_stats`, ...), or
+* a method of the `pdxc` command library (`SetOpenLoopFrequency`,
+  `GetCurrentPosition`, ...). Getters are called with their output list
+  appended automatically and return the value. Negative return codes are
+  reported as errors.
+
+On the client side, `Batch` collects the calls:
+
+    with Batch(c) as b:
+        b.SetOpenLoopFrequency3(0, 1000)
+        for i in range(100):
+            b.move_forward(500)
+            b.GetCurrentPosition(0)
+    print(b.results)
+"""
+import time
+
+from PDXC_COMMAND_LIB import pdxc
+
+
+def _normalize(command):
+    """
+    Return (name, args, kwargs) from a command tuple.
+    """
+    if isinstance(command, str):
+        return command, (), {}
+    name, *rest = command
+    args = rest[0] if len(rest) > 0 else ()
+    kwargs = rest[1] if len(rest) > 1 else {}
+    return name, tuple(args), dict(kwargs)
+
+
+def _resolve(driver, name):
+    """
+    Return a callable for command `name`.
+    """
+    if name == 'batch':
+        raise ValueError('Batches cannot be nested.')
+    method = getattr(type(driver), name, None)
+    if method is not None and hasattr(method, 'api_info') and not name.startswith('_'):
+        return getattr(driver, name)
+    if name[:3] in ('Get', 'Set') and hasattr(pdxc, name):
+        return _library_call(driver.chain.port, getattr(driver.device, name), getter=name.startswith('Get'))
+    raise ValueError(f'Unknown batch command {name}.')
+
+
+def _library_call(port, method, getter):
+    """
+    Wrap a pdxc library method: getters return their value, failures raise.
+    The call runs on the handle thread of `port` (see PDXCAxes.HandleScheduler).
+    """
+    def call(*args):
+        if getter:
+            out = [None]
+            ret = port.call(method, *args, out)
+        else:
+            out = None
+            ret = port.call(method, *args)
+        if ret < 0:
+            raise RuntimeError(f'{method.__name__} failed ({ret}).')
+        return out[0] if getter else ret
+    return call
+
+
+def run_batch(driver, commands, stop_on_error=True):
+    """
+    Execute `commands` on `driver` in order.
+
+    Returns:
+        one dict per executed command with keys 'name', 'result', 'error' (None or repr
+        of the exception) and 'time' (execution time in s).
+    """
+    results = []
+    for command in commands:
+        name, args, kwargs = _normalize(command)
+        t0 = time.perf_counter()
+        result = None
+        error = None
+        try:
+            result = _resolve(driver, name)(*args, **kwargs)
+        except Exception as e:
+            error = repr(e)
+        results.append({'name': name, 'result': result, 'error': error, 'time': time.perf_counter() - t0})
+        if error is not None and stop_on_error:
+            break
+    return results
+
+
+class Batch:
+    """
+    Client-side collector of batch commands. Any method called on this object is
+    recorded; `run` (or leaving the `with` block) sends them all in one call.
+    """
+
+    def __init__(self, client, stop_on_error=True):
+        self.client = client
+        self.stop_on_error = stop_on_error
+        self.commands = []
+        self.results = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return record
+
+    def run(self):
+        """
+        Send the recorded commands and return their results.
+        """
+        self.results = self.client.batch(self.commands, stop_on_error=self.stop_on_error)
+        self.commands = []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
@@ -0,0 +1,293 @@
+"""
+Prototyped, allocation-free binding of the PDXC command library.
+
+The `pdxc` class of PDXC_COMMAND_LIB.py calls the DLL functions without
+prototypes, allocates new ctypes objects (a 1 kB string buffer for every text
+getter) on each call and returns values through a list argument. That is fine
+for setup, but adds up in loops polling the position.
+
+`PDXCBinding` is built from one declarative table (`SPEC`) of the library
+entry points:
+
+* every function gets its prototype (see `prototyped`), on function pointers
+  private to this module (the prototypes do not leak into the `pdxc` class),
+* output values are written to buffers allocated once per handle,
+* getters return their value and every call raises `PDXCError` on failure:
+
+    b = PDXCBinding(hdl)             # handle returned by pdxc.Open
+    position = b.GetCurrentPosition(0)
+    b.SetOpenLoopMoveForward(0, 500, 0)
+
+The method names and arguments are those of `pdxc`, without the output list.
+The per-handle buffers make an instance unsafe to share between threads that
+call it concurrently: serialize the calls (see PDXCAxes.HandleScheduler).
+"""
+import ctypes
+from ctypes import c_int, c_double, c_byte, c_char, c_char_p, POINTER
+
+from PDXC_COMMAND_LIB import pdxc
+
+LIBRARY_PATH = "./PDXC_COMMAND_LIB_win64.dll"
+
+
+class Text:
+    """
+    Text output, with the controller's line terminator `strip` removed.
+    """
+
+    def __init__(self, strip):
+        self.strip = strip
+
+
+# (method name, DLL function, input argument types after the handle, output type or None)
+SPEC = [
+    ('GetCurrentStatus', 'Get_CurrentStatus', (c_int,), Text(">\r\n")),
+    ('GetSN', 'Get_SN', (c_int,), Text("\r\n")),
+    ('GetSN2', 'Get_SN2', (c_int,), Text("\r\n")),
+    ('GetFV', 'Get_FV', (c_int,), Text("\r\n")),
+    ('GetCalibrationIsCompleted', 'Get_CalibrationIsCompleted', (c_int,), c_byte),
+    ('GetDaisyChainStatus', 'Get_DaisyChainStatus', (c_int,), c_byte),
+    ('GetUserDataIsSaved', 'Get_UserDataIsSaved', (c_int,), Text(">\r\n")),
+    ('GetKpOfPidParameters', 'Get_KpOfPidParameters', (c_int,), c_double),
+    ('GetKiOfPidParameters', 'Get_KiOfPidparameters', (c_int,), c_double),
+    ('GetKdOfPidParameters', 'Get_KdOfPidparameters', (c_int,), c_double),
+    ('GetOpenLoopFrequency', 'Get_OpenLoopFrequency', (c_int,), c_int),
+    ('GetOpenLoopFrequency2', 'Get_OpenLoopFrequency2', (c_int,), c_int),
+    ('GetOpenLoopFrequency3', 'Get_OpenLoopFrequency3', (c_int,), c_int),
+    ('GetLoopStatus', 'Get_LoopStatus', (c_int,), c_int),
+    ('GetAbnormalMoveDetect', 'Get_AbnormalMoveDetect', (c_int,), c_int),
+    ('GetErrorMessage', 'Get_ErrorMessage', (c_int,), c_int),
+    ('GetCurrentPosition', 'Get_CurrentPosition', (c_int,), c_double),
+    ('GetTargetTriggerPosition', 'Get_TargetTriggerPosition', (c_int,), c_double),
+    ('GetDisabled', 'Get_Disabled', (c_int,), c_int),
+    ('GetOpenLoopJogSize', 'Get_OpenLoopJogSize', (c_int,), c_int),
+    ('GetOpenLoopJogSize2', 'Get_OpenLoopJogSize2', (c_int,), c_int),
+    ('GetOpenLoopJogSize3', 'Get_OpenLoopJogSize3', (c_int,), c_int),
+    ('GetForwardAmplitude', 'Get_ForwardAmplitude', (c_int,), c_int),
+    ('GetBackwardAmplitude', 'Get_BackwardAmplitude', (c_int,), c_int),
+    ('GetSpeedStageType', 'Get_SpeedStageType', (c_int,), c_int),
+    ('GetAllParametersInExternalTrigger', 'Get_AllParametersInExternalTrigger', (c_int,), Text(">\r\n")),
+    ('GetCurrentStatusInExternalTrigger', 'Get_CurrentStatusInExternalTrigger', (c_int,), Text(">\r\n")),
+    ('GetAnalogInputGain', 'Get_AnalogInputGain', (c_int,), c_double),
+    ('GetAnalogInputOffSet', 'Get_AnalogInputOffSet', (c_int,), c_double),
+    ('GetAnalogOutGain', 'Get_AnalogOutGain', (c_int,), c_double),
+    ('GetAnalogOutOffSet', 'Get_AnalogOutOffSet', (c_int,), c_double),
+    ('GetPositionLimit', 'Get_PositionLimit', (c_int,), Text("\n>\r\n")),
+    ('GetJoystickStatus', 'Get_JoystickStatus', (c_int,), c_int),
+    ('GetJoystickConfig', 'Get_JoystickConfig', (c_int,), Text("\n>\r\n")),
+    ('GetInitPosition', 'Get_InitPosition', (c_int,), c_int),
+    ('SetDaisyChain', 'Set_DaisyChain', (c_int,), None),
+    ('SetTargetSpeed', 'Set_TargetSpeed', (c_int, c_int), None),
+    ('SetOpenLoopFrequency', 'Set_OpenLoopFrequency', (c_int, c_int), None),
+    ('SetOpenLoopFrequency2', 'Set_OpenLoopFrequency2', (c_int, c_int), None),
+    ('SetOpenLoopFrequency3', 'Set_OpenLoopFrequency3', (c_int, c_int), None),
+    ('SetOpenLoopJogSize', 'Set_OpenLoopJogSize', (c_int, c_int), None),
+    ('SetOpenLoopJogSize2', 'Set_OpenLoopJogSize2', (c_int, c_int), None),
+    ('SetOpenLoopJogSize3', 'Set_OpenLoopJogSize3', (c_int, c_int), None),
+    ('SetForwardAmplitude', 'Set_ForwardAmplitude', (c_int, c_int), None),
+    ('SetBackwardAmplitude', 'Set_BackwardAmplitude', (c_int, c_int), None),
+    ('SetPositionCalibration', 'Set_PositionCalibration', (c_int, c_int), None),
+    ('SetAbnormalMoveDetect', 'Set_AbnormalMoveDetect', (c_int, c_int), None),
+    ('SetLoop', 'Set_Loop', (c_int, c_int), None),
+    ('SetTargetPosition', 'Set_TargetPosition', (c_int, c_double), None),
+    ('SetKpOfPidParameters', 'Set_KpOfPidParameters', (c_int, c_double), None),
+    ('SetKiOfPidParameters', 'Set_KiOfPidParameters', (c_int, c_double), None),
+    ('SetKdOfPidParameters', 'Set_KdOfPidParameters', (c_int, c_double), None),
+    ('SetAnalogInputGain', 'Set_AnalogInputGain', (c_int, c_double), None),
+    ('SetAnalogInputOffSet', 'Set_AnalogInputOffSet', (c_int, c_double), None),
+    ('SetAnalogOutGain', 'Set_AnalogOutGain', (c_int, c_double), None),
+    ('SetAnalogOutOffSet', 'Set_AnalogOutOffSet', (c_int, c_double), None),
+    ('SetAllCustomerData', 'Set_AllCustomerData', (c_int, c_int), None),
+    ('SetOpenLoopMoveForward', 'Set_OpenLoopMoveForward', (c_int, c_int, c_int), None),
+    ('SetOpenLoopMoveBack', 'Set_OpenLoopMoveBack', (c_int, c_int, c_int), None),
+    ('SetDisabled', 'Set_Disabled', (c_int, c_int), None),
+    ('SetCurrentStatusInExternalTrigger', 'Set_CurrentStatusInExternalTrigger', (c_int, c_char_p), None),
+    ('SetPositionLimit', 'Set_PositionLimit', (c_int, c_double, c_double), None),
+    ('SetJoystickConfig', 'Set_JoystickConfig', (c_int, c_int, c_int), None),
+    ('SetStepPulseAndResponse', 'Set_StepPulseAndResponse', (c_int, c_double), None),
+    ('SetInitPosition', 'Set_InitPosition', (c_int, c_int), None),
+]
+
+# Functions that do not take a handle
+_HANDLE_FREE = {
+    'List': ([POINTER(c_char), c_int], c_int),
+    'Open': ([c_char_p, c_int, c_int], c_int),
+    'IsOpen': ([c_char_p], c_int),
+    'GetHandle': ([c_char_p], c_int),
+    'Close': ([c_int], c_int),
+}
+
+TEXT_SIZE = 1024
+
+
+class PDXCError(RuntimeError):
+    """
+    A PDXC library call returned an error code.
+    """
+
+    def __init__(self, name, code):
+        super().__init__(f'{name} failed ({code}).')
+        self.name = name
+        self.code = code
+
+
+def _output_argtype(output):
+    return POINTER(c_char) if isinstance(output, Text) else POINTER(output)
+
+
+def _needs_conversion(argtypes):
+    """
+    True if calling without argtypes would pass some arguments wrongly (or not at all).
+    Python ints and byref() pointers are passed correctly without prototype.
+    """
+    return any(t not in (c_int,) and not (isinstance(t, type) and issubclass(t, ctypes._Pointer))
+               for t in argtypes)
+
+
+_functions = {}
+
+
+def prototyped(lib, strict=False):
+    """
+    {DLL function name: function} for `lib`, with the prototypes of SPEC.
+
+    The restype is always declared. With strict=False, argtypes are only declared
+    for functions taking double or string arguments: for the others (all getters)
+    the argument conversion done by ctypes on every call costs more than the call
+    itself and brings nothing, the arguments being ints and preallocated pointers.
+    strict=True declares all argtypes (arguments checked on every call).
+
+    For a ctypes library the functions are new function pointers, so the prototypes
+    don't affect other users of `lib`. Other objects (e.g. a simulated library) are
+    used as they are.
+    """
+    key = (id(lib), strict)
+    if key in _functions:
+        return _functions[key]
+    table = {}
+    prototypes = {fname: ([c_int] + list(inputs) + ([_output_argtype(output)] if output is not None else []), c_int)
+                  for name, fname, inputs, output in SPEC}
+    prototypes.update(_HANDLE_FREE)
+    for fname, (argtypes, restype) in prototypes.items():
+        if isinstance(lib, ctypes.CDLL):
+            f = lib._FuncPtr((fname, lib))
+            if strict or _needs_conversion(argtypes):
+                f.argtypes = argtypes
+            f.restype = restype
+        else:
+            f = getattr(lib, fname)
+        table[fname] = f
+    _functions[key] = table
+    return table
+
+
+def _getter(name, fname, output):
+    """
+    Factory of getter `name` for a binding instance: (secondary) -> value.
+    """
+    if isinstance(output, Text):
+        strip = output.strip
+
+        def bind(b):
+            f, hdl, buf = b._f[fname], b.hdl, b._text
+
+            def method(secondary):
+                ret = f(hdl, secondary, buf)
+                if ret < 0:
+                    raise PDXCError(name, ret)
+                return buf.value.decode("utf-8", "ignore").replace(strip, "")
+            return method
+    else:
+        def bind(b):
+            f, hdl, ref, value = b._f[fname], b.hdl, b._refs[output], b._values[output]
+
+            def method(secondary):
+                ret = f(hdl, secondary, ref)
+                if ret < 0:
+                    raise PDXCError(name, ret)
+                return value.value
+            return method
+    return bind
+
+
+def _setter(name, fname, inputs):
+    """
+    Factory of setter `name` for a binding instance: (*args) -> None.
+    """
+    if c_char_p in inputs:
+        def bind(b):
+            f, hdl = b._f[fname], b.hdl
+
+            def method(*args):
+                ret = f(hdl, *(a.encode('utf-8') if isinstance(a, str) else a for a in args))
+                if ret < 0:
+                    raise PDXCError(name, ret)
+            return method
+    else:
+        def bind(b):
+            f, hdl = b._f[fname], b.hdl
+
+            def method(*args):
+                ret = f(hdl, *args)
+                if ret < 0:
+                    raise PDXCError(name, ret)
+            return method
+    return bind
+
+
+_METHODS = {name: _getter(name, fname, output) if output is not None else _setter(name, fname, inputs)
+            for name, fname, inputs, output in SPEC}
+
+
+class PDXCBinding:
+    """
+    Direct-return, prototyped access to one opened PDXC (one serial handle).
+
+    The methods of SPEC are created per instance, with the handle, the function and
+    the output buffer bound in advance.
+    """
+
+    def __init__(self, hdl, lib=None, strict=False):
+        """
+        Args:
+            hdl: handle returned by Open (pdxc.Open or PDXCBinding.open).
+            lib: the command library. Defaults to the one loaded by `pdxc`.
+            strict: declare argtypes for all functions (see `prototyped`).
+        """
+        self.hdl = hdl
+        self.lib = lib if lib is not None else load_library()
+        self._f = prototyped(self.lib, strict)
+        # Output buffers, reused by every call on this handle
+        self._text = ctypes.create_string_buffer(TEXT_SIZE)
+        self._values = {t: t(0) for t in (c_int, c_double, c_byte)}
+        self._refs = {t: ctypes.byref(v) for t, v in self._values.items()}
+        for name, bind in _METHODS.items():
+            method = bind(self)
+            method.__name__ = name
+            method.__doc__ = f"Same as pdxc.{name}, without the output list: returns the value, raises PDXCError on failure."
+            setattr(self, name, method)
+
+    @classmethod
+    def open(cls, serial, baud=115200, timeout=3, lib=None):
+        """
+        Open the device with serial number `serial` and return its binding.
+        """
+        lib = lib if lib is not None else load_library()
+        hdl = prototyped(lib)['Open'](serial.encode('utf-8'), baud, timeout)
+        if hdl < 0:
+            raise PDXCError('Open', hdl)
+        return cls(hdl, lib)
+
+    def close(self):
+        ret = self._f['Close'](self.hdl)
+        if ret < 0:
+            raise PDXCError('Close', ret)
+
+
+def load_library(path=LIBRARY_PATH):
+    """
+    The command library loaded by `pdxc` (loaded from `path` if it isn't yet).
+    """
+    if not pdxc.isLoad:
+        pdxc.load_library(path)
+    return pdxc.pdxcLib
@@ -1,80 +1,368 @@
 from lclib import register_driver, proxycall, proxydevice,ProxyDeviceError
 from lclib.base import SocketDriverBase
 from PDXC_COMMAND_LIB import *
+from PDXCAxes import Chain
+from PDXCBinding import PDXCBinding
+from PDXCConnect import open_controller
+from PDXCBatch import run_batch
+from PDXCTrigger import TriggeredScan
+from PDXCStatus import StatusCache
+from PDXCParams import ParameterCache
+from PDXCTelemetry import TelemetrySampler
+from callstats import instrument
+import os
+import time
+import tempfile
 ADDRESS = ('192.168.3.12',10001) #the IP of proxy Server which connects the controller
 @register_driver
 @proxydevice(address=ADDRESS) #register "pdxcdriver" to the global registry binding with ADDRESS IP
+@instrument  # server-side latency histograms of every proxycall (see call_stats)
 class PDXCDriver(SocketDriverBase): #driver_name=pdxcdriver
     """
     Socket driver example for a PDXC device.
     """
-    def __init__(self, device_address):
+    SETTLE_TOLERANCE = 1e-4  # position change (mm or °) below which a move is considered settled
+    MOVE_TIMEOUT = 10.       # maximum time (s) to wait for a move to settle
+    STATUS_TTL = 0.5         # time (s) during which status() is served from cache
+    TELEMETRY_RATE = 20.     # telemetry samples per second
+    TELEMETRY_SECONDS = 600. # telemetry history kept on the server (s)
+    TELEMETRY_PORT = 5560    # port on which telemetry batches are published
+    SERIAL = None            # serial number of the controller (None: the last one used, else the first found)
+    DISCOVERY_CACHE = os.path.join(tempfile.gettempdir(), 'pdxc_devices.json')  # serial -> port of the controllers seen
+    AXES = {'stage': (0, 0)} # axis name: (index in daisy chain (0:Single Mode or Main, 1 -11 : Secondary1 - Secondary11), channel)
+    def __init__(self, device_address, serial=None):
+        self.serial = serial or self.SERIAL
         self.init_device()
 
     def init_device(self):
         """
-        Device initialization.
+        Device initialization: open the controller (see PDXCConnect) and set up the axes.
         """
+        t0 = time.perf_counter()
         self.device = pdxc()
-        devs = pdxc.ListDevices()
-        print(devs)
-        if len(devs) <= 0:
-            print('There is no devices connected')
-            raise RuntimeError("device is not connected to the Server")
-        device_info = devs[0]
-        sn = device_info[0]
-        print("connect ", sn)
-        hdl = self.device.Open(sn, 115200, 3)
-        if hdl < 0:
-            print("open ", sn, " failed")
-            exit()
-        if self.device.IsOpen(sn) == 0:
-            print("pdxcIsOpen failed")
-            self.device.Close()
-            raise RuntimeError("device is not open")
-        result = self.device.SetDaisyChain(0)  # 0:Single Mode, 1:Main, 2 -12 : Secondary1 - Secondary11
-        if result < 0:
-            print("set daisy chain mode failed", result)
-        else:
-            print("set daisy chain mode: single mode")
+        hdl, self.connection = open_controller(pdxc.pdxcLib, self.serial, self.DISCOVERY_CACHE)
+        self.device.hdl = hdl
+        self.serial = self.connection['serial']  # keep the same controller on reconnect
+        print("connect ", self.serial, "(handle reused)" if self.connection['reused'] else "")
+        if not self.connection['reused']:
+            # 0:Single Mode, 1:Main, 2 -12 : Secondary1 - Secondary11
+            chained = any(secondary > 0 for secondary, channel in self.AXES.values())
+            result = self.device.SetDaisyChain(1 if chained else 0)
+            if result < 0:
+                print("set daisy chain mode failed", result)
+            else:
+                print(f"set daisy chain mode: {'main' if chained else 'single mode'}")
+        self.binding = PDXCBinding(self.device.hdl)  # prototyped, allocation-free calls on the same handle
+        self.chain = Chain(self.device, self.AXES, tolerance=self.SETTLE_TOLERANCE, timeout=self.MOVE_TIMEOUT,
+                           binding=self.binding, name=f'pdxc-{self.serial}')
+        self.status_cache = StatusCache(lambda secondary: self.chain.port.call(self.binding.GetCurrentStatus, secondary),
+                                        ttl=self.STATUS_TTL)
+        self.params = ParameterCache(self.binding, self.chain.port.call)  # new connection: nothing cached
+        self.telemetry_sampler = self._telemetry_sampler(self.TELEMETRY_RATE)  # started by telemetry_start
+        self.motion = self.chain.axis().motion  # default axis
+        self.scan = None
         self.initialized = True
+        self.connection['init_time'] = time.perf_counter() - t0
+    @proxycall(admin=True, block=False)
+    def move_forward(self, value, axis=None):
+        """ Open-loop move forward and wait until the stage has settled.
+        Args:
+            value: pulses of move channel:SMC[1,65535]; PD2/PD3[1,400000]
+            axis: name of the axis (see AXES), None for the first one
+        Returns:
+            the move record (measured duration, predicted duration, final position, ...) or None if the move failed.
+        """
+        if value <= 0:
+            raise ValueError(f'The number of pulses must be positive, got {value}.')
+        return self.chain.move(axis, value)
+
     @proxycall(admin=True, block=False)
-    def move_forward(self, value):
-
-        pul = value
-        result = self.device.SetOpenLoopMoveForward(0, pul, 0)  # move forward in open loop mode of channel 0;
-        # SMC[1,65535]; PD2/PD3[1,400000]
-        """ Set Open Loop Move Forward
-                Args:
-                    secondary: index in daisy chain (0:Single Mode or Main, 1 -11 : Secondary1 - Secondary11)
-                    pulses: pulses of move channel:SMC[1,65535]; PD2/PD3[1,400000]
-                    channel: Move fordward channel (0 : channel 1, 1 : channel 2, others :both channels)
-                Returns:
-                    0: Success; negative number: failed.
-        """
-        if result < 0:
-            print(f"set OpenLoopMoveForward {pul} failed", result)
-        else:
-            print(f"set OpenLoopMoveForward {pul}")
-        time.sleep(1)
+    def move_back(self, value, axis=None):
+        """ Open-loop move back and wait until the stage has settled.
+        Args:
+            value: pulses of move channel:SMC[1,65535]; PD2/PD3[1,400000]
+            axis: name of the axis (see AXES), None for the first one
+        Returns:
+            the move record (measured duration, predicted duration, final position, ...) or None if the move failed.
+        """
+        if value <= 0:
+            raise ValueError(f'The number of pulses must be positive, got {value}.')
+        return self.chain.move(axis, -value)
 
     @proxycall(admin=True, block=False)
-    def move_back(self,value):
-        pul = value
-        result = self.device.SetOpenLoopMoveBack(0, pul, 0)
-        """ Set Open Loop Move Forward
+    def move_axes(self, moves):
+        """ Move several axes at the same time and wait until all of them have settled.
+        Commands sharing the serial line are serialized, the settle waits overlap.
+        Args:
+            moves: {axis name: pulses}, negative pulses to move back
+        Returns:
+            {axis name: move record}
+        """
+        return self.chain.move_many(moves)
+
+    @proxycall()
+    @property
+    def axes(self):
+        """
+        {axis name: (secondary, channel)} of the axes managed by this driver.
+        """
+        return {name: (a.secondary, a.channel) for name, a in self.chain.axes.items()}
+
+    @proxycall()
+    @property
+    def connection_info(self):
+        """
+        How the controller was opened: {'serial', 'reused' (existing handle), 'listed' (ports enumerated),
+        'attempts', 'time' (open), 'init_time' (whole initialization)}.
+        """
+        return self.connection
+
+    @proxycall(admin=True)
+    def reconnect(self, serial=None):
+        """ Re-initialize the driver. The open handle is reused if the controller still answers.
         Args:
-            secondary: index in daisy chain (0:Single Mode or Main, 1 -11 : Secondary1 - Secondary11)
-            pulses: pulses of move channel:SMC[1,65535]; PD2/PD3[1,400000]
-            channel: Move fordward channel (0 : channel 1, 1 : channel 2, others :both channels)
+            serial: serial number of another controller to use instead (None: keep the current one)
         Returns:
-            0: Success; negative number: failed.
+            the connection info
+        """
+        self.telemetry_sampler.stop()
+        self.chain.close()
+        if serial is not None and serial != self.serial:
+            self.device.Close()
+            self.serial = serial
+        self.init_device()
+        return self.connection
+
+    def _read_position(self):
+        """
+        Current position of the default axis, or None if it can't be read (e.g. stage without encoder).
         """
-        if result < 0:
-            print(f"set OpenLoopMoveForward {pul} failed", result)
-        else:
-            print(f"set OpenLoopMoveForward {pul}")
-        time.sleep(1)
+        return self.chain.read_position(self.chain.axis().secondary)
+
+    @proxycall(admin=True, block=False)
+    def batch(self, commands, stop_on_error=True):
+        """ Run a sequence of commands in one call (see PDXCBatch).
+        Args:
+            commands: list of (name, args, kwargs), name being a driver method or a pdxc Get*/Set* method
+            stop_on_error: if True, stop at the first failing command
+        Returns:
+            list of {'name', 'result', 'error', 'time'}, one per executed command.
+        """
+        try:
+            return run_batch(self, commands, stop_on_error)
+        finally:
+            # The batch may have changed parameters
+            self.status_cache.invalidate()
+            self.params.invalidate()
+
+    @proxycall()
+    def status(self, axis=None, max_age=None):
+        """ Controller status of an axis, parsed from GetCurrentStatus (see PDXCStatus.Status).
+        Served from cache if not older than max_age (default: status_ttl) seconds.
+        Args:
+            axis: name of the axis (see AXES), None for the first one
+            max_age: maximum age (s) of the returned status, 0 to force a new reading
+        Returns:
+            Status (error, kp, ki, kd, loop, velocity, step_size, speed, jog_step, home, abnormal_detection, ...)
+        """
+        return self.status_cache.get(self.chain.axis(axis).secondary, max_age)
+
+    @proxycall()
+    def get_parameter(self, name, axis=None, refresh=False):
+        """ Value of a configuration parameter (see PDXCParams.PARAMETERS), from the cache if known.
+        Args:
+            name: parameter name, e.g. 'kp', 'open_loop_frequency3', 'position_limit'
+            axis: name of the axis (see AXES), None for the first one
+            refresh: if True, read the controller even if the value is cached
+        """
+        return self.params.get(name, self.chain.axis(axis).secondary, refresh)
+
+    @proxycall(admin=True)
+    def set_parameter(self, name, value, axis=None, force=False):
+        """ Write a configuration parameter, unless it already has this value.
+        Returns:
+            True if the value was written.
+        """
+        return self.params.set(name, value, self.chain.axis(axis).secondary, force)
+
+    @proxycall(admin=True)
+    def apply_profile(self, profile, axis=None):
+        """ Write the parameters of profile ({name: value}) that differ from the controller state.
+        Returns:
+            {'written': [names], 'skipped': [names], 'time': s}
+        """
+        return self.params.apply(profile, self.chain.axis(axis).secondary)
+
+    @proxycall()
+    def read_profile(self, axis=None, names=None, refresh=False):
+        """ {name: value} of the configuration parameters of an axis (all of them if names is None).
+        """
+        return self.params.read_profile(self.chain.axis(axis).secondary, names, refresh)
+
+    @proxycall(admin=True)
+    def save_profile(self, path, axis=None):
+        """ Save the configuration parameters of an axis to the JSON file path (on the server).
+        """
+        return self.params.save(path, self.chain.axis(axis).secondary)
+
+    @proxycall(admin=True)
+    def load_profile(self, path, axis=None):
+        """ Apply the profile saved in the JSON file path (on the server). See apply_profile.
+        """
+        return self.params.load(path, self.chain.axis(axis).secondary)
+
+    @proxycall(admin=True)
+    def save_customer_data(self, save=1, axis=None):
+        """ Save (1) or erase (0) the user data in the controller (SetAllCustomerData).
+        The parameter and status caches of the axis are invalidated.
+        """
+        secondary = self.chain.axis(axis).secondary
+        try:
+            self.chain.port.call(self.binding.SetAllCustomerData, secondary, save)
+        finally:
+            self.params.invalidate(secondary)
+            self.status_cache.invalidate(secondary)
+
+    def _telemetry_sampler(self, rate):
+        return TelemetrySampler({name: a.secondary for name, a in self.chain.axes.items()},
+                                self.chain.read_position, self.chain.read_error,
+                                rate=rate, seconds=self.TELEMETRY_SECONDS, port=self.TELEMETRY_PORT,
+                                name=f'pdxc-{self.serial}-telemetry')
+
+    @proxycall(admin=True)
+    def telemetry_start(self, rate=None):
+        """ Start sampling the position and error code of all axes, and publishing them on TELEMETRY_PORT
+        (see PDXCTelemetry.TelemetrySubscriber).
+        Args:
+            rate: samples per second (default: TELEMETRY_RATE). Changing the rate clears the history.
+        """
+        if rate is not None and rate != self.telemetry_sampler.rate:
+            self.telemetry_sampler.stop()
+            self.telemetry_sampler = self._telemetry_sampler(rate)
+        self.telemetry_sampler.start()
+        return self.telemetry_sampler.info()
+
+    @proxycall(admin=True)
+    def telemetry_stop(self):
+        """
+        Stop sampling. The history is kept.
+        """
+        self.telemetry_sampler.stop()
+
+    @proxycall()
+    def telemetry(self, seconds=10.):
+        """ Telemetry history of the last seconds.
+        Returns:
+            {'columns': ['time', '<axis>.position', '<axis>.error', ...], 'data': array (one row per sample)}
+        """
+        return self.telemetry_sampler.last(seconds)
+
+    @proxycall()
+    def telemetry_info(self):
+        """
+        Sampling rate, port, number of samples, overruns and sampling jitter of the telemetry.
+        """
+        return self.telemetry_sampler.info()
+
+    @proxycall(admin=True)
+    @property
+    def status_ttl(self):
+        """
+        Time (s) during which status() is served from cache.
+        """
+        return self.status_cache.ttl
+
+    @status_ttl.setter
+    def status_ttl(self, value):
+        self.status_cache.ttl = float(value)
+
+    @proxycall(admin=True, block=False)
+    def start_triggered_scan(self, step, n_steps, rising=True):
+        """ Arm the fixed-step external trigger mode: the stage moves by `step` on each trigger edge,
+        without any call to the server. Call finish_triggered_scan once the triggers have been sent.
+        Args:
+            step: step size in PDX1/PDX2/PDXZ1(mm)/PDXR(°) unit, negative to step back
+            n_steps: number of triggers that will be sent
+            rising: trigger on rising (True) or falling (False) edges
+        Returns:
+            the start position.
+        """
+        if self.scan is not None:
+            raise RuntimeError('A triggered scan is already armed.')
+        scan = TriggeredScan(self._read_position,
+                             lambda mode: self.chain.call('SetCurrentStatusInExternalTrigger', self.chain.axis().secondary, mode),
+                             step, n_steps, rising=rising)
+        scan.start()
+        self.scan = scan
+        print(f"external trigger mode {scan.mode}, {n_steps} steps")
+        return scan.start_position
+
+    @proxycall(admin=True, block=False)
+    def finish_triggered_scan(self, timeout=10.):
+        """ Wait for the triggered steps (up to timeout s), go back to manual mode and check the final position.
+        Returns:
+            report with the number of steps detected, the achieved step rate (steps/s) and the
+            final position error (read with GetCurrentPosition).
+        """
+        if self.scan is None:
+            raise RuntimeError('No triggered scan armed.')
+        scan, self.scan = self.scan, None
+        report = scan.finish(timeout)
+        if not report['position_ok']:
+            print(f"triggered scan ended at {report['final_position']}, expected {report['expected_position']}")
+        return report
+
+    @proxycall(interrupt=True)
+    def abort(self):
+        """
+        Stop waiting for the current moves. An armed triggered scan is cancelled:
+        the controller goes back to manual mode ("ML").
+        """
+        self.chain.abort()
+        scan, self.scan = self.scan, None
+        if scan is not None:
+            scan.abort()
+
+    @proxycall()
+    def move_stats(self, axis=None):
+        """
+        Statistics of the measured move times of an axis (the default one if None).
+        """
+        return self.chain.axis(axis).motion.stats()
+
+    @proxycall()
+    def move_records(self, n=None, axis=None):
+        """
+        The last n move records of an axis (all of them if n is None).
+        """
+        records = list(self.chain.axis(axis).motion.records)
+        return records if n is None else records[-n:]
+
+    @proxycall(admin=True)
+    @property
+    def settle_tolerance(self):
+        """
+        Position change below which the stage is considered settled.
+        """
+        return self.motion.tolerance
+
+    @settle_tolerance.setter
+    def settle_tolerance(self, value):
+        for a in self.chain.axes.values():
+            a.motion.tolerance = float(value)
+
+    @proxycall(admin=True)
+    @property
+    def move_timeout(self):
+        """
+        Maximum time (s) spent waiting for a single move to settle.
+        """
+        return self.motion.timeout
+
+    @move_timeout.setter
+    def move_timeout(self, value):
+        for a in self.chain.axes.values():
+            a.motion.timeout = float(value)
 
 try:
     c = PDXCDriver.Client()# this script is used to start a client and connect to the registered driver(server)
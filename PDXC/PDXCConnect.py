@@ -0,0 +1,156 @@
+"""
+Fast connection to a PDXC controller: cached discovery, handle reuse, selection by serial.
+
+A cold start used to enumerate the ports (`List`, slow), open the first
+controller found and configure it. `open_controller` instead
+
+1. picks the serial number: the requested one, else the last one used
+   (discovery cache), else the first one found;
+2. reuses the handle of that serial if the library still has it open
+   (`GetHandle` / `IsOpen`, e.g. driver re-initialized in the same process)
+   and it answers a command;
+3. otherwise opens the serial directly, without enumerating the ports;
+4. only enumerates when the serial is unknown or can't be opened, and then
+   updates the cache. Opening is retried a few times, as the port may still
+   be held for a moment by a server that was just stopped.
+
+The cache is a small JSON file {serial: {'port': 'COM3', 'seen': time}}.
+"""
+import json
+import time
+import ctypes
+
+from PDXCBinding import prototyped
+
+LIST_SIZE = 10240
+
+
+class DiscoveryCache:
+    """
+    serial -> port of the controllers seen, stored as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.devices = {}
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def last(self):
+        """
+        Serial number of the controller opened most recently, or None if none was ever opened.
+        """
+        opened = [(d['opened'], serial) for serial, d in self.devices.items() if d.get('opened', 0) > 0]
+        return max(opened)[1] if opened else None
+
+    def update(self, devices):
+        """
+        Replace the known controllers by `devices` [(serial, port)].
+        """
+        now = time.time()
+        self.devices = {serial: {'port': port, 'seen': now, 'opened': self.devices.get(serial, {}).get('opened', 0)}
+                        for serial, port in devices}
+        self.save()
+
+    def opened(self, serial):
+        self.devices.setdefault(serial, {'port': None, 'seen': time.time()})['opened'] = time.time()
+        self.save()
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.devices, f, indent=2)
+        except OSError as error:
+            print(f'Could not save the discovery cache {self.path}: {error}')
+
+
+def list_devices(lib):
+    """
+    [(serial, port)] of the connected controllers (same as pdxc.ListDevices).
+    """
+    buf = ctypes.create_string_buffer(LIST_SIZE)
+    prototyped(lib)['List'](buf, LIST_SIZE)
+    items = buf.value.decode('utf-8', 'ignore').rstrip('\x00').split(',')
+    return [(serial, port) for serial, port in zip(items[::2], items[1::2]) if serial]
+
+
+def _alive(lib, hdl):
+    """
+    True if the controller behind `hdl` answers.
+    """
+    error = ctypes.c_int(0)
+    return prototyped(lib)['Get_ErrorMessage'](hdl, 0, ctypes.byref(error)) >= 0
+
+
+def open_controller(lib, serial=None, cache_path=None, baud=115200, timeout=3, retries=3, retry_delay=0.3):
+    """
+    Open (or reuse) the controller `serial` (see module doc).
+
+    Args:
+        lib: the command library (e.g. pdxc.pdxcLib).
+        serial: serial number to open. None for the last one used if it is connected, else the first one found.
+        cache_path: discovery cache file. None to always enumerate.
+        baud, timeout: passed to Open.
+        retries: number of Open attempts after an enumeration.
+        retry_delay: pause (s) between attempts.
+
+    Returns:
+        (handle, info), info being {'serial', 'reused', 'listed', 'attempts', 'time'}.
+
+    Raises:
+        RuntimeError if no controller (or not the requested one) can be opened.
+    """
+    t0 = time.perf_counter()
+    f = prototyped(lib)
+    cache = DiscoveryCache(cache_path) if cache_path else None
+    info = {'serial': None, 'reused': False, 'listed': False, 'attempts': 0}
+
+    def done(hdl, serial):
+        if cache is not None:
+            cache.opened(serial)
+        info['serial'] = serial
+        info['time'] = time.perf_counter() - t0
+        return hdl, info
+
+    def try_open(serial):
+        info['attempts'] += 1
+        return f['Open'](serial.encode('utf-8'), baud, timeout)
+
+    candidate = serial or (cache.last if cache is not None else None)
+    if candidate is not None:
+        hdl = f['GetHandle'](candidate.encode('utf-8'))
+        if hdl >= 0 and f['IsOpen'](candidate.encode('utf-8')) == 1:
+            if _alive(lib, hdl):
+                info['reused'] = True
+                return done(hdl, candidate)
+            f['Close'](hdl)  # stale handle: reopen
+        hdl = try_open(candidate)
+        if hdl >= 0:
+            return done(hdl, candidate)
+
+    # Unknown serial, or it can't be opened (unplugged, other port, port still busy): enumerate
+    devices = list_devices(lib)
+    info['listed'] = True
+    if cache is not None:
+        cache.update(devices)
+    serials = [s for s, port in devices]
+    if serial is None:
+        if not serials:
+            raise RuntimeError('There is no PDXC controller connected.')
+        # The last one used, if still connected (e.g. its port is not released yet): never
+        # silently switch to another controller
+        candidate = candidate if candidate in serials else serials[0]
+    elif serial not in serials:
+        raise RuntimeError(f'PDXC {serial} is not connected (found: {serials}).')
+    else:
+        candidate = serial
+    for attempt in range(retries):
+        hdl = try_open(candidate)
+        if hdl >= 0:
+            return done(hdl, candidate)
+        time.sleep(retry_delay)
+    raise RuntimeError(f'Failed to open PDXC {candidate} (Open returned {hdl}).')
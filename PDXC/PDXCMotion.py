@@ -0,0 +1,158 @@
+"""
+Move completion for PDXC open-loop moves.
+
+`SetOpenLoopMoveForward` / `SetOpenLoopMoveBack` return as soon as the command
+has been accepted by the controller, long before the stage has stopped. Instead
+of sleeping a fixed time after each move, `MoveCompletion` waits for the stage
+to settle:
+
+* if the open-loop frequency is known, the move duration is predicted from
+  the number of pulses and most of it is slept through in one go;
+* the position is then polled with an adaptive backoff (short intervals while
+  the stage moves, growing intervals once it is quiet) until it has stayed
+  within `tolerance` for `settle_count` consecutive reads;
+* stages without an encoder (position read fails) fall back to the predicted
+  duration, or to `fallback_delay` if nothing better is known.
+
+Every call is recorded so that the measured move times can be inspected.
+"""
+import time
+import threading
+from collections import deque
+
+
+class MoveCompletion:
+    """
+    Wait for the end of an open-loop move and record how long it took.
+    """
+
+    def __init__(self, read_position, frequency=None, tolerance=1e-4, settle_count=2,
+                 min_poll=0.002, max_poll=0.05, backoff=1.5, timeout=10., fallback_delay=1.,
+                 history=1000):
+        """
+        Args:
+            read_position: callable returning the current position, or None if it can't be read.
+            frequency: open-loop pulse frequency (Hz) used to predict move durations. None if unknown.
+            tolerance: position change below which the stage is considered still (mm or °).
+            settle_count: number of consecutive still reads required to declare the move done.
+            min_poll, max_poll: bounds of the polling interval (s).
+            backoff: growth factor of the polling interval while the stage is still.
+            timeout: maximum time (s) spent waiting for a single move.
+            fallback_delay: time (s) to wait when the position can't be read and no prediction exists.
+            history: number of move records kept.
+        """
+        self.read_position = read_position
+        self.frequency = frequency
+        self.tolerance = tolerance
+        self.settle_count = settle_count
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.backoff = backoff
+        self.timeout = timeout
+        self.fallback_delay = fallback_delay
+        self.records = deque(maxlen=history)
+        self._abort = threading.Event()
+
+    def predict(self, pulses):
+        """
+        Predicted duration (s) of a move of `pulses` pulses, or None if the frequency is unknown.
+        """
+        if not self.frequency or self.frequency <= 0:
+            return None
+        return abs(pulses) / self.frequency
+
+    def abort(self):
+        """
+        Interrupt the current wait.
+        """
+        self._abort.set()
+
+    def reset(self):
+        """
+        Clear a previous abort. Called before the move command is sent, so that an abort
+        arriving while the command is sent still interrupts the wait.
+        """
+        self._abort.clear()
+
+    def wait(self, pulses, t0, start_position=None):
+        """
+        Block until the move started at time `t0` has settled.
+
+        Args:
+            pulses: number of pulses sent with the move command.
+            t0: time.perf_counter() value taken just before the move command.
+            start_position: position before the move (None if unknown).
+
+        Returns:
+            The move record (dict) with the measured duration.
+        """
+        predicted = self.predict(pulses)
+        deadline = t0 + self.timeout
+
+        # Sleep through most of the predicted motion
+        if predicted:
+            self._abort.wait(max(0., t0 + .8 * predicted - time.perf_counter()))
+
+        position = self.read_position()
+        if position is None:
+            # No encoder: the prediction is all we have
+            delay = predicted if predicted is not None else self.fallback_delay
+            self._abort.wait(max(0., t0 + delay - time.perf_counter()))
+            return self._record(pulses, t0, predicted, None, settled=not self._abort.is_set(), polls=1)
+
+        polls = 1
+        still = 0
+        interval = self.min_poll
+        settled = False
+        moved = start_position is None or abs(position - start_position) > self.tolerance
+        while not self._abort.is_set():
+            now = time.perf_counter()
+            if now > deadline:
+                print(f'Move of {pulses} pulses did not settle within {self.timeout} s')
+                break
+            self._abort.wait(interval)
+            new_position = self.read_position()
+            polls += 1
+            if new_position is None:
+                break
+            if abs(new_position - position) <= self.tolerance:
+                # A stage that has not started yet is not settled, unless the prediction says it should be done
+                if moved or (predicted is not None and now - t0 >= predicted):
+                    still += 1
+                interval = min(interval * self.backoff, self.max_poll)
+            else:
+                moved = True
+                still = 0
+                interval = self.min_poll
+            position = new_position
+            if still >= self.settle_count:
+                settled = True
+                break
+        return self._record(pulses, t0, predicted, position, settled=settled, polls=polls)
+
+    def _record(self, pulses, t0, predicted, position, settled, polls):
+        """
+        Store and return the record of a move.
+        """
+        record = {'pulses': pulses,
+                  'duration': time.perf_counter() - t0,
+                  'predicted': predicted,
+                  'position': position,
+                  'settled': settled,
+                  'polls': polls}
+        self.records.append(record)
+        return record
+
+    def stats(self):
+        """
+        Summary of the recorded move times.
+        """
+        durations = [r['duration'] for r in self.records]
+        if not durations:
+            return {'moves': 0}
+        return {'moves': len(durations),
+                'mean_duration': sum(durations) / len(durations),
+                'min_duration': min(durations),
+                'max_duration': max(durations),
+                'last_duration': durations[-1],
+                'unsettled': sum(1 for r in self.records if not r['settled'])}
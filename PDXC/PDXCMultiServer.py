@@ -0,0 +1,205 @@
+"""
+One server process for every PDXC controller connected to the host.
+
+PDXCServer.py serves one controller on one address. This script lists the
+controllers once (shared discovery, which also fills the discovery cache) and
+serves each of them as a separate device on its own port, so that adding a
+stage does not need another process:
+
+    python PDXCMultiServer.py                          # every controller found, ports 10001, 10002, ...
+    python PDXCMultiServer.py --serial 112233 445566   # only these ones
+
+Each controller has its own driver instance (PDXCDriver subclass with SERIAL
+set), hence its own handle, handle thread ('pdxc-<serial>'), caches, admin
+and telemetry port. Ports are given by PORTS (serial: port) so that the
+address of a stage does not depend on which other controllers are plugged in;
+the other controllers get BASE_PORT, BASE_PORT + 1, ... in serial order.
+
+Shared between the devices:
+
+* discovery: one `List` at startup instead of one per controller;
+* logging: print output of a device goes to that device's admin client, and
+  is shown locally prefixed with its serial number;
+* metrics: every device has its own call_stats (clients see only theirs),
+  `MultiServer.report()` / --stats-path gathers them with the connection info.
+
+Clients connect to a controller with its address:
+
+    from PDXCServer import PDXCDriver
+    stage = PDXCDriver.Client(address=('192.168.3.69', 10002))
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+import builtins
+
+from PDXC_COMMAND_LIB import pdxc
+from PDXCServer import PDXCDriver
+from PDXCConnect import DiscoveryCache, list_devices
+from callstats import CallStats, instrumented_server
+
+HOST = '192.168.3.69'        # IP of this host, seen by the clients
+BASE_PORT = 10001            # first port given to the controllers not in PORTS
+PORTS = {}                   # serial number: fixed port
+TELEMETRY_BASE_PORT = 5560   # telemetry ports: TELEMETRY_BASE_PORT, + 1, ... for the served controllers in serial order
+
+
+class MultiServer:
+    """
+    One instrumented PDXCDriver server per controller.
+    """
+
+    def __init__(self, serials=None, host=HOST, base_port=BASE_PORT, ports=None):
+        """
+        Args:
+            serials: serial numbers to serve. None for every controller found.
+            host: IP of this host.
+            base_port: first port of the controllers not in `ports`.
+            ports: {serial: port}, default PORTS.
+        """
+        self.host = host
+        self.lock = threading.Lock()
+        pdxc()  # load the command library
+        t0 = time.perf_counter()
+        self.devices = list_devices(pdxc.pdxcLib)
+        DiscoveryCache(PDXCDriver.DISCOVERY_CACHE).update(self.devices)
+        print(f"found {len(self.devices)} controller(s) in {time.perf_counter() - t0:.2f} s: {self.devices}")
+        found = [serial for serial, port in self.devices]
+        if serials is None:
+            serials = sorted(found)
+        missing = [serial for serial in serials if serial not in found]
+        if missing:
+            print(f"not connected: {missing}")
+        self.ports = self.assign_ports([serial for serial in serials if serial in found], base_port,
+                                       PORTS if ports is None else ports)
+        # By index, not from the RPC port: fixed ports may be anywhere
+        self.telemetry_ports = {serial: TELEMETRY_BASE_PORT + i for i, serial in enumerate(sorted(self.ports))}
+
+        self.servers = {}
+        self.errors = {}
+        for serial, port in self.ports.items():
+            try:
+                self.servers[serial] = self.serve(serial, port, self.telemetry_ports[serial])
+                print(f"serving {serial} on {host}:{port} (telemetry {self.telemetry_ports[serial]})")
+            except Exception as error:
+                # one faulty controller does not take the others down
+                self.errors[serial] = repr(error)
+                print(f"failed to serve {serial}: {error}")
+        self.route_print()
+
+    @staticmethod
+    def assign_ports(serials, base_port, ports):
+        """
+        {serial: port}: the fixed ports, then the next free ones from base_port.
+        """
+        assigned = {serial: ports[serial] for serial in serials if serial in ports}
+        port = base_port
+        for serial in serials:
+            if serial in assigned:
+                continue
+            while port in assigned.values():
+                port += 1
+            assigned[serial] = port
+            port += 1
+        return assigned
+
+    def serve(self, serial, port, telemetry_port):
+        """
+        Start the server of one controller.
+        """
+        driver = type(PDXCDriver.__name__, (PDXCDriver,), {
+            '__module__': PDXCDriver.__module__,  # servers redirect print in the driver modules only
+            'SERIAL': serial,
+            'TELEMETRY_PORT': telemetry_port,
+            'callstats': CallStats(f'{PDXCDriver.__name__} {serial}'),
+        })
+        return instrumented_server(driver)(address=(self.host, port))
+
+    def route_print(self):
+        """
+        Send the print output of the drivers to the server of the calling client.
+
+        Every server redirects `print` of the driver modules to its own clients
+        when it starts, so the last one started would otherwise get all of it.
+        """
+        if not self.servers:
+            return
+        modules = {sys.modules[c.__module__] for c in PDXCDriver.__mro__ if c.__module__ != 'builtins'}
+        for module in modules:
+            module.print = self._print
+
+    def _print(self, *objects, **kwargs):
+        thread = threading.get_ident()
+        for serial, server in self.servers.items():
+            if thread in server.clients:
+                server._proxy_print(f'[{serial}]', *objects, **kwargs)
+                return
+        # handle threads and non-blocking calls: local output only
+        builtins.print(*objects, **kwargs)
+
+    def addresses(self):
+        """
+        {serial: (host, port)} of the served controllers.
+        """
+        return {serial: (self.host, self.ports[serial]) for serial in self.servers}
+
+    def report(self):
+        """
+        Address, connection info, clients and call statistics of every controller.
+        """
+        report = {}
+        for serial, server in self.servers.items():
+            instance = server.instance
+            report[serial] = {'address': (self.host, self.ports[serial]),
+                              'connection': dict(instance.connection),
+                              'clients': len(server.clients),
+                              'handle': {'calls': instance.chain.port.calls,
+                                         'busy_time': instance.chain.port.busy_time},
+                              'calls': instance.callstats.report()}
+        for serial, error in self.errors.items():
+            report[serial] = {'address': (self.host, self.ports[serial]), 'error': error}
+        return report
+
+    def dump(self, path):
+        """
+        Write report() as JSON.
+        """
+        with self.lock:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2, default=str)
+
+    def wait(self, stats_path=None, interval=60.):
+        """
+        Block while any server runs, writing the report to stats_path every interval seconds.
+        """
+        while True:
+            alive = [server for server in self.servers.values() if server.serving_thread.is_alive()]
+            if not alive:
+                break
+            if stats_path:
+                self.dump(stats_path)
+            alive[0].serving_thread.join(interval)
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve every connected PDXC controller from one process.')
+    parser.add_argument('--serial', nargs='+', default=None, help='serial numbers to serve (default: all)')
+    parser.add_argument('--host', default=HOST, help='IP of this host')
+    parser.add_argument('--base-port', type=int, default=BASE_PORT, help='first port')
+    parser.add_argument('--stats-path', default=None, help='write the per-controller statistics to this JSON file')
+    parser.add_argument('--stats-interval', type=float, default=60., help='time (s) between two statistics writes')
+    args = parser.parse_args()
+    try:
+        s = MultiServer(args.serial, args.host, args.base_port)
+        if not s.servers:
+            sys.exit(1)
+        s.wait(args.stats_path, args.stats_interval)
+        sys.exit(0)
+    except Exception as e:
+        print(f"an error occur :{e}")
@@ -0,0 +1,197 @@
+"""
+Write-through cache of the PDXC configuration parameters.
+
+Every Get/Set of a parameter is a serial transaction. `ParameterCache` keeps
+the last value read or written for each (secondary, parameter):
+
+* `set` skips the write when the cached value is already the requested one,
+* `apply(profile)` writes only the parameters of the profile that differ from
+  the cache (parameters never seen are written, which costs the same as
+  reading them first),
+* `read_profile` / `save` / `load` capture a configuration and restore it.
+
+The cache mirrors the controller only as long as nothing else changes it:
+invalidate it after a reconnection, after `SetAllCustomerData` (erasing the
+user data resets the parameters) and after raw library calls.
+"""
+import json
+import math
+import time
+import threading
+
+# name: (getter, setter) of PDXCBinding
+PARAMETERS = {
+    'kp': ('GetKpOfPidParameters', 'SetKpOfPidParameters'),
+    'ki': ('GetKiOfPidParameters', 'SetKiOfPidParameters'),
+    'kd': ('GetKdOfPidParameters', 'SetKdOfPidParameters'),
+    'loop': ('GetLoopStatus', 'SetLoop'),
+    'open_loop_frequency': ('GetOpenLoopFrequency', 'SetOpenLoopFrequency'),
+    'open_loop_frequency2': ('GetOpenLoopFrequency2', 'SetOpenLoopFrequency2'),
+    'open_loop_frequency3': ('GetOpenLoopFrequency3', 'SetOpenLoopFrequency3'),
+    'jog_size': ('GetOpenLoopJogSize', 'SetOpenLoopJogSize'),
+    'jog_size2': ('GetOpenLoopJogSize2', 'SetOpenLoopJogSize2'),
+    'jog_size3': ('GetOpenLoopJogSize3', 'SetOpenLoopJogSize3'),
+    'forward_amplitude': ('GetForwardAmplitude', 'SetForwardAmplitude'),
+    'backward_amplitude': ('GetBackwardAmplitude', 'SetBackwardAmplitude'),
+    'abnormal_move_detect': ('GetAbnormalMoveDetect', 'SetAbnormalMoveDetect'),
+    'analog_input_gain': ('GetAnalogInputGain', 'SetAnalogInputGain'),
+    'analog_input_offset': ('GetAnalogInputOffSet', 'SetAnalogInputOffSet'),
+    'analog_out_gain': ('GetAnalogOutGain', 'SetAnalogOutGain'),
+    'analog_out_offset': ('GetAnalogOutOffSet', 'SetAnalogOutOffSet'),
+    'position_limit': ('GetPositionLimit', 'SetPositionLimit'),   # (min, max)
+    'init_position': ('GetInitPosition', 'SetInitPosition'),
+}
+
+
+def _parse_limit(text):
+    """
+    (min, max) from the GetPositionLimit answer, or None if it can't be parsed.
+    """
+    numbers = []
+    for token in text.replace(',', ' ').replace(':', ' ').split():
+        try:
+            numbers.append(float(token))
+        except ValueError:
+            pass
+    return tuple(numbers[-2:]) if len(numbers) >= 2 else None
+
+
+def _same(a, b):
+    """
+    True if the cached value a equals the requested value b.
+    """
+    if a is None:
+        return False
+    if isinstance(a, (tuple, list)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+
+class ParameterCache:
+    """
+    Cache of the parameters of all secondaries reached through one handle.
+    """
+
+    def __init__(self, binding, call=None):
+        """
+        Args:
+            binding: PDXCBinding of the handle.
+            call: callable (fn, *args) used to run the library calls, e.g.
+                HandleScheduler.call to serialize them. Defaults to calling directly.
+        """
+        self.binding = binding
+        self.call = call or (lambda fn, *args: fn(*args))
+        self.values = {}
+        self.lock = threading.Lock()
+        self.counts = {'reads': 0, 'writes': 0, 'skipped': 0}
+
+    @staticmethod
+    def _check(name):
+        if name not in PARAMETERS:
+            raise ValueError(f'Unknown parameter {name}. Parameters are {list(PARAMETERS)}.')
+
+    def _read(self, name, secondary):
+        value = self.call(getattr(self.binding, PARAMETERS[name][0]), secondary)
+        if name == 'position_limit':
+            value = _parse_limit(value)
+        self.counts['reads'] += 1
+        return value
+
+    def get(self, name, secondary=0, refresh=False):
+        """
+        Value of parameter `name`, read from the controller if not cached (or if refresh).
+        """
+        self._check(name)
+        key = (secondary, name)
+        with self.lock:
+            if not refresh and self.values.get(key) is not None:
+                return self.values[key]
+        value = self._read(name, secondary)
+        with self.lock:
+            self.values[key] = value
+        return value
+
+    def set(self, name, value, secondary=0, force=False):
+        """
+        Write parameter `name`, unless the cached value is already `value` (and not force).
+
+        Returns:
+            True if the value was written.
+        """
+        self._check(name)
+        key = (secondary, name)
+        if name == 'position_limit':
+            value = tuple(value)
+        with self.lock:
+            if not force and _same(self.values.get(key), value):
+                self.counts['skipped'] += 1
+                return False
+            # Unknown until the write succeeds
+            self.values.pop(key, None)
+        setter = getattr(self.binding, PARAMETERS[name][1])
+        if name == 'position_limit':
+            self.call(setter, secondary, *value)
+        else:
+            self.call(setter, secondary, value)
+        self.counts['writes'] += 1
+        with self.lock:
+            self.values[key] = value
+        return True
+
+    def apply(self, profile, secondary=0):
+        """
+        Write the parameters of `profile` ({name: value}) that differ from the cache.
+
+        Returns:
+            {'written': [names], 'skipped': [names], 'time': s}
+        """
+        for name in profile:
+            self._check(name)
+        t0 = time.perf_counter()
+        written, skipped = [], []
+        for name, value in profile.items():
+            (written if self.set(name, value, secondary) else skipped).append(name)
+        return {'written': written, 'skipped': skipped, 'time': time.perf_counter() - t0}
+
+    def read_profile(self, secondary=0, names=None, refresh=False):
+        """
+        {name: value} of the parameters `names` (all of them if None).
+        Parameters the stage does not support (read fails) are left out.
+        """
+        profile = {}
+        for name in names or PARAMETERS:
+            try:
+                value = self.get(name, secondary, refresh)
+            except RuntimeError:
+                continue
+            if value is not None:
+                profile[name] = value
+        return profile
+
+    def save(self, path, secondary=0, names=None):
+        """
+        Save the profile of `secondary` as JSON. Returns the profile.
+        """
+        profile = self.read_profile(secondary, names)
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2)
+        return profile
+
+    def load(self, path, secondary=0):
+        """
+        Apply the profile saved in `path` (see apply).
+        """
+        with open(path) as f:
+            profile = json.load(f)
+        return self.apply(profile, secondary)
+
+    def invalidate(self, secondary=None):
+        """
+        Forget the cached values of `secondary` (of all secondaries if None).
+        """
+        with self.lock:
+            if secondary is None:
+                self.values.clear()
+            else:
+                for key in [k for k in self.values if k[0] == secondary]:
+                    del self.values[key]
@@ -0,0 +1,430 @@
+"""
+Simulated PDXC command library, for running the driver without a controller.
+
+`SimulatedLibrary` has the entry points of PDXC_COMMAND_LIB_win64.dll (List,
+Open, Get_*, Set_*, ...) with the same calling convention: ctypes or Python
+arguments, outputs written through `byref()` and string buffers, 0 or a
+negative code returned. Both `pdxc` and `PDXCBinding` run unchanged on it.
+
+It models what matters for timing:
+
+* every command holds the serial line of its handle for
+  `overhead + bytes * 10 / baud` seconds (commands on one handle never
+  overlap, as on the real line), `List` and `Open` take longer;
+* open-loop moves last pulses / open-loop frequency, each pulse moving the
+  stage by `pulse_size` scaled by the forward/backward amplitude (%), with an
+  optional relative jitter; closed-loop moves run at the target speed;
+* the position is interpolated in time, so it can be polled during a move,
+  moves are clipped to the position limits;
+* fixed-step external trigger mode ("FR/FF[step]") moves one step per edge
+  sent with `trigger`.
+
+Set the environment variable PDXC_SIMULATOR before `pdxc` loads its library
+to use it, optionally with options:
+
+    PDXC_SIMULATOR=1 python PDXCServer.py
+    PDXC_SIMULATOR="secondaries=2,overhead=0.002,seed=1" python PDXCServer.py
+
+or pass an instance to `PDXCBinding(hdl, lib=...)` / set `pdxc.pdxcLib` directly.
+"""
+import os
+import ast
+import time
+import random
+import threading
+import ctypes
+
+from PDXCBinding import SPEC
+
+# Parameters stored as they are written, with their value after an erase (SetAllCustomerData(0))
+DEFAULTS = {
+    'KpOfPidParameters': 0.5,
+    'KiOfPidParameters': 0.01,
+    'KdOfPidParameters': 0.,
+    'Loop': 0,
+    'OpenLoopFrequency': 1000,
+    'OpenLoopFrequency2': 1000,
+    'OpenLoopFrequency3': 1000,
+    'OpenLoopJogSize': 100,
+    'OpenLoopJogSize2': 100,
+    'OpenLoopJogSize3': 100,
+    'ForwardAmplitude': 100,
+    'BackwardAmplitude': 100,
+    'AbnormalMoveDetect': 1,
+    'Disabled': 0,
+    'TargetSpeed': 5,
+    'AnalogInputGain': 1.,
+    'AnalogInputOffSet': 0.,
+    'AnalogOutGain': 1.,
+    'AnalogOutOffSet': 0.,
+    'InitPosition': 0,
+    'JoystickStatus': 0,
+}
+
+# Getter names that read another parameter than their own
+ALIASES = {'LoopStatus': 'Loop'}
+
+# Error codes of Get_ErrorMessage
+OUT_OF_RANGE = 2
+WRONG_MODE = 6
+
+
+def _in(arg):
+    """
+    Python value of an input argument (int, float, bytes or ctypes object).
+    """
+    value = getattr(arg, 'value', arg)
+    return value.decode('utf-8', 'ignore') if isinstance(value, bytes) else value
+
+
+def _out(ref, value):
+    """
+    Write `value` to an output argument (byref(), pointer or string buffer).
+    """
+    obj = getattr(ref, '_obj', ref)
+    if isinstance(obj, ctypes._Pointer):
+        obj = obj.contents
+    if isinstance(obj, ctypes.Array):
+        obj.value = value.encode('utf-8')[:len(obj) - 1]
+    else:
+        obj.value = value
+
+
+class SimulatedStage:
+    """
+    One stage (one secondary of a chain): parameters and motion.
+    """
+
+    def __init__(self, stage_type=0, pulse_size=1e-3, limits=(-10., 10.), jitter=0., rng=None):
+        """
+        Args:
+            stage_type: value of GetSpeedStageType (0: PDX, 1: SMC, 2: PD2/PD3).
+            pulse_size: open-loop displacement (mm or °) of one pulse at 100% amplitude.
+            limits: (min, max) travel.
+            jitter: relative standard deviation of the open-loop displacement.
+            rng: random.Random used for the jitter.
+        """
+        self.stage_type = stage_type
+        self.pulse_size = pulse_size
+        self.range = tuple(limits)
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.reset()
+
+    def reset(self):
+        self.params = dict(DEFAULTS)
+        self.params['SpeedStageType'] = self.stage_type
+        self.limits = self.range
+        self.error = 0
+        self.homed = False
+        self.saved = True
+        self.trigger_mode = 'ML'
+        self.start = self.target = 0.
+        self.t_start = self.t_end = 0.
+
+    def position(self, t=None):
+        t = time.perf_counter() if t is None else t
+        if t >= self.t_end:
+            return self.target
+        return self.start + (self.target - self.start) * (t - self.t_start) / (self.t_end - self.t_start)
+
+    @property
+    def moving(self):
+        return time.perf_counter() < self.t_end
+
+    def move_to(self, target, duration):
+        """
+        Start a linear move to `target` (clipped to the limits) lasting `duration` s at full length.
+        """
+        t = time.perf_counter()
+        start = self.position(t)
+        clipped = min(max(target, self.limits[0]), self.limits[1])
+        if target != start and clipped != target:
+            # stops at the limit, after the corresponding part of the move
+            duration *= abs(clipped - start) / abs(target - start)
+        self.start, self.target = start, clipped
+        self.t_start, self.t_end = t, t + max(duration, 0.)
+
+    def frequency(self, channel):
+        if self.stage_type == 1:
+            return self.params['OpenLoopFrequency2' if channel == 1 else 'OpenLoopFrequency']
+        if self.stage_type == 2:
+            return self.params['OpenLoopFrequency3']
+        return self.params['OpenLoopFrequency']
+
+    def open_loop_move(self, pulses, channel):
+        """
+        Move of `pulses` pulses (negative: back) at the open-loop frequency.
+        """
+        amplitude = self.params['ForwardAmplitude' if pulses >= 0 else 'BackwardAmplitude'] / 100.
+        distance = pulses * self.pulse_size * amplitude
+        if self.jitter:
+            distance *= 1. + self.rng.gauss(0., self.jitter)
+        self.move_to(self.position() + distance, abs(pulses) / max(self.frequency(channel), 1))
+
+    def closed_loop_move(self, target):
+        speed = max(self.params['TargetSpeed'], 1e-3)
+        self.move_to(target, abs(target - self.position()) / speed)
+
+    def status(self):
+        p = self.params
+        if self.stage_type == 1:
+            return (f"ERR:{self.error},VEL:{p['OpenLoopFrequency']},STEP:{p['OpenLoopJogSize']},"
+                    f"VEL2:{p['OpenLoopFrequency2']},STEP2:{p['OpenLoopJogSize2']}>\r\n")
+        return (f"ERR:{self.error},KP:{p['KpOfPidParameters']},KI:{p['KiOfPidParameters']},"
+                f"KD:{p['KdOfPidParameters']},LOOP:{p['Loop']},VEL:{p['OpenLoopFrequency']},"
+                f"STEP:{p['OpenLoopJogSize']},SPEED:{p['TargetSpeed']},JOG:{p['OpenLoopJogSize']},"
+                f"HOME:{int(self.homed)},AD:{p['AbnormalMoveDetect']}>\r\n")
+
+
+class SimulatedController:
+    """
+    A controller (one serial port) and the stages of its daisy chain.
+    """
+
+    def __init__(self, serial, port, stages):
+        self.serial = serial
+        self.port = port
+        self.stages = stages
+        self.hdl = -1
+        self.baud = 115200
+        self.chain = 0
+        self.joystick = (0, 0)
+        self.line = threading.Lock()    # the serial line: one command at a time
+
+
+class SimulatedLibrary:
+    """
+    Stand-in for the PDXC command library (see module doc).
+    """
+
+    def __init__(self, serials=('SIM00001',), secondaries=0, stage_type=0, pulse_size=1e-3, limits=(-10., 10.),
+                 overhead=0.001, list_latency=0.05, open_latency=0.2, jitter=0., seed=None, latency=True):
+        """
+        Args:
+            serials: serial numbers of the simulated controllers.
+            secondaries: number of secondary stages chained to each controller.
+            stage_type, pulse_size, limits, jitter: see SimulatedStage.
+            overhead: processing time (s) of a command, on top of the transmission time.
+            list_latency, open_latency: duration (s) of List and Open.
+            seed: seed of the random generator (reproducible jitter).
+            latency: False to answer immediately (functional tests).
+        """
+        self.rng = random.Random(seed)
+        self.controllers = {
+            serial: SimulatedController(
+                serial, f'SIM{i + 1}',
+                [SimulatedStage(stage_type, pulse_size, limits, jitter, self.rng) for _ in range(secondaries + 1)])
+            for i, serial in enumerate(serials)}
+        self.handles = {}
+        self.overhead = overhead
+        self.list_latency = list_latency
+        self.open_latency = open_latency
+        self.latency = latency
+        self.commands = 0
+        self._lock = threading.Lock()
+        for name, fname, inputs, output in SPEC:
+            setattr(self, fname, self._entry(name, output))
+
+    @classmethod
+    def from_environment(cls, variable='PDXC_SIMULATOR'):
+        """
+        Instance configured by `variable`: '1' for the defaults, or 'key=value,...' options of __init__.
+        """
+        options = {}
+        for item in os.environ.get(variable, '').split(','):
+            if '=' not in item:
+                continue
+            key, value = (s.strip() for s in item.split('=', 1))
+            try:
+                options[key] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                options[key] = value
+        if isinstance(options.get('serials'), str):
+            options['serials'] = tuple(options['serials'].split(':'))
+        return cls(**options)
+
+    def _wait(self, seconds):
+        if self.latency and seconds > 0:
+            time.sleep(seconds)
+
+    def _transfer(self, controller, reply):
+        """
+        Time (s) the line is busy for one command and its reply.
+        """
+        return self.overhead + (16 + len(reply)) * 10. / controller.baud
+
+    # Handle-free functions
+
+    def List(self, buf, size):
+        self._wait(self.list_latency)
+        text = ','.join(f'{c.serial},{c.port}' for c in self.controllers.values())
+        _out(buf, text[:size - 1])
+        return 0
+
+    def Open(self, serial, baud, timeout):
+        self._wait(self.open_latency)
+        with self._lock:
+            controller = self.controllers.get(_in(serial))
+            if controller is None or controller.hdl >= 0:
+                return -1
+            hdl = max(self.handles, default=-1) + 1
+            controller.hdl = hdl
+            controller.baud = _in(baud)
+            self.handles[hdl] = controller
+            return hdl
+
+    def IsOpen(self, serial):
+        controller = self.controllers.get(_in(serial))
+        return int(controller is not None and controller.hdl >= 0)
+
+    def GetHandle(self, serial):
+        controller = self.controllers.get(_in(serial))
+        return -1 if controller is None else controller.hdl
+
+    def Close(self, hdl):
+        with self._lock:
+            controller = self.handles.pop(_in(hdl), None)
+            if controller is None:
+                return -1
+            controller.hdl = -1
+            return 0
+
+    # Commands
+
+    def _entry(self, name, output):
+        if output is None:
+            def f(hdl, *args):
+                return self._command(name, hdl, [_in(a) for a in args], None)
+        else:
+            def f(hdl, secondary, ref):
+                return self._command(name, hdl, [_in(secondary)], ref)
+        f.__name__ = name
+        return f
+
+    def _command(self, name, hdl, args, ref):
+        controller = self.handles.get(_in(hdl))
+        if controller is None:
+            return -1
+        with controller.line:
+            self.commands += 1
+            if name == 'SetDaisyChain':
+                controller.chain = args[0]
+                self._wait(self._transfer(controller, ''))
+                return 0
+            secondary, args = args[0], args[1:]
+            if not 0 <= secondary < len(controller.stages):
+                self._wait(self._transfer(controller, ''))
+                return -1
+            stage = controller.stages[secondary]
+            if ref is None:
+                ret = self._set(controller, stage, name[3:], args)
+                self._wait(self._transfer(controller, ''))
+                return ret
+            value = self._get(controller, stage, name[3:])
+            if value is None:
+                self._wait(self._transfer(controller, ''))
+                return -1
+            self._wait(self._transfer(controller, str(value)))
+            _out(ref, value)
+            return 0
+
+    def _get(self, controller, stage, key):
+        if key == 'CurrentPosition':
+            return stage.position()
+        if key == 'CurrentStatus':
+            return stage.status()
+        if key == 'ErrorMessage':
+            error, stage.error = stage.error, 0
+            return error
+        if key in ('SN', 'SN2'):
+            return f'{controller.serial}\r\n'
+        if key == 'FV':
+            return 'SIM 1.0\r\n'
+        if key == 'CalibrationIsCompleted':
+            return int(stage.homed)
+        if key == 'DaisyChainStatus':
+            return controller.chain
+        if key == 'UserDataIsSaved':
+            return f'{int(stage.saved)}>\r\n'
+        if key == 'TargetTriggerPosition':
+            return stage.target
+        if key in ('CurrentStatusInExternalTrigger', 'AllParametersInExternalTrigger'):
+            return f'{stage.trigger_mode}>\r\n'
+        if key == 'PositionLimit':
+            return f'{stage.limits[0]:.6f},{stage.limits[1]:.6f}\n>\r\n'
+        if key == 'JoystickConfig':
+            return f'{controller.joystick[0]},{controller.joystick[1]}\n>\r\n'
+        return stage.params.get(ALIASES.get(key, key))
+
+    def _set(self, controller, stage, key, args):
+        if key in ('OpenLoopMoveForward', 'OpenLoopMoveBack'):
+            pulses, channel = args
+            if stage.trigger_mode != 'ML':
+                stage.error = WRONG_MODE
+                return -1
+            stage.open_loop_move(pulses if key == 'OpenLoopMoveForward' else -pulses, channel)
+        elif key in ('TargetPosition', 'StepPulseAndResponse'):
+            target = args[0] + (stage.position() if key == 'StepPulseAndResponse' else 0.)
+            if not stage.limits[0] <= target <= stage.limits[1]:
+                stage.error = OUT_OF_RANGE
+                return -1
+            stage.closed_loop_move(target)
+        elif key == 'PositionCalibration':
+            stage.closed_loop_move(0.)
+            stage.homed = True
+        elif key == 'CurrentStatusInExternalTrigger':
+            stage.trigger_mode = args[0]
+        elif key == 'PositionLimit':
+            low, high = args
+            if not stage.range[0] <= low < high <= stage.range[1]:
+                stage.error = OUT_OF_RANGE
+                return -1
+            stage.limits = (low, high)
+        elif key == 'JoystickConfig':
+            controller.joystick = tuple(args)
+        elif key == 'AllCustomerData':
+            if args[0]:
+                stage.saved = True
+            else:
+                position = stage.position()
+                stage.reset()
+                stage.start = stage.target = position
+        else:
+            stage.params[key] = args[0]
+            stage.saved = False
+        return 0
+
+    def trigger(self, serial, secondary=0, edges=1, rate=None, rising=True):
+        """
+        Send `edges` trigger edges to a stage in fixed-step trigger mode ("FR/FF[step]").
+
+        With `rate` (edges per second) the edges are sent from a background thread, which is returned.
+        Edges of the other polarity, or outside fixed-step mode, are ignored.
+        """
+        stage = self.controllers[serial].stages[secondary]
+
+        def edge():
+            mode = stage.trigger_mode
+            if mode[:2] != ('FR' if rising else 'FF'):
+                return
+            try:
+                step = float(mode[2:])
+            except ValueError:
+                return
+            stage.closed_loop_move(stage.target + step)
+
+        if rate is None:
+            for _ in range(edges):
+                edge()
+            return None
+
+        def run():
+            t = time.perf_counter()
+            for _ in range(edges):
+                edge()
+                t += 1. / rate
+                time.sleep(max(0., t - time.perf_counter()))
+        thread = threading.Thread(target=run, name='pdxc-trigger', daemon=True)
+        thread.start()
+        return thread
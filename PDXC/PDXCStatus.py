@@ -0,0 +1,155 @@
+"""
+Controller status snapshot, parsed from GetCurrentStatus and cached.
+
+`GetCurrentStatus` answers in one command what a dozen Get* calls would: a
+comma separated string with
+
+* in D-sub mode: ERR, KP, KI, KD, current loop, velocity level (open loop),
+  step size (open loop), speed (closed loop), jog step (closed loop), home
+  flag and abnormal detection status,
+* in SMC mode: ERR, velocity and step size of channel 1, velocity and step
+  size of channel 2.
+
+`parse_status` turns it into a `Status`. `StatusCache` keeps the last status
+of each secondary for `ttl` seconds. Readers arriving while a refresh is in
+progress wait for it instead of sending their own command (single flight), so
+any number of clients costs at most one serial command per `ttl`.
+"""
+import time
+import threading
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+DSUB_FIELDS = ('error', 'kp', 'ki', 'kd', 'loop', 'velocity', 'step_size', 'speed', 'jog_step', 'home',
+               'abnormal_detection')
+SMC_FIELDS = ('error', 'velocity', 'step_size', 'velocity2', 'step_size2')
+
+_TYPES = {'error': int, 'kp': float, 'ki': float, 'kd': float, 'loop': int, 'velocity': int, 'step_size': int,
+          'speed': float, 'jog_step': float, 'home': bool, 'abnormal_detection': bool, 'velocity2': int,
+          'step_size2': int}
+
+
+@dataclass(frozen=True)
+class Status:
+    """
+    One reading of the controller status. Fields not reported in the current mode are None.
+    """
+    secondary: int
+    mode: str                       # 'dsub', 'smc' or 'unknown' (string not understood, see raw)
+    raw: str
+    time: float                     # time.time() of the reading
+    error: Optional[int] = None
+    kp: Optional[float] = None
+    ki: Optional[float] = None
+    kd: Optional[float] = None
+    loop: Optional[int] = None      # 0: open loop, 1: closed loop
+    velocity: Optional[int] = None
+    step_size: Optional[int] = None
+    speed: Optional[float] = None
+    jog_step: Optional[float] = None
+    home: Optional[bool] = None
+    abnormal_detection: Optional[bool] = None
+    velocity2: Optional[int] = None
+    step_size2: Optional[int] = None
+
+    @property
+    def age(self):
+        """
+        Time (s) since the reading.
+        """
+        return time.time() - self.time
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _value(segment, kind):
+    """
+    Convert one segment ('KP:0.5', 'KP=0.5' or '0.5') to `kind`.
+    """
+    for sep in (':', '='):
+        if sep in segment:
+            segment = segment.split(sep, 1)[1]
+    segment = segment.strip()
+    if kind is bool:
+        return float(segment) != 0
+    if kind is int:
+        return int(float(segment))
+    return kind(segment)
+
+
+def parse_status(raw, secondary=0, t=None):
+    """
+    Parse the string returned by GetCurrentStatus.
+    """
+    t = time.time() if t is None else t
+    segments = [s for s in raw.strip().split(',') if s.strip()]
+    fields = {len(DSUB_FIELDS): DSUB_FIELDS, len(SMC_FIELDS): SMC_FIELDS}.get(len(segments))
+    if fields is None:
+        return Status(secondary, 'unknown', raw, t)
+    try:
+        values = {name: _value(s, _TYPES[name]) for name, s in zip(fields, segments)}
+    except ValueError:
+        return Status(secondary, 'unknown', raw, t)
+    return Status(secondary, 'dsub' if fields is DSUB_FIELDS else 'smc', raw, t, **values)
+
+
+class StatusCache:
+    """
+    Per-secondary status cache with a time to live and single-flight refresh.
+    """
+
+    def __init__(self, read_status, ttl=0.5):
+        """
+        Args:
+            read_status: callable (secondary) -> status string.
+            ttl: time (s) during which a reading is served from the cache.
+        """
+        self.read_status = read_status
+        self.ttl = ttl
+        self.cache = {}
+        self.refreshing = set()
+        self.cond = threading.Condition()
+        self.counts = {'hits': 0, 'refreshes': 0, 'waits': 0}
+
+    def get(self, secondary=0, max_age=None):
+        """
+        Status of `secondary`, no older than max_age (default: ttl) seconds.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        t_request = time.time()
+        with self.cond:
+            while True:
+                status = self.cache.get(secondary)
+                # A reading started after this request is always fresh enough (max_age=0)
+                if status is not None and (status.age <= max_age or status.time >= t_request):
+                    self.counts['hits'] += 1
+                    return status
+                if secondary not in self.refreshing:
+                    break
+                # Someone is already reading it: wait for their result
+                self.counts['waits'] += 1
+                self.cond.wait()
+            self.refreshing.add(secondary)
+            self.counts['refreshes'] += 1
+
+        try:
+            t = time.time()
+            status = parse_status(self.read_status(secondary), secondary, t)
+            with self.cond:
+                self.cache[secondary] = status
+            return status
+        finally:
+            with self.cond:
+                self.refreshing.discard(secondary)
+                self.cond.notify_all()
+
+    def invalidate(self, secondary=None):
+        """
+        Drop the cached status of `secondary` (of all secondaries if None).
+        """
+        with self.cond:
+            if secondary is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(secondary, None)
@@ -0,0 +1,232 @@
+"""
+Position telemetry: sample the axes on the server, push batches to subscribers.
+
+`TelemetrySampler` reads the position and error code of every axis at a fixed
+rate into a numpy ring buffer (one row per sample: time, then position and
+error of each axis). New rows are published in batches on a zmq PUB socket
+(lclib's serializing socket, as for frame streaming), so the serial line sees
+the same reads whatever the number of watchers. `last(seconds)` returns the
+recent history for clients that just connected or missed batches.
+
+Sampling and publishing are periodic tasks of the process-wide scheduler
+(common/scheduler.py), so several controllers served from one process (see
+PDXCMultiServer) don't need a thread each; `info()` includes the sampling
+jitter.
+
+Client side:
+
+    with TelemetrySubscriber(('192.168.3.69', PDXCDriver.TELEMETRY_PORT)) as sub:
+        rows, meta = sub.receive()      # meta['columns'] names the columns
+"""
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import zmq
+
+from lclib.util.imstream import SerializingContext
+
+from scheduler import shared_scheduler
+
+
+class TelemetryRing:
+    """
+    Fixed-size ring of float64 rows.
+    """
+
+    def __init__(self, capacity, width):
+        self.data = np.full((capacity, width), np.nan)
+        self.capacity = capacity
+        self.count = 0          # total number of rows ever written
+        self.lock = threading.Lock()
+
+    def append(self, row):
+        with self.lock:
+            self.data[self.count % self.capacity] = row
+            self.count += 1
+
+    def since(self, index):
+        """
+        Rows written since total count `index` (at most capacity rows), and the new count.
+        """
+        with self.lock:
+            count = self.count
+            start = max(index, count - self.capacity)
+            idx = np.arange(start, count) % self.capacity
+            return self.data[idx], count
+
+    def last(self, seconds, now=None):
+        """
+        Rows of the last `seconds` seconds (column 0 is the time).
+        """
+        rows, _ = self.since(0)
+        now = time.time() if now is None else now
+        return rows[rows[:, 0] >= now - seconds]
+
+
+class TelemetrySampler:
+    """
+    Background sampling of the axes positions and error codes.
+    """
+
+    def __init__(self, axes, read_position, read_error, rate=20., seconds=600., port=5560, batch_interval=0.2,
+                 name='pdxc-telemetry'):
+        """
+        Args:
+            axes: {name: secondary} of the axes to sample.
+            read_position: callable (secondary) -> position or None.
+            read_error: callable (secondary) -> error code or None.
+            rate: samples per second.
+            seconds: history kept in the ring buffer.
+            port: port of the PUB socket (tcp://*:port). None to disable publishing.
+            batch_interval: time (s) between two published batches.
+            name: name of the scheduler tasks.
+        """
+        self.axes = dict(axes)
+        self.read_position = read_position
+        self.read_error = read_error
+        self.rate = rate
+        self.port = port
+        self.batch_interval = batch_interval
+        self.columns = ['time'] + [f'{name}.{q}' for name in self.axes for q in ('position', 'error')]
+        self.ring = TelemetryRing(max(1, int(rate * seconds)), len(self.columns))
+        self.name = name
+        self.published = 0
+        self._tasks = None
+        self.last_stats = None
+        self.context = None
+        self.socket = None
+
+    def start(self):
+        if self._tasks is not None:
+            return
+        if self.port is not None:
+            self.context = SerializingContext()
+            self.socket = self.context.socket(zmq.PUB)
+            self.socket.bind(f'tcp://*:{self.port}')
+        scheduler = shared_scheduler()
+        # Reads slower than the rate skip the missed samples instead of bursting
+        self._tasks = (scheduler.add(self.sample, 1. / self.rate, name=f'{self.name}.sample'),
+                       scheduler.add(self.publish, self.batch_interval, name=f'{self.name}.publish',
+                                     delay=self.batch_interval))
+
+    def stop(self):
+        if self._tasks is None:
+            return
+        for task in self._tasks:
+            task.cancel(wait=True)
+        self.publish()
+        self.last_stats = self._tasks[0].stats()
+        self._tasks = None
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.context.term()
+            self.socket = None
+            self.context = None
+
+    @property
+    def running(self):
+        return self._tasks is not None
+
+    def sample(self):
+        """
+        Read all axes once and store the row.
+        """
+        row = [time.time()]
+        for secondary in self.axes.values():
+            position = self.read_position(secondary)
+            error = self.read_error(secondary)
+            row += [np.nan if position is None else position, np.nan if error is None else error]
+        self.ring.append(row)
+
+    def publish(self):
+        """
+        Send the rows stored since the last batch.
+        """
+        rows, count = self.ring.since(self.published)
+        if len(rows) and self.socket is not None:
+            meta = {'columns': self.columns, 'first': count - len(rows), 'rate': self.rate}
+            self.socket.send_frame(np.ascontiguousarray(rows), meta)
+        self.published = count
+
+    def last(self, seconds):
+        """
+        {'columns': [...], 'data': array} of the last `seconds` seconds.
+        """
+        return {'columns': self.columns, 'data': self.ring.last(seconds)}
+
+    def info(self):
+        stats = self._tasks[0].stats() if self._tasks is not None else self.last_stats
+        return {'running': self.running, 'rate': self.rate, 'port': self.port, 'columns': self.columns,
+                'samples': self.ring.count, 'capacity': self.ring.capacity,
+                'overruns': stats['overruns'] + stats['skipped'] if stats else 0,
+                'errors': stats['errors'] if stats else 0,
+                'jitter': stats['jitter'] if stats else None}
+
+
+class TelemetrySubscriber:
+    """
+    Receive the telemetry batches published by a TelemetrySampler.
+    Batches are queued (up to `max_batches`) so none is lost between two receive calls.
+    """
+
+    def __init__(self, address, max_batches=1000, callback=None):
+        """
+        Args:
+            address: (ip, port) of the publisher.
+            max_batches: number of batches kept until received (older ones are dropped).
+            callback: if given, called as callback(rows, meta) for each batch instead of queuing it.
+        """
+        ip, port = address
+        self.address = f'tcp://{ip}:{port}'
+        self.callback = callback
+        self.batches = deque(maxlen=max_batches)
+        self.missed = 0
+        self._next = None
+        self._ready = threading.Condition()
+        self.context = SerializingContext()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.socket.connect(self.address)
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop:
+            if (self.socket.poll(500) & zmq.POLLIN) == 0:
+                continue
+            rows, meta = self.socket.recv_frame()
+            if rows is None:
+                continue
+            if self._next is not None and meta['first'] > self._next:
+                self.missed += meta['first'] - self._next
+            self._next = meta['first'] + len(rows)
+            if self.callback is not None:
+                self.callback(rows, meta)
+                continue
+            with self._ready:
+                self.batches.append((rows, meta))
+                self._ready.notify_all()
+
+    def receive(self, timeout=15.):
+        """
+        Next batch (rows, meta). Raise TimeoutError if none arrives within timeout.
+        """
+        with self._ready:
+            if not self._ready.wait_for(lambda: self.batches, timeout=timeout):
+                raise TimeoutError(f'No telemetry from {self.address}')
+            return self.batches.popleft()
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        self.socket.close(linger=0)
+        self.context.term()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
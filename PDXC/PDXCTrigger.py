@@ -0,0 +1,127 @@
+"""
+Hardware-triggered stepping with the PDXC fixed-step external trigger mode.
+
+In "FR[value]" / "FF[value]" mode the controller moves by a fixed step on each
+rising / falling edge of its trigger input, without any software in the loop.
+Wired to the detector's trigger output, the stage advances once per frame.
+
+`TriggeredScan` arms the mode, follows the position in the background to time
+the steps, and on `finish` restores the manual mode ("ML") and checks the
+final position against the expected one.
+"""
+import time
+import threading
+
+from lclib.util import Future
+
+STEP_DECIMALS = 6   # decimals of the step in the trigger mode string
+
+
+def trigger_mode(step, rising=True):
+    """
+    Fixed-step trigger mode string, e.g. "FR0.00001" for a 10 µm step on rising edges.
+    The step is written in fixed-point: the controller does not accept exponents (1e-05).
+    """
+    value = f'{step:.{STEP_DECIMALS}f}'.rstrip('0').rstrip('.')
+    if float(value) == 0:
+        raise ValueError(f'Step {step} is too small (resolution {10 ** -STEP_DECIMALS}).')
+    return f"{'FR' if rising else 'FF'}{value}"
+
+
+class TriggeredScan:
+    """
+    One fixed-step externally triggered scan.
+    """
+
+    def __init__(self, read_position, set_trigger_mode, step, n_steps, rising=True,
+                 tolerance=None, poll_interval=0.002):
+        """
+        Args:
+            read_position: callable returning the current position (or None).
+            set_trigger_mode: callable taking the trigger mode string, returning the pdxc result code.
+            step: step size in stage units (mm or °). Negative values step backwards.
+            n_steps: number of triggers expected.
+            rising: trigger on rising (True) or falling (False) edges.
+            tolerance: accepted final position error. Defaults to a quarter step.
+            poll_interval: position sampling interval (s) of the step monitor.
+        """
+        self.read_position = read_position
+        self.set_trigger_mode = set_trigger_mode
+        self.step = step
+        self.n_steps = n_steps
+        self.mode = trigger_mode(step, rising)
+        self.tolerance = abs(step) / 4 if tolerance is None else tolerance
+        self.poll_interval = poll_interval
+        self.start_position = None
+        self.step_times = []
+        self._stop = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        """
+        Arm the fixed-step trigger mode and start following the position.
+        """
+        self.start_position = self.read_position()
+        if self.start_position is None:
+            raise RuntimeError('Cannot read the stage position: triggered scans need an encoder.')
+        result = self.set_trigger_mode(self.mode)
+        if result < 0:
+            raise RuntimeError(f'Setting external trigger mode {self.mode} failed ({result}).')
+        self.t_start = time.perf_counter()
+        self._monitor = Future(self._follow)
+
+    def steps_done(self, position):
+        """
+        Number of steps corresponding to `position`.
+        """
+        return round((position - self.start_position) / self.step)
+
+    def _follow(self):
+        """
+        Sample the position and record the time at which each step is first seen.
+        """
+        seen = 0
+        while not self._stop.is_set() and seen < self.n_steps:
+            position = self.read_position()
+            if position is not None:
+                done = self.steps_done(position)
+                while seen < min(done, self.n_steps):
+                    seen += 1
+                    self.step_times.append(time.perf_counter())
+            self._stop.wait(self.poll_interval)
+
+    def abort(self):
+        """
+        Stop following the position and restore the manual trigger mode.
+        """
+        self._stop.set()
+        self.set_trigger_mode("ML")
+
+    def finish(self, timeout=10.):
+        """
+        Wait for the expected number of steps (up to `timeout` s), restore the manual
+        trigger mode and verify the final position.
+
+        Returns:
+            scan report (dict).
+        """
+        self._monitor.join(timeout)
+        self._stop.set()
+        self._monitor.join()
+        self.set_trigger_mode("ML")
+
+        final_position = self.read_position()
+        expected = self.start_position + self.n_steps * self.step
+        error = None if final_position is None else final_position - expected
+        times = self.step_times
+        rate = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else None
+        return {'mode': self.mode,
+                'steps_expected': self.n_steps,
+                'steps_detected': len(times),
+                'start_position': self.start_position,
+                'expected_position': expected,
+                'final_position': final_position,
+                'position_error': error,
+                'position_ok': error is not None and abs(error) <= self.tolerance,
+                'step_rate': rate,
+                'duration': (times[-1] if times else time.perf_counter()) - self.t_start}
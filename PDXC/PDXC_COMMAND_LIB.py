@@ -1,3 +1,4 @@
+import os
 import time
 from ctypes import *
 class pdxc:
@@ -31,7 +32,12 @@ class pdxc:
 
     @staticmethod
     def load_library(path):
-        pdxc.pdxcLib = cdll.LoadLibrary(path)
+        if os.environ.get('PDXC_SIMULATOR', '0') != '0':
+            # simulated controllers, see PDXCSimulator.py
+            from PDXCSimulator import SimulatedLibrary
+            pdxc.pdxcLib = SimulatedLibrary.from_environment()
+        else:
+            pdxc.pdxcLib = cdll.LoadLibrary(path)
         pdxc.isLoad = True
 
     def __init__(self): #the constructor will load the dll and create an pdxcobj
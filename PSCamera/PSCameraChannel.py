@@ -0,0 +1,310 @@
+"""
+Frame channel: transfer of the in-memory frames next to the RPC connection.
+
+Through rpyc, `last_frame` pickles the array on the server, sends it and
+unpickles it on the client: a 16 MP frame (32 MB) is copied several times.
+`FrameChannel` serves the frames of the driver's FrameBuffer on a separate
+TCP port (FRAME_PORT), and `FrameClient` fetches them:
+
+* remote clients: a small header, then the raw pixels, sent straight from the
+  frame buffer (no copy on the server) and received straight into the
+  destination array (`recv_into`, no copy on the client);
+* same-host clients: if the buffers are in shared memory (SHARED_FRAMES),
+  only the header is sent and the client copies the frame from the mapped
+  buffer.
+
+If the driver tags its frames in a MetadataCache (common/metacache.py), the
+header carries the version of the frame's metadata snapshot, and the snapshot
+itself only when it differs from the last one sent on that connection.
+
+    frames = FrameClient(('192.168.3.69', PSCameraDriver.FRAME_PORT))
+    number, frame = frames.get()                   # current frame
+    number, frame = frames.get(after=number)       # wait for the next one
+    frames.meta                                    # metadata snapshot of that frame (or None)
+
+The frame buffers are reused by the following snaps. The server tells after
+each transfer whether the frame may have been overwritten meanwhile, in which
+case `get` raises FrameOverwritten (retry, or increase FRAME_BUFFERS).
+
+Protocol: every message is a 4-byte big-endian length followed by a JSON object.
+
+    client: {'after': number or None, 'timeout': s, 'shared': bool}
+    server: {'number', 'shape', 'dtype', 'nbytes', 'shm', 'meta_version', 'meta'},
+            or {'number': None, 'timeout': bool}
+            then the nbytes raw bytes, unless 'shm' (name of the shared memory holding the frame)
+    client (shm only): {'check': number}
+    server: {'intact': bool}
+"""
+import json
+import time
+import socket
+import struct
+import ipaddress
+import threading
+import socketserver
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_LENGTH = struct.Struct('!I')
+
+
+class FrameOverwritten(RuntimeError):
+    """
+    The frame buffer was reused while the frame was being transferred.
+    """
+
+
+def _recv_into(sock, view):
+    """
+    Fill the memoryview `view` from sock.
+    """
+    received = 0
+    n = len(view)
+    while received < n:
+        r = sock.recv_into(view[received:], n - received)
+        if r == 0:
+            raise ConnectionError('Frame channel closed.')
+        received += r
+
+
+def send_message(sock, obj):
+    data = json.dumps(obj, default=str).encode()  # metadata values may not be JSON types
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    header = bytearray(_LENGTH.size)
+    _recv_into(sock, memoryview(header))
+    data = bytearray(_LENGTH.unpack(header)[0])
+    _recv_into(sock, memoryview(data))
+    return json.loads(data)
+
+
+def _is_local(host):
+    """
+    True if `host` is this machine.
+    """
+    try:
+        address = socket.gethostbyname(host)
+        if ipaddress.ip_address(address).is_loopback:
+            return True
+        return address in socket.gethostbyname_ex(socket.gethostname())[2]
+    except (OSError, ValueError):
+        return False
+
+
+def _attach(name):
+    """
+    Map the shared memory `name` created by another process, without letting
+    this process's resource tracker unlink it at exit.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass  # windows: no resource tracker
+        return shm
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FrameChannel:
+    """
+    Serve the frames of a FrameBuffer on a TCP port, one thread per client.
+    """
+
+    def __init__(self, frames, port, host='', meta=None):
+        """
+        Args:
+            frames: the FrameBuffer whose frames are served.
+            port: TCP port.
+            host: interface to listen on ('' for all).
+            meta: MetadataCache in which the frames are tagged with their number (optional).
+        """
+        self.frames = frames
+        self.meta = meta
+        self.port = port
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'streamed': 0, 'shared': 0, 'overwritten': 0, 'timeouts': 0,
+                       'bytes_sent': 0, 'send_time': 0.}
+        channel = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                channel._serve(self.request)
+
+        self.server = _Server((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='frame_channel')
+        self.thread.start()
+
+    def publish(self):
+        """
+        Wake up the clients waiting for a new frame (call after each snap).
+        """
+        with self.cond:
+            self.cond.notify_all()
+
+    def _latest(self, after, timeout):
+        """
+        (number, frame) of the newest frame, waiting up to `timeout` for one newer than `after`.
+        """
+        def available():
+            number, frame = self.frames.last
+            return frame is not None and (after is None or number > after)
+        with self.cond:
+            if not self.cond.wait_for(available, timeout):
+                return None, None
+        return self.frames.last
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sent = {'meta': None}  # last metadata snapshot sent on this connection
+        try:
+            while True:
+                self._reply(sock, recv_message(sock), sent)
+        except (ConnectionError, OSError, ValueError):
+            return  # client gone
+
+    def _reply(self, sock, request, sent):
+        """
+        Serve one request.
+        """
+        self._count('requests')
+        number, frame = self._latest(request.get('after'), request.get('timeout') or 0.)
+        if frame is None:
+            self._count('timeouts')
+            send_message(sock, {'number': None, 'timeout': request.get('after') is not None})
+            return
+        header = {'number': number, 'shape': frame.shape, 'dtype': frame.dtype.str, 'nbytes': frame.nbytes,
+                  'shm': None, 'meta_version': None, 'meta': None}
+        snap = self.meta.tagged(number) if self.meta is not None else None
+        if snap is not None:
+            header['meta_version'] = snap.version
+            if snap is not sent['meta']:
+                header['meta'] = snap.as_dict()
+                sent['meta'] = snap
+        if request.get('shared') and self.frames.shared:
+            header['shm'] = self.frames.shared_names[self.frames.index(number)]
+            send_message(sock, header)
+            recv_message(sock)  # the client has copied the frame
+            self._count('shared')
+        else:
+            t0 = time.perf_counter()
+            send_message(sock, header)
+            sock.sendall(memoryview(frame).cast('B'))
+            self._count('streamed')
+            self._count('bytes_sent', frame.nbytes)
+            self._count('send_time', time.perf_counter() - t0)
+        intact = self.frames.intact(number)
+        if not intact:
+            self._count('overwritten')
+        send_message(sock, {'intact': intact})
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        stats['MB_per_second'] = stats['bytes_sent'] / stats['send_time'] * 1e-6 if stats['send_time'] else None
+        return stats
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FrameClient:
+    """
+    Fetch frames from a FrameChannel.
+    """
+
+    def __init__(self, address, shared=None, timeout=30.):
+        """
+        Args:
+            address: (host, port) of the channel.
+            shared: map the server's shared memory instead of receiving the pixels.
+                None: if the server is on this host.
+            timeout: socket timeout (s).
+        """
+        self.address = tuple(address)
+        self.shared = _is_local(address[0]) if shared is None else shared
+        self.sock = socket.create_connection(self.address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.shm = {}
+        self.meta = None
+        self._meta = None  # last snapshot received
+
+    def get(self, after=None, timeout=10., out=None):
+        """
+        Fetch a frame.
+
+        Args:
+            after: wait for a frame newer than this number. None for the current frame.
+            timeout: maximum wait (s) for a new frame.
+            out: array receiving the frame (allocated if None or of another shape/dtype).
+
+        Returns:
+            (number, frame), or (None, None) if no frame was acquired yet.
+            The metadata snapshot of the frame (dict) is then in self.meta (None if not tagged).
+
+        Raises:
+            TimeoutError if no frame newer than `after` comes within timeout.
+            FrameOverwritten if the buffer was reused during the transfer.
+        """
+        send_message(self.sock, {'after': after, 'timeout': timeout, 'shared': self.shared})
+        header = recv_message(self.sock)
+        number = header['number']
+        if number is None:
+            if header['timeout']:
+                raise TimeoutError(f'No frame after {after} within {timeout} s.')
+            return None, None
+        if header['meta'] is not None:
+            self._meta = header['meta']
+        self.meta = self._meta if header['meta_version'] is not None else None
+        shape, dtype = tuple(header['shape']), np.dtype(header['dtype'])
+        if out is None or out.shape != shape or out.dtype != dtype:
+            out = np.empty(shape, dtype)
+        if header['shm']:
+            try:
+                buf = self._map(header['shm']).buf
+                np.copyto(out, np.ndarray(shape, dtype, buffer=buf))
+            except FileNotFoundError:
+                # not on the same host after all: receive the pixels from now on
+                self.shared = False
+                send_message(self.sock, {'check': number})
+                recv_message(self.sock)
+                return self.get(after, timeout, out)
+            send_message(self.sock, {'check': number})
+        else:
+            _recv_into(self.sock, memoryview(out).cast('B'))
+        if not recv_message(self.sock)['intact']:
+            raise FrameOverwritten(f'Frame {number} was overwritten during the transfer.')
+        return number, out
+
+    def _map(self, name):
+        if name not in self.shm:
+            self.shm[name] = _attach(name)
+        return self.shm[name]
+
+    def close(self):
+        self.sock.close()
+        for shm in self.shm.values():
+            shm.close()
+        self.shm = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
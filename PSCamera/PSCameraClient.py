@@ -1,6 +1,17 @@
 from lclib import register_driver, proxycall, proxydevice,ProxyDeviceError
 from lclib.base import SocketDriverBase
 import ctypes
+from PSCameraWait import StagedWait
+from PSCameraFrame import FrameBuffer, load_camera_library, load_sensor_library
+from PSCameraWriter import FrameWriter
+from PSCameraChannel import FrameChannel
+from metacache import MetadataCache
+from callstats import instrument, timed_library
+import os
+import time
+import tempfile
+import threading
+from lclib.util import Future
 from config import config # a dict including config parameters
 ADDRESS = ('192.168.3.69',10003)  #the IP of proxy Server which connects the controller
 DEVICE_ADDRESS = ('192.168.3.69', 10003)   #the IP of proxy Server which connects the controller
@@ -10,33 +21,239 @@ data_path = config['data_path']
 exposure_time = config['exposure_time']
 @register_driver
 @proxydevice(address=ADDRESS)
+@instrument  # server-side latency histograms of every proxycall (see call_stats)
 class PSCameraDriver(SocketDriverBase): #driver_name=PSCameradriver
     """
     Socket driver example for a PS detector.
     """
     DEFAULT_DEVICE_ADDRESS = DEVICE_ADDRESS
+    READOUT_TIME = 0.5               # expected readout + transfer time (s) of one frame
+    ACQUISITION_TIMEOUT_MARGIN = 5.  # time (s) allowed beyond exposure + readout before giving up on a frame
+    FRAME_BUFFERS = 2                # number of preallocated buffers for in-memory acquisition
+    WRITER_QUEUE = 8                 # number of frames waiting to be written before WRITER_POLICY applies
+    WRITER_PROCESSES = 2             # number of frame writer processes
+    WRITER_POLICY = 'block'          # 'block', 'drop' or 'spill' when the writer queue is full
+    SPILL_PATH = os.path.join(tempfile.gettempdir(), 'pscamera_spill')  # local directory for spilled frames
+    FRAME_PORT = 10004               # port of the frame channel (raw frame transfer, see PSCameraChannel)
+    SHARED_FRAMES = True             # frame buffers in shared memory, mapped by clients on the same host
+    META_FRAMES = 64                 # number of recent frames whose metadata snapshot is kept (frame_meta)
     def __init__(self, device_address=None):
-        self.device = ctypes.CDLL("PS_camera.dll",winmode=0)#make sure all required dlls exist
+        self.device = timed_library(load_camera_library())  # PS_camera.dll, or the simulator if PSCAMERA_SIMULATOR is set
+        self.exposure_time = 0  # us, set by Camera_Configuration
+        # Metadata published on change; each frame is tagged with a snapshot (see frame_meta)
+        self.metacache = MetadataCache(keep=self.META_FRAMES, name='pscamera-metadata')
+        self.metacache.publish('camera', {'exposure_time': self.exposure_time, 'frame_buffers': self.FRAME_BUFFERS})
+        self.waiter = StagedWait(timeout_margin=self.READOUT_TIME + self.ACQUISITION_TIMEOUT_MARGIN)
+        self.readout = None     # readout still running after Camera_Expose
+        # In-memory acquisition through the sensor library used by PS_camera.dll
+        self.frames = FrameBuffer(timed_library(load_sensor_library()), n_buffers=self.FRAME_BUFFERS, waiter=self.waiter,
+                                  shared=self.SHARED_FRAMES)
+        # The frames are fetched by the clients on a separate port rather than through last_frame
+        try:
+            self.channel = FrameChannel(self.frames, self.FRAME_PORT, meta=self.metacache)
+        except OSError as error:
+            print(f'frame channel not available on port {self.FRAME_PORT}: {error}')
+            self.channel = None
+        # Frames acquired in memory are written in the background
+        self.writer = self._open_writer()
         print('PS initialization success!')
+    def _open_writer(self):
+        return FrameWriter(max_queue=self.WRITER_QUEUE, processes=self.WRITER_PROCESSES,
+                           policy=self.WRITER_POLICY, spill_path=self.SPILL_PATH)
     @proxycall(admin=True, block=False)
     def Camera_Init(self, mac_str, ip_str):
         mac = ctypes.c_char_p(mac_str.encode())   #physical IP address of the device
         ip = ctypes.c_char_p(ip_str.encode())  # the IP of controller should be in the same network segment as the camera, rather than the same IP.
+        if self.writer.closed:  # after Camera_Close
+            self.writer = self._open_writer()
         self.device.AcquisitionInit(mac, ip)
     @proxycall(admin=True, block=False)
     def Camera_Acquisition(self, tif_path): #tif_path : the path to save the image
+        self.waiter.reset()  # an abort from here on stops this acquisition
+        self._readout_done()
+        return self._fetch(tif_path)
+    def _fetch(self, tif_path, on_exposed=None):
         print(tif_path)
         tif_path = tif_path.encode()
-        while 1:
-            if self.device.AcquisitionFetch(tif_path) == 1:
-                break
+        # Polls AcquisitionFetch without pinning a core. Raises TimeoutError if the frame never comes.
+        return self.waiter.wait(lambda: self.device.AcquisitionFetch(tif_path) == 1, expected=self.exposure_time * 1e-6,
+                                on_expected=on_exposed)
+    @proxycall(admin=True, block=False)
+    def Camera_Snap(self, tif_path=None):
+        """
+        Acquire one frame into memory. The frame is available as last_frame until its buffer is reused.
+        If tif_path is given, the frame is also queued to be written there by the background writer:
+        this returns as soon as the frame is queued, not when the file is written.
+        Returns the frame shape, or None if the acquisition was aborted.
+        """
+        self.waiter.reset()
+        self._readout_done()
+        return self._snap(tif_path)
+    def _snap(self, tif_path, on_exposed=None):
+        self.metacache.publish('acquisition', {'mode': 'snap', 'n_frames': 1, 'tif_path': tif_path,
+                                               'first_index': 0, 'settle_time': 0.})
+        frame = self.frames.snap(self.exposure_time * 1e-6, on_exposed)
+        if frame is None:
+            return None
+        self._publish()
+        if tif_path is not None:
+            self.writer.submit(frame, tif_path)
+        return frame.shape
+    @proxycall(admin=True)
+    def Camera_Expose(self, tif_path=None, in_memory=True):
+        """
+        Start one acquisition (Camera_Snap if in_memory, else Camera_Acquisition) and return as soon as
+        the exposure is over, so that a step scan can move the stage during the readout.
+        The sensor library has no end-of-exposure status: the exposure is timed here, from the start
+        of the acquisition on the server, so the RPC latency and queueing are not part of it.
+        The readout continues in the background. Camera_Readout waits for it and returns its result;
+        the next acquisition also waits for it first.
+        Blocking call (short exposures return at once): abort still interrupts it.
+        """
+        self.waiter.reset()  # here rather than in the acquisition thread, which may start after an abort
+        self._readout_done()
+        exposed = threading.Event()
+        acquire = self._snap if in_memory else self._fetch
+        def acquisition():
+            try:
+                return acquire(tif_path, exposed.set)
+            finally:
+                exposed.set()  # also if the acquisition failed before the exposure
+        self.readout = Future(acquisition, callback=lambda result, error: None)  # error raised by _readout_done
+        exposed.wait()
+    @proxycall(admin=True)
+    def Camera_Readout(self):
+        """
+        Wait for the readout started by Camera_Expose and return its result (see Camera_Snap and
+        Camera_Acquisition), or None if there is none.
+        """
+        return self._readout_done()
+    def _readout_done(self):
+        readout, self.readout = self.readout, None
+        if readout is None:
+            return None
+        error = readout.exception()
+        if error is not None:
+            raise error
+        return readout.result()
+    @proxycall(admin=True, block=False)
+    def Camera_Sequence(self, n_frames, tif_path=None, settle_time=0., first_index=0):
+        """
+        Acquire n_frames frames in memory back to back, for scans where the detector trigger
+        output steps the stage (PDXCDriver.start_triggered_scan): no call is needed between frames.
+        tif_path, if given, is formatted with index=first_index + frame number (e.g. 'scan/img{index:04d}.tif')
+        and frames are queued to the background writer. settle_time (s) is waited after each frame.
+        Returns the number of frames acquired, the elapsed time and the achieved frame rate.
+        """
+        self.waiter.reset()
+        self._readout_done()
+        self.metacache.publish('acquisition', {'mode': 'sequence', 'n_frames': n_frames, 'tif_path': tif_path,
+                                               'first_index': first_index, 'settle_time': settle_time})
+        def queue(i, frame):
+            self._publish()
+            if tif_path is not None:
+                self.writer.submit(frame, tif_path.format(index=first_index + i))
+        t0 = time.perf_counter()
+        n = self.frames.sequence(n_frames, self.exposure_time * 1e-6, settle_time, queue)
+        elapsed = time.perf_counter() - t0
+        return {'frames': n, 'elapsed': elapsed, 'frame_rate': n / elapsed if elapsed > 0 else None}
+    @proxycall()
+    @property
+    def last_frame(self):
+        """
+        The last frame acquired with Camera_Snap (numpy array), or None.
+        Large frames are much faster to fetch through the frame channel (PSCameraChannel.FrameClient).
+        """
+        return self.frames.frame
+    @proxycall()
+    @property
+    def frame_channel(self):
+        """
+        Port, shared memory use and transfer statistics of the frame channel (None if not running).
+        """
+        if self.channel is None:
+            return None
+        return {'port': self.channel.port, 'shared': self.frames.shared, 'stats': self.channel.stats()}
+    @proxycall()
+    def frame_meta(self, number=None):
+        """
+        Metadata snapshot of frame `number` (default: the last frame): version, stale sources
+        and values per source. None if the frame is unknown or older than META_FRAMES frames.
+        """
+        snap = self.metacache.tagged(self.frames.count if number is None else number)
+        return None if snap is None else snap.as_dict()
+    @proxycall(admin=True)
+    def publish_meta(self, source, values, max_age=None):
+        """
+        Publish metadata of another device (e.g. stage positions) once, when it changes.
+        The following frames carry it; it is flagged stale after max_age seconds without a publish.
+        Returns the metadata version.
+        """
+        return self.metacache.publish(source, values, max_age)
+    @proxycall()
+    def metadata_stats(self):
+        """
+        Version, publish/snapshot counts and staleness of the metadata sources.
+        """
+        return self.metacache.stats()
+    def _publish(self):
+        self.metacache.tag(self.frames.count)  # snapshot reference, taken before the clients are woken up
+        if self.channel is not None:
+            self.channel.publish()
     @proxycall(admin=True, block=False)
     def Camera_Configuration(self, ExposureTime): #configure exposuretime(us)
+        self.exposure_time = ExposureTime
         ExposureTime = ctypes.c_int(ExposureTime)
         self.device.Configuration(ExposureTime)
+        self.metacache.publish('camera', {'exposure_time': self.exposure_time})
     @proxycall(admin=True, block=False)
     def Camera_Close(self):
-        self.device.AcquisitionClose()
+        try:
+            self._readout_done()
+        finally:
+            # Writes what is still queued, then frees the writer processes and shared memory slots
+            self.writer.close()
+            self.device.AcquisitionClose()
+    @proxycall()
+    def writer_stats(self):
+        """
+        Writer queue depth, dropped/spilled frames and write throughput.
+        """
+        return self.writer.stats()
+    @proxycall(admin=True, block=False)
+    def writer_flush(self, timeout=None):
+        """
+        Wait until all queued frames are written. Returns False on timeout.
+        """
+        return self.writer.flush(timeout)
+    @proxycall(admin=True, block=False)
+    def writer_resubmit_spilled(self):
+        """
+        Copy the frames spilled to local disk to their destination. Returns the number of files.
+        """
+        return self.writer.resubmit_spilled()
+    @proxycall(admin=True)
+    @property
+    def writer_policy(self):
+        """
+        What happens when the writer queue is full: 'block', 'drop' or 'spill'.
+        """
+        return self.writer.policy
+    @writer_policy.setter
+    def writer_policy(self, value):
+        self.writer.policy = value
+    @proxycall(interrupt=True)
+    def abort(self):
+        """
+        Stop waiting for the current acquisition.
+        """
+        self.waiter.abort()
+    @proxycall()
+    def fetch_stats(self):
+        """
+        Fetch latency statistics (delay between the expected and actual end of the acquisitions).
+        """
+        return self.waiter.stats()
 c = PSCameraDriver.Client()
     # Check that client is admin by default
 
@@ -0,0 +1,229 @@
+"""
+In-memory acquisition for the gsense4040 (X-ray sCMOS 16MP) detector.
+
+`PS_camera.dll` only offers `AcquisitionFetch(tif_path)`, which writes every
+frame to disk. The underlying `gsense4040control_x64.dll` (loaded by
+`PS_camera.dll` anyway) can copy a new frame straight into a memory location
+provided by the caller (`PSL_VHR_set_customers_buffer`). `FrameBuffer` keeps a
+small ring of preallocated ctypes buffers, snaps into them and exposes each
+frame as a numpy array sharing the buffer memory (no copy).
+
+A frame array stays valid until its buffer is reused, i.e. for the next
+`n_buffers - 1` snaps. Copy it if it must live longer.
+
+With `shared=True` the buffers are allocated in named shared memory, so that
+clients on the same host can map the frames directly (see PSCameraChannel).
+"""
+import os
+import atexit
+import ctypes
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from PSCameraWait import StagedWait
+
+SENSOR_SHAPE = (4096, 4096)   # gsense4040 full frame (height, width)
+DTYPE = np.uint16
+
+_PROTOTYPES = {
+    'PSL_VHR_set_customers_buffer': ([ctypes.POINTER(ctypes.c_uint16)], ctypes.c_bool),
+    'PSL_VHR_Snap_and_return': ([], ctypes.c_bool),
+    'PSL_VHR_Get_snap_status': ([], ctypes.c_bool),
+    'PSL_VHR_abort_snap': ([], ctypes.c_bool),
+    'PSL_VHR_apply_post_snap_processing': ([ctypes.POINTER(ctypes.c_uint16)], ctypes.c_bool),
+    'PSL_VHR_get_width': ([], ctypes.c_long),
+    'PSL_VHR_get_height': ([], ctypes.c_long),
+}
+
+
+def simulated():
+    """
+    True if the PSCAMERA_SIMULATOR environment variable selects the simulated detector (PSCameraSimulator).
+    """
+    return os.environ.get('PSCAMERA_SIMULATOR', '0') != '0'
+
+
+def load_camera_library(name="PS_camera.dll"):
+    """
+    Load PS_camera.dll (make sure all required dlls exist and the path is correct).
+    """
+    if simulated():
+        from PSCameraSimulator import SimulatedCameraLibrary
+        return SimulatedCameraLibrary()
+    return ctypes.CDLL(name, winmode=0)
+
+
+def load_sensor_library(name="gsense4040control_x64.dll"):
+    """
+    Load the gsense4040 control library and declare the prototypes of the functions used here.
+    """
+    if simulated():
+        from PSCameraSimulator import SimulatedSensorLibrary
+        return SimulatedSensorLibrary()
+    lib = ctypes.CDLL(name, winmode=0)
+    for fname, (argtypes, restype) in _PROTOTYPES.items():
+        f = getattr(lib, fname)
+        f.argtypes = argtypes
+        f.restype = restype
+    return lib
+
+
+class FrameBuffer:
+    """
+    Ring of preallocated frame buffers filled directly by the sensor library.
+    """
+
+    def __init__(self, lib, n_buffers=2, shape=SENSOR_SHAPE, waiter=None, post_processing=True, shared=False):
+        """
+        Args:
+            lib: the sensor library (see load_sensor_library).
+            n_buffers: number of buffers in the ring.
+            shape: (height, width) used to size the buffers. Grown automatically
+                if the sensor reports a larger frame.
+            waiter: StagedWait instance used to poll the snap status.
+            post_processing: if True, apply the PS corrections (offset, flat field, ...) in place.
+            shared: if True, allocate the buffers in shared memory (names in shared_names).
+        """
+        self.lib = lib
+        self.n_buffers = n_buffers
+        self.waiter = waiter or StagedWait()
+        self.post_processing = post_processing
+        self.shared = shared
+        self.shm = []
+        self.buffers = []
+        self.size = 0
+        self.count = 0
+        self.frame = None
+        self.last = (0, None)
+        self._allocate(shape[0] * shape[1])
+        if shared:
+            atexit.register(self._unlink)
+
+    def _allocate(self, size):
+        """
+        (Re)allocate the ring with buffers of `size` pixels.
+        """
+        self._release()
+        if self.shared:
+            self.shm = [shared_memory.SharedMemory(create=True, size=size * 2) for _ in range(self.n_buffers)]
+            self.buffers = [(ctypes.c_uint16 * size).from_buffer(shm.buf) for shm in self.shm]
+        else:
+            self.buffers = [(ctypes.c_uint16 * size)() for _ in range(self.n_buffers)]
+        self.arrays = [np.ctypeslib.as_array(b) for b in self.buffers]
+        self.size = size
+
+    def _release(self):
+        # The views must go before the shared memory can be closed
+        self.frame = None
+        self.last = (self.count, None)
+        self.arrays = []
+        self.buffers = []
+        for shm in self.shm:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # a frame is still in use (e.g. being sent): freed with it
+            shm.unlink()
+        self.shm = []
+
+    def _unlink(self):
+        # At exit the library may still hold the buffers: only remove the names
+        for shm in self.shm:
+            shm.unlink()
+
+    @property
+    def shared_names(self):
+        """
+        Shared memory names of the buffers (empty if not shared).
+        """
+        return [shm.name for shm in self.shm]
+
+    def index(self, number):
+        """
+        Buffer index of frame `number` (value of count after its snap).
+        """
+        return (number - 1) % self.n_buffers
+
+    def intact(self, number):
+        """
+        True if the buffer of frame `number` can't have been overwritten yet:
+        the snap reusing it only starts after frame number + n_buffers - 1.
+        """
+        return self.count <= number + self.n_buffers - 2
+
+    def shape(self):
+        """
+        Current frame shape (height, width) as reported by the sensor library.
+        """
+        return self.lib.PSL_VHR_get_height(), self.lib.PSL_VHR_get_width()
+
+    def snap(self, exposure=0., on_exposed=None):
+        """
+        Acquire one frame into the next buffer of the ring.
+
+        Args:
+            exposure: exposure time (s), used to sleep through the exposure.
+            on_exposed: called once the exposure is over, timed from the start of the snap
+                (the sensor library has no end-of-exposure status), or when the snap ends.
+
+        Returns:
+            the frame as a numpy array (a view on the buffer), or None if the snap was aborted.
+        """
+        h, w = self.shape()
+        if h * w > self.size:
+            self._allocate(h * w)
+        i = self.count % self.n_buffers
+        buf = self.buffers[i]
+        ptr = ctypes.cast(buf, ctypes.POINTER(ctypes.c_uint16))
+
+        if not self.lib.PSL_VHR_set_customers_buffer(ptr):
+            raise RuntimeError('PSL_VHR_set_customers_buffer failed.')
+        if not self.lib.PSL_VHR_Snap_and_return():
+            raise RuntimeError('PSL_VHR_Snap_and_return failed.')
+        if not self.waiter.wait(self.lib.PSL_VHR_Get_snap_status, expected=exposure, on_expected=on_exposed):
+            self.lib.PSL_VHR_abort_snap()
+            return None
+        if self.post_processing:
+            self.lib.PSL_VHR_apply_post_snap_processing(ptr)
+
+        self.count += 1
+        self.frame = self.arrays[i][:h * w].reshape(h, w)
+        self.last = (self.count, self.frame)  # read by other threads: number and frame set together
+        return self.frame
+
+    def sequence(self, n_frames, exposure=0., settle_time=0., on_frame=None):
+        """
+        Acquire `n_frames` frames back to back, e.g. while the detector trigger output
+        steps a stage (see PDXCTrigger).
+
+        Args:
+            n_frames: number of frames.
+            exposure: exposure time (s).
+            settle_time: pause (s) after each frame, to let a triggered stage settle.
+            on_frame: called as on_frame(index, frame) after each frame, before the next snap.
+
+        Returns:
+            the number of frames acquired (smaller than n_frames if aborted).
+        """
+        for i in range(n_frames):
+            frame = self.snap(exposure)
+            if frame is None:
+                return i
+            if on_frame is not None:
+                on_frame(i, frame)
+            if settle_time > 0 and i < n_frames - 1:
+                time.sleep(settle_time)
+        return n_frames
+
+    def abort(self):
+        """
+        Abort the current snap, and the next ones until waiter.reset() (called before each acquisition).
+        """
+        self.waiter.abort()
+
+    def close(self):
+        """
+        Free the buffers (and their shared memory).
+        """
+        self._release()
@@ -0,0 +1,256 @@
+"""
+Simulated gsense4040 detector, for running the camera driver without the acquisition PC.
+
+Two objects stand in for the libraries loaded by the driver, sharing one
+`SimulatedCamera`:
+
+* `SimulatedCameraLibrary` for PS_camera.dll: AcquisitionInit, Configuration,
+  AcquisitionFetch (writes the frame as a tiff file, with `tifffile`) and
+  AcquisitionClose;
+* `SimulatedSensorLibrary` for gsense4040control_x64.dll: the PSL_VHR_*
+  functions used by PSCameraFrame.FrameBuffer (frames copied into the
+  caller's buffer).
+
+A frame is ready `exposure + readout_time` seconds after the acquisition
+starts (first AcquisitionFetch call, or PSL_VHR_Snap_and_return). Frames are
+full size (4096 x 4096 uint16) by default: a fixed pattern, computed once, is
+copied for each frame, and the frame number is stored in the first two pixels
+(low and high 16 bits) so that consumers can check for missing frames.
+
+Faults are drawn per frame with a seeded random generator:
+
+* with probability `drop_rate` the frame never comes: the acquisition stays
+  pending (the driver times out) until a new one is started, i.e. the next
+  snap, or a fetch to another path or `drop_timeout` seconds later;
+* with probability `late_rate` the frame comes `late_delay` seconds late.
+
+Set the environment variable PSCAMERA_SIMULATOR before starting the driver to
+use it, optionally with options of SimulatedCamera:
+
+    PSCAMERA_SIMULATOR=1 python PSCameraServer.py
+    PSCAMERA_SIMULATOR="readout_time=0.1,drop_rate=0.01,late_rate=0.05,seed=1" python PSCameraServer.py
+    PSCAMERA_SIMULATOR="shape=512x1024,readout_time=0.02" python PSCameraServer.py
+
+The options are separated by commas, so `shape` is given as HEIGHTxWIDTH (or a
+single number for square frames).
+"""
+import os
+import ast
+import time
+import random
+import threading
+import ctypes
+
+import numpy as np
+
+SENSOR_SHAPE = (4096, 4096)
+
+
+def _in(arg):
+    """
+    Python value of a ctypes or Python argument.
+    """
+    value = getattr(arg, 'value', arg)
+    return value.decode('utf-8', 'ignore') if isinstance(value, bytes) else value
+
+
+class SimulatedCamera:
+    """
+    Timing, frames and faults of the simulated detector.
+    """
+
+    def __init__(self, shape=SENSOR_SHAPE, readout_time=0.5, init_time=0.5, processing_time=0.,
+                 drop_rate=0., late_rate=0., late_delay=0.5, drop_timeout=5., write_files=True, seed=None):
+        """
+        Args:
+            shape: (height, width) of the frames.
+            readout_time: time (s) between the end of the exposure and the frame being available.
+            init_time: duration (s) of AcquisitionInit.
+            processing_time: duration (s) of PSL_VHR_apply_post_snap_processing.
+            drop_rate: probability that a frame is lost.
+            late_rate: probability that a frame comes late_delay seconds late.
+            late_delay: delay (s) of late frames.
+            drop_timeout: time (s) after which a fetch restarts an acquisition whose frame was lost.
+            write_files: if False, AcquisitionFetch does not write the tiff files.
+            seed: seed of the fault generator and of the frame pattern.
+        """
+        self.readout_time = readout_time
+        self.init_time = init_time
+        self.processing_time = processing_time
+        self.drop_rate = drop_rate
+        self.late_rate = late_rate
+        self.late_delay = late_delay
+        self.drop_timeout = drop_timeout
+        self.write_files = write_files
+        self.rng = random.Random(seed)
+        self.exposure = 0.          # s
+        self.initialized = False
+        self.lock = threading.Lock()
+        self.counts = {'acquisitions': 0, 'frames': 0, 'dropped': 0, 'late': 0}
+        self.number = 0             # frame number, including lost frames
+        self.t_ready = None         # time the pending frame is available (inf if lost)
+        self.t_start = None
+        self.path = None
+        self.seed = seed
+        self.set_shape(shape)
+
+    def set_shape(self, shape):
+        """
+        Change the frame size (height, width), e.g. to benchmark smaller regions of interest.
+        """
+        h, w = self.shape = tuple(shape)
+        pattern = np.random.default_rng(self.seed).normal(1000., 30., (h, w))
+        pattern += np.linspace(0., 2000., w)[None, :]
+        self.pattern = pattern.clip(0, 65535).astype(np.uint16)
+
+    def start(self, path=None):
+        """
+        Start an acquisition and draw its faults.
+        """
+        t = time.perf_counter()
+        self.number += 1
+        self.counts['acquisitions'] += 1
+        self.t_start = t
+        self.path = path
+        r = self.rng.random()
+        if r < self.drop_rate:
+            self.counts['dropped'] += 1
+            self.t_ready = float('inf')
+            return
+        self.t_ready = t + self.exposure + self.readout_time
+        if r < self.drop_rate + self.late_rate:
+            self.counts['late'] += 1
+            self.t_ready += self.late_delay
+
+    def ready(self):
+        return self.t_ready is not None and time.perf_counter() >= self.t_ready
+
+    def fill(self, out):
+        """
+        Copy the pending frame into `out` (flat uint16 array) and end the acquisition.
+        """
+        out[:self.pattern.size] = self.pattern.ravel()
+        out[0] = self.number & 0xffff
+        out[1] = (self.number >> 16) & 0xffff
+        self.counts['frames'] += 1
+        self.t_ready = None
+
+    def stats(self):
+        return dict(self.counts)
+
+
+_camera = None
+
+
+def shared_camera():
+    """
+    The camera configured by the PSCAMERA_SIMULATOR environment variable ('1' or 'key=value,...',
+    with shape=HEIGHTxWIDTH), shared by both simulated libraries.
+    """
+    global _camera
+    if _camera is None:
+        options = {}
+        for item in os.environ.get('PSCAMERA_SIMULATOR', '').split(','):
+            if '=' not in item:
+                continue
+            key, value = (s.strip() for s in item.split('=', 1))
+            try:
+                options[key] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                options[key] = value
+        shape = options.get('shape')
+        if isinstance(shape, str):
+            options['shape'] = tuple(int(n) for n in shape.lower().split('x'))
+        elif isinstance(shape, int):
+            options['shape'] = (shape, shape)
+        _camera = SimulatedCamera(**options)
+    return _camera
+
+
+class SimulatedCameraLibrary:
+    """
+    Stand-in for PS_camera.dll.
+    """
+
+    def __init__(self, camera=None):
+        self.camera = camera or shared_camera()
+
+    def AcquisitionInit(self, mac, ip):
+        time.sleep(self.camera.init_time)
+        self.camera.initialized = True
+        return 0
+
+    def Configuration(self, exposure_us):
+        self.camera.exposure = _in(exposure_us) * 1e-6
+        return 0
+
+    def AcquisitionFetch(self, tif_path):
+        """
+        1 once the frame is written to tif_path, 0 while the acquisition is in progress.
+        """
+        camera = self.camera
+        path = _in(tif_path)
+        with camera.lock:
+            if not camera.initialized:
+                return -1
+            lost = camera.t_ready == float('inf') and time.perf_counter() > camera.t_start + camera.drop_timeout
+            if camera.t_ready is None or camera.path != path or lost:
+                camera.start(path)
+            if not camera.ready():
+                return 0
+            frame = np.empty(camera.pattern.size, np.uint16)
+            camera.fill(frame)
+        if camera.write_files:
+            import tifffile
+            tifffile.imwrite(path, frame.reshape(camera.shape))
+        return 1
+
+    def AcquisitionClose(self):
+        self.camera.initialized = False
+        self.camera.t_ready = None
+        return 0
+
+
+class SimulatedSensorLibrary:
+    """
+    Stand-in for gsense4040control_x64.dll (functions used by FrameBuffer).
+    """
+
+    def __init__(self, camera=None):
+        self.camera = camera or shared_camera()
+        self.buffer = None
+
+    def PSL_VHR_set_customers_buffer(self, ptr):
+        h, w = self.camera.shape
+        self.buffer = np.ctypeslib.as_array(ctypes.cast(ptr, ctypes.POINTER(ctypes.c_uint16)), shape=(h * w,))
+        return True
+
+    def PSL_VHR_Snap_and_return(self):
+        if self.buffer is None:
+            return False
+        with self.camera.lock:
+            self.camera.start()
+        return True
+
+    def PSL_VHR_Get_snap_status(self):
+        camera = self.camera
+        with camera.lock:
+            if not camera.ready():
+                return False
+            camera.fill(self.buffer)
+        return True
+
+    def PSL_VHR_abort_snap(self):
+        self.camera.t_ready = None
+        return True
+
+    def PSL_VHR_apply_post_snap_processing(self, ptr):
+        if self.camera.processing_time:
+            time.sleep(self.camera.processing_time)
+        return True
+
+    def PSL_VHR_get_width(self):
+        return self.camera.shape[1]
+
+    def PSL_VHR_get_height(self):
+        return self.camera.shape[0]
@@ -0,0 +1,140 @@
+"""
+Bounded, CPU-friendly polling for PS camera acquisitions.
+
+`AcquisitionFetch` has to be called repeatedly until it reports a finished
+frame. Calling it in a tight loop pins a core for the whole exposure and never
+gives up if a frame is lost. `StagedWait` polls in stages instead:
+
+* one immediate poll (in case the call itself triggers the acquisition),
+* a plain sleep until shortly before the expected end of the exposure,
+* a short spin phase (tight polling) around the expected end,
+* a yield phase (`time.sleep(0)`) that gives other threads a chance to run,
+* a sleep phase with a growing interval,
+
+with a hard timeout and an abort hook. The delay between the end of the
+exposure and the successful poll (readout included) is recorded as the fetch
+latency.
+"""
+import time
+import threading
+from collections import deque
+
+
+class StagedWait:
+    """
+    Poll a completion callable with a spin → yield → sleep backoff.
+    """
+
+    def __init__(self, spin_time=2e-3, yield_time=1e-2, min_sleep=1e-3, max_sleep=2e-2,
+                 wake_ahead=5e-3, timeout_margin=5., history=1000):
+        """
+        Args:
+            spin_time: duration (s) of the tight polling phase.
+            yield_time: duration (s) of the yielding phase that follows.
+            min_sleep, max_sleep: bounds of the sleep interval (s) in the last phase.
+            wake_ahead: how early (s) before the expected end polling resumes.
+            timeout_margin: time (s) allowed after the expected end before giving up.
+            history: number of fetch latencies kept for statistics.
+        """
+        self.spin_time = spin_time
+        self.yield_time = yield_time
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.wake_ahead = wake_ahead
+        self.timeout_margin = timeout_margin
+        self.latencies = deque(maxlen=history)
+        self.counts = {'fetches': 0, 'polls': 0, 'timeouts': 0, 'aborts': 0}
+        self._abort = threading.Event()
+
+    def abort(self):
+        """
+        Interrupt the current wait.
+        """
+        self._abort.set()
+
+    def reset(self):
+        """
+        Clear a previous abort. Called before the acquisition starts, so that an abort
+        arriving before the wait still interrupts it.
+        """
+        self._abort.clear()
+
+    def wait(self, poll, expected=0., on_expected=None):
+        """
+        Call `poll` until it returns True.
+
+        Args:
+            poll: callable returning True once the frame is available.
+            expected: expected duration (s) of the exposure. Polling stays fast from then on.
+            on_expected: called once, when the expected end is reached or when the wait ends,
+                whichever comes first (e.g. to let the stage move during the readout).
+
+        Returns:
+            True if the frame was fetched, False if the wait was aborted.
+
+        Raises:
+            TimeoutError if nothing came within expected + timeout_margin.
+        """
+        t0 = time.perf_counter()
+        t_expected = t0 + expected
+        deadline = t_expected + self.timeout_margin
+        polls = 0
+
+        def done():
+            nonlocal polls
+            polls += 1
+            return poll()
+
+        try:
+            finished = done()
+            if not finished:
+                # Nothing to do until the exposure is nearly over
+                self._abort.wait(max(0., t_expected - self.wake_ahead - time.perf_counter()))
+
+            interval = self.min_sleep
+            while not finished:
+                if self._abort.is_set():
+                    self.counts['aborts'] += 1
+                    self.counts['polls'] += polls
+                    return False
+                now = time.perf_counter()
+                if on_expected is not None and now >= t_expected:
+                    on_expected, expected_end = None, on_expected
+                    expected_end()
+                if now > deadline:
+                    self.counts['timeouts'] += 1
+                    self.counts['polls'] += polls
+                    raise TimeoutError(f'No frame after {now - t0:.3f} s (expected {expected:.3f} s).')
+                finished = done()
+                if finished:
+                    break
+                late = now - t_expected + self.wake_ahead
+                if late < self.spin_time:
+                    continue
+                elif late < self.spin_time + self.yield_time:
+                    time.sleep(0)
+                else:
+                    self._abort.wait(interval)
+                    interval = min(2 * interval, self.max_sleep)
+        finally:
+            if on_expected is not None:
+                on_expected()
+
+        self.counts['fetches'] += 1
+        self.counts['polls'] += polls
+        self.latencies.append(time.perf_counter() - t_expected)
+        return True
+
+    def stats(self):
+        """
+        Fetch latency statistics (s) and poll counts.
+        """
+        stats = dict(self.counts)
+        latencies = sorted(self.latencies)
+        if latencies:
+            n = len(latencies)
+            stats.update({'latency_mean': sum(latencies) / n,
+                          'latency_p50': latencies[n // 2],
+                          'latency_p99': latencies[min(n - 1, int(.99 * n))],
+                          'latency_max': latencies[-1]})
+        return stats
@@ -0,0 +1,273 @@
+"""
+Background frame writer: encode and write frames on a pool of processes.
+
+Writing a 32 MB frame to a network share takes longer than acquiring it. The
+`FrameWriter` decouples the two: `submit` copies the frame into a free
+shared-memory slot and returns, a worker process attaches to the slot, writes
+the file and frees the slot.
+
+The slots form the bounded queue. When all of them are busy, `submit` applies
+the configured policy:
+
+* 'block': wait for a slot (up to `block_timeout`, forever if None),
+* 'drop': discard the frame,
+* 'spill': write the frame synchronously to a local directory instead. Spilled
+  frames can be copied to their destination later with `resubmit_spilled`.
+
+Files are written with `tifffile`, which must be installed where the
+writer runs.
+"""
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+POLICIES = ('block', 'drop', 'spill')
+
+
+def _write_tiff(path, frame):
+    """
+    Write `frame` to `path` as tiff.
+    """
+    import tifffile
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tifffile.imwrite(path, frame)
+
+
+def _write_from_shared(slot_name, shape, dtype, path):
+    """
+    Worker process entry point: write the frame stored in shared memory slot `slot_name`.
+
+    Returns:
+        (number of bytes, write time in s)
+    """
+    t0 = time.perf_counter()
+    shm = shared_memory.SharedMemory(name=slot_name)
+    try:
+        frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _write_tiff(path, frame)
+        nbytes = frame.nbytes
+        del frame
+    finally:
+        shm.close()
+    return nbytes, time.perf_counter() - t0
+
+
+def _copy(src, dst):
+    """
+    Worker process entry point: copy a spilled file to its destination.
+    """
+    t0 = time.perf_counter()
+    d = os.path.dirname(dst)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    shutil.copyfile(src, dst)
+    os.remove(src)
+    return os.path.getsize(dst), time.perf_counter() - t0
+
+
+class FrameWriter:
+    """
+    Bounded, process-based frame writer with backpressure policies.
+    """
+
+    def __init__(self, max_queue=8, processes=2, policy='block', spill_path=None, block_timeout=None):
+        """
+        Args:
+            max_queue: number of frames that can be waiting or being written.
+            processes: number of writer processes.
+            policy: what to do when the queue is full: 'block', 'drop' or 'spill'.
+            spill_path: local directory for spilled frames (required for 'spill').
+            block_timeout: maximum time (s) to wait for a slot with the 'block' policy.
+        """
+        self.max_queue = max_queue
+        self.processes = processes
+        self.policy = policy
+        self.spill_path = spill_path
+        self.block_timeout = block_timeout
+
+        self.pool = ProcessPoolExecutor(max_workers=processes)
+        self.slots = []
+        self.slot_size = 0
+        self.free = []
+        self.cond = threading.Condition()
+        self.spilled = []
+        self.copying = 0      # spilled files queued for copy and not copied yet
+        self.closed = False
+        self.errors = []
+        self.counts = {'submitted': 0, 'written': 0, 'dropped': 0, 'spilled': 0, 'failed': 0,
+                       'bytes_written': 0, 'write_time': 0., 'max_depth': 0, 'blocked_time': 0.}
+        self.t_start = time.perf_counter()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, value):
+        if value not in POLICIES:
+            raise ValueError(f'Unknown policy {value}. Should be one of {POLICIES}.')
+        self._policy = value
+
+    @property
+    def depth(self):
+        """
+        Number of frames waiting or being written.
+        """
+        return len(self.slots) - len(self.free) if self.slots else 0
+
+    def _allocate(self, size):
+        """
+        Create the shared memory slots, large enough for frames of `size` bytes.
+        Must be called with self.cond held and no frame in flight.
+        """
+        self._release_slots()
+        self.slots = [shared_memory.SharedMemory(create=True, size=size) for _ in range(self.max_queue)]
+        self.free = list(range(self.max_queue))
+        self.slot_size = size
+
+    def _release_slots(self):
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+        self.slots = []
+        self.free = []
+
+    def submit(self, frame, path):
+        """
+        Queue `frame` to be written to `path`. The frame is copied, so the caller can
+        reuse its buffer as soon as this returns.
+
+        Returns:
+            True if the frame was queued, False if it was dropped or spilled.
+        """
+        with self.cond:
+            if frame.nbytes > self.slot_size:
+                # First frame, or larger frames: wait for the writers to be done and reallocate
+                while self.depth:
+                    self.cond.wait()
+                self._allocate(frame.nbytes)
+
+            spill = False
+            if not self.free:
+                if self.policy == 'drop':
+                    self.counts['dropped'] += 1
+                    return False
+                if self.policy == 'spill':
+                    spill = True
+                else:
+                    t0 = time.perf_counter()
+                    if not self.cond.wait_for(lambda: self.free, timeout=self.block_timeout):
+                        raise TimeoutError(f'No free writer slot after {self.block_timeout} s.')
+                    self.counts['blocked_time'] += time.perf_counter() - t0
+
+            if not spill:
+                i = self.free.pop()
+                self.counts['submitted'] += 1
+                self.counts['max_depth'] = max(self.counts['max_depth'], self.depth)
+
+        if spill:
+            self._spill(frame, path)
+            return False
+
+        shm = self.slots[i]
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf)[:] = frame
+        future = self.pool.submit(_write_from_shared, shm.name, frame.shape, frame.dtype.str, path)
+        future.add_done_callback(lambda f: self._done(f, i, path))
+        return True
+
+    def _spill(self, frame, path):
+        """
+        Write the frame synchronously to the local spill directory.
+        """
+        if self.spill_path is None:
+            raise RuntimeError("Policy 'spill' requires a spill_path.")
+        with self.cond:
+            n = self.counts['spilled']
+            self.counts['spilled'] += 1
+        local = os.path.join(self.spill_path, f'{n:06d}_{os.path.basename(path)}')
+        _write_tiff(local, frame)
+        with self.cond:
+            self.spilled.append((local, path))
+
+    def _done(self, future, i, path):
+        """
+        Called when a write finishes: update statistics and free the slot.
+        """
+        with self.cond:
+            self._account(future, path)
+            if i is not None:
+                self.free.append(i)
+            else:
+                self.copying -= 1
+            self.cond.notify_all()
+
+    def _account(self, future, path):
+        error = future.exception()
+        if error is not None:
+            self.counts['failed'] += 1
+            self.errors.append((path, repr(error)))
+            print(f'Writing {path} failed: {error!r}')
+            return
+        nbytes, dt = future.result()
+        self.counts['written'] += 1
+        self.counts['bytes_written'] += nbytes
+        self.counts['write_time'] += dt
+
+    def resubmit_spilled(self):
+        """
+        Copy all spilled frames to their destination (in the writer processes).
+
+        Returns:
+            the number of files queued for copy.
+        """
+        with self.cond:
+            spilled, self.spilled = self.spilled, []
+            self.copying += len(spilled)  # waited for by flush
+        for local, path in spilled:
+            future = self.pool.submit(_copy, local, path)
+            future.add_done_callback(lambda f, path=path: self._done(f, None, path))
+        return len(spilled)
+
+    def flush(self, timeout=None):
+        """
+        Wait until all queued frames are written and all resubmitted spilled frames are copied.
+
+        Returns:
+            True if the queue is empty, False on timeout.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.depth == 0 and self.copying == 0, timeout=timeout)
+
+    def stats(self):
+        """
+        Queue depth and write throughput.
+        """
+        with self.cond:
+            stats = dict(self.counts)
+            stats['depth'] = self.depth
+            stats['copying'] = self.copying
+        elapsed = time.perf_counter() - self.t_start
+        stats['throughput_MBps'] = stats['bytes_written'] / elapsed * 1e-6 if elapsed > 0 else 0.
+        if stats['written']:
+            stats['mean_write_time'] = stats['write_time'] / stats['written']
+        stats['policy'] = self.policy
+        return stats
+
+    def close(self):
+        """
+        Write everything still queued, stop the workers and free the shared memory.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.pool.shutdown(wait=True)
+        with self.cond:
+            self._release_slots()
@@ -0,0 +1,83 @@
+"""
+Calls per second of hot PDXC getters: `pdxc` class vs `PDXCBinding`.
+
+Opens the first connected controller (or the one with serial --serial) and
+times each getter with the original `pdxc` methods, the binding with its
+default prototypes and the binding with all argtypes declared (strict).
+
+    python bench_pdxc_binding.py --calls 2000 --json binding.json
+
+Run it from a directory containing PDXC_COMMAND_LIB_win64.dll (or pass --dll).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDXC'))
+
+from PDXC_COMMAND_LIB import pdxc
+from PDXCBinding import PDXCBinding, LIBRARY_PATH
+
+GETTERS = ['GetCurrentPosition', 'GetSpeedStageType', 'GetOpenLoopFrequency3', 'GetCurrentStatus']
+
+
+def rate(call, n):
+    """
+    Calls per second of call() over n calls.
+    """
+    t0 = time.perf_counter()
+    for _ in range(n):
+        call()
+    return n / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dll', default=LIBRARY_PATH, help='path of the PDXC command library')
+    parser.add_argument('--serial', default=None, help='serial number of the controller (default: first found)')
+    parser.add_argument('--secondary', type=int, default=0, help='index in daisy chain')
+    parser.add_argument('--calls', type=int, default=2000, help='calls per getter and implementation')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    args = parser.parse_args()
+
+    pdxc.load_library(args.dll)
+    device = pdxc()
+    serial = args.serial
+    if serial is None:
+        devs = pdxc.ListDevices()
+        if not devs:
+            sys.exit('There is no devices connected')
+        serial = devs[0][0]
+    if device.Open(serial, 115200, 3) < 0:
+        sys.exit(f'open {serial} failed')
+
+    fast = PDXCBinding(device.hdl)
+    strict = PDXCBinding(device.hdl, strict=True)
+    results = {}
+    try:
+        for name in GETTERS:
+            out = [None]
+            legacy = getattr(device, name)
+            bound = getattr(fast, name)
+            checked = getattr(strict, name)
+            results[name] = {
+                'pdxc': rate(lambda: legacy(args.secondary, out), args.calls),
+                'binding': rate(lambda: bound(args.secondary), args.calls),
+                'binding_strict': rate(lambda: checked(args.secondary), args.calls),
+            }
+    finally:
+        device.Close()
+
+    print(f"{'getter':<24}{'pdxc':>12}{'binding':>12}{'strict':>12}{'speedup':>10}  (calls/s)")
+    for name, r in results.items():
+        print(f"{name:<24}{r['pdxc']:>12.0f}{r['binding']:>12.0f}{r['binding_strict']:>12.0f}"
+              f"{r['binding'] / r['pdxc']:>10.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'serial': serial, 'calls': args.calls, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
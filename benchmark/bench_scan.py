@@ -0,0 +1,193 @@
+"""
+Step-and-acquire scan throughput: steps/s, frames/s, MB/s and step time percentiles.
+
+Runs `StepScan` (demo/scan_engine.py) for every combination of step count,
+exposure time, frame size and output target, and reports for each run the
+throughput, the step time percentiles, the move and acquisition call latencies
+(from the drivers' call_stats) and the writer throughput.
+
+Output targets:
+
+* memory: frames acquired in memory (as Camera_Snap), no file;
+* writer: frames acquired in memory and written by the camera's background writer;
+* fetch:  frames written by PS_camera.dll (as Camera_Acquisition).
+
+The acquisition latency is that of Camera_Expose, which returns at the end of the exposure.
+
+By default the drivers are created in this process on the simulated backends
+(PDXCSimulator, PSCameraSimulator). With --remote the scan uses the clients of
+running servers (real or simulated); frame sizes can then not be changed.
+
+    python bench_scan.py --steps 10 50 --exposure 1000 100000 --frame-size 4096 2048 --json scan.json
+    python bench_scan.py --baseline scan.json --tolerance 0.1    # exit code 1 if slower by more than 10%
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import argparse
+import itertools
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for d in ('PDXC', 'PSCamera', 'common', 'demo'):
+    sys.path.insert(0, os.path.join(HERE, '..', d))
+
+TARGETS = ('memory', 'writer', 'fetch')
+
+
+def percentiles(values):
+    """
+    {'p50', 'p95', 'p99', 'max'} of `values` (None if empty).
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    n = len(values)
+    return {'p50': values[n // 2],
+            'p95': values[min(n - 1, int(.95 * n))],
+            'p99': values[min(n - 1, int(.99 * n))],
+            'max': values[-1]}
+
+
+def call_latency(stats, name):
+    """
+    exec time summary of `name` from a call_stats() report, in s.
+    """
+    entry = stats.get(name)
+    return entry['exec'] if entry else None
+
+
+def connect(args):
+    """
+    (stage, camera, simulated camera or None)
+    """
+    if not args.remote:
+        os.environ.setdefault('PDXC_SIMULATOR', '1')
+        os.environ.setdefault('PSCAMERA_SIMULATOR', f'readout_time={args.readout_time},init_time=0')
+    from PDXCServer import PDXCDriver
+    from PSCameraServer import PSCameraDriver
+    if args.remote:
+        stage = PDXCDriver.Client()
+        camera = PSCameraDriver.Client()
+        stage.ask_admin(True)
+        camera.ask_admin(True)
+        return stage, camera, None
+    from PSCameraSimulator import shared_camera
+    return PDXCDriver(), PSCameraDriver(), shared_camera()
+
+
+def run_one(stage, camera, args, n_steps, exposure, target, frame_size, step_size):
+    from scan_engine import StepScan
+    camera.Camera_Configuration(exposure)
+    data_path = os.path.join(args.data_path, f'{target}_{n_steps}_{exposure}_{frame_size}')
+    file_name = None if target == 'memory' else 'test{index}.tif'
+    scan = StepScan(stage, camera, step_size, exposure, data_path, file_name=file_name, in_memory=target != 'fetch')
+    stage.call_stats(reset=True)
+    camera.call_stats(reset=True)
+    written = camera.writer_stats()['bytes_written']
+
+    report = scan.run(n_steps)
+    t0 = time.perf_counter()
+    camera.writer_flush()
+    flush_time = time.perf_counter() - t0
+
+    total_time = report['wall_time'] + flush_time
+    frame_bytes = frame_size * frame_size * 2
+    stage_stats = stage.call_stats()
+    camera_stats = camera.call_stats()
+    move_name = 'move_forward' if step_size >= 0 else 'move_back'
+    return {'steps': n_steps,
+            'exposure_us': exposure,
+            'frame_size': frame_size,
+            'target': target,
+            'wall_time': report['wall_time'],
+            'flush_time': flush_time,
+            'steps_per_second': report['steps_per_second'],
+            'frames_per_second': n_steps / total_time,
+            'MB_per_second': n_steps * frame_bytes / total_time * 1e-6,
+            'step_time': percentiles(scan.step_times),
+            'move': call_latency(stage_stats, move_name),
+            'acquisition': call_latency(camera_stats, 'Camera_Expose'),
+            'bytes_written': camera.writer_stats()['bytes_written'] - written}
+
+
+def key(run):
+    return run['steps'], run['exposure_us'], run['frame_size'], run['target']
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Print the steps/s change against a previous result file. Returns the configurations slower than tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = {key(r): r for r in json.load(f)['runs']}
+    slower = []
+    print(f"\ncompared to {baseline_path}:")
+    for run in results:
+        old = baseline.get(key(run))
+        if old is None or not old['steps_per_second']:
+            continue
+        change = run['steps_per_second'] / old['steps_per_second'] - 1.
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            slower.append(key(run))
+        print(f"{str(key(run)):<40}{old['steps_per_second']:>10.2f} -> {run['steps_per_second']:>8.2f} steps/s "
+              f"({change * 100:+.1f}%){flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--steps', type=int, nargs='+', default=[20], help='numbers of steps')
+    parser.add_argument('--exposure', type=int, nargs='+', default=[10000], help='exposure times (µs)')
+    parser.add_argument('--frame-size', type=int, nargs='+', default=[4096],
+                        help='frame sizes (pixels per side, simulated camera only)')
+    parser.add_argument('--target', nargs='+', choices=TARGETS, default=['writer'], help='output targets')
+    parser.add_argument('--step-size', type=int, default=100,
+                        help='pulses per step, the direction alternates from one run to the next')
+    parser.add_argument('--readout-time', type=float, default=0.05, help='readout time (s) of the simulated camera')
+    parser.add_argument('--data-path', default=os.path.join(tempfile.gettempdir(), 'bench_scan'),
+                        help='directory of the written frames (seen from the camera server)')
+    parser.add_argument('--remote', action='store_true', help='use the clients of running servers')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--baseline', default=None, help='previous --json result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative steps/s loss against the baseline reported as a regression')
+    args = parser.parse_args()
+    if args.remote and args.frame_size != [4096]:
+        parser.error('--frame-size is only supported with the simulated camera')
+
+    stage, camera, simulated_camera = connect(args)
+    camera.Camera_Init('00:00:00:00:00:00', '127.0.0.1')
+    results = []
+    configurations = itertools.product(args.frame_size, args.steps, args.exposure, args.target)
+    for i, (frame_size, n_steps, exposure, target) in enumerate(configurations):
+        if simulated_camera is not None:
+            simulated_camera.set_shape((frame_size, frame_size))
+        # back and forth, so that long benchmarks don't run into the end of travel
+        step_size = args.step_size if i % 2 == 0 else -args.step_size
+        run = run_one(stage, camera, args, n_steps, exposure, target, frame_size, step_size)
+        results.append(run)
+        st = run['step_time']
+        print(f"{target:<7} {frame_size:>5}px {n_steps:>5} steps {exposure:>8} µs: "
+              f"{run['steps_per_second']:7.2f} steps/s {run['frames_per_second']:7.2f} frames/s "
+              f"{run['MB_per_second']:8.1f} MB/s  step p50 {st['p50'] * 1e3:.1f} ms p99 {st['p99'] * 1e3:.1f} ms")
+    camera.Camera_Close()  # also closes the writer
+
+    slower = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    if args.json:
+        meta = {'time': time.time(), 'host': socket.gethostname(), 'python': platform.python_version(),
+                'simulated': simulated_camera is not None, 'step_size': args.step_size,
+                'readout_time': args.readout_time if simulated_camera is not None else None}
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'runs': results}, f, indent=2)
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Socket transport benchmark: commands/s of lclib's SocketDriverBase against common/transport.py.
+
+A fake device (a thread of this process, on a local port) answers every line
+with a reply of the requested size. For each reply size the benchmark sends
+--commands commands with:
+
+* base:      SocketDriverBase.device_cmd (listening thread, recv(1024) concatenation);
+* buffered:  BufferedSocketDriverBase.device_cmd (recv_into a preallocated buffer);
+* pipelined: BufferedSocketDriverBase.device_cmds, PIPELINE_DEPTH commands in flight.
+
+    python bench_transport.py --reply-size 16 1024 65536 1048576 --commands 2000 --json transport.json
+
+--latency adds a processing time (s) to every command of the fake device.
+The device handles its commands one after the other, so pipelining then only
+saves the round trips, not the processing time.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'common'))
+
+import lclib
+from lclib.base import SocketDriverBase
+from transport import BufferedSocketDriverBase
+
+
+class FakeDevice:
+    """
+    Line-based device answering every command with `reply_size` bytes (EOL included).
+    """
+
+    def __init__(self, latency=0.):
+        self.latency = latency
+        self.reply = b'\n'
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.address = self.server.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def set_reply_size(self, size):
+        self.reply = b'x' * (size - 1) + b'\n'
+
+    def _accept(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn, conn.makefile('rb') as f:
+            for line in f:
+                if self.latency:
+                    time.sleep(self.latency)
+                conn.sendall(self.reply)
+
+
+class BaseDevice(SocketDriverBase):
+    def init_device(self):
+        self.initialized = True
+
+
+class BufferedDevice(BufferedSocketDriverBase):
+    def init_device(self):
+        self.initialized = True
+
+
+def run(driver, mode, n, reply_size):
+    """
+    Commands per second (and check of the reply sizes).
+    """
+    cmd = b'GET?\n'
+    t0 = time.perf_counter()
+    if mode == 'pipelined':
+        replies = driver.device_cmds([cmd] * n)
+    else:
+        replies = [driver.device_cmd(cmd) for _ in range(n)]
+    elapsed = time.perf_counter() - t0
+    bad = sum(len(r) != reply_size for r in replies)
+    return {'mode': mode, 'reply_size': reply_size, 'commands': n, 'elapsed': elapsed,
+            'commands_per_second': n / elapsed, 'MB_per_second': n * reply_size / elapsed * 1e-6,
+            'bad_replies': bad}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reply-size', type=int, nargs='+', default=[16, 1024, 65536, 1048576],
+                        help='reply sizes (bytes)')
+    parser.add_argument('--commands', type=int, default=2000, help='commands per measurement')
+    parser.add_argument('--depth', type=int, default=16, help='pipeline depth')
+    parser.add_argument('--latency', type=float, default=0., help='reply delay (s) of the fake device')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--lab', default='bench', help='lclib lab name, if lclib is not initialized yet '
+                                                        '(the drivers keep their config under ~/.<lab>-lclib)')
+    args = parser.parse_args()
+    if 'conf_path' not in lclib.get_config():
+        lclib.init(args.lab, host_ips={'control': '127.0.0.1'})
+
+    device = FakeDevice(args.latency)
+    BufferedDevice.PIPELINE_DEPTH = args.depth
+    drivers = {'base': BaseDevice(device.address), 'buffered': BufferedDevice(device.address)}
+    drivers['pipelined'] = drivers['buffered']
+    results = []
+    for size in args.reply_size:
+        device.set_reply_size(size)
+        # fewer commands for large replies, so that every size takes about as long
+        n = max(20, min(args.commands, int(args.commands * 1024 / size)))
+        for mode, driver in drivers.items():
+            r = run(driver, mode, n, size)
+            results.append(r)
+            print(f"{mode:<10}{size:>10} B {r['commands_per_second']:>12.0f} commands/s {r['MB_per_second']:>10.1f} MB/s"
+                  + (f"  {r['bad_replies']} bad replies" if r['bad_replies'] else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'depth': args.depth, 'latency': args.latency, 'runs': results}, f, indent=2)
+    for driver in set(drivers.values()):
+        driver.shutdown()
+        driver.close_device()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Load generator for the proxy servers: N concurrent clients, calls/s, tail latency and failures.
+
+Each client is a separate `Driver.Client(admin=False)` (own rpyc connection)
+running on its own thread and issuing calls drawn from a weighted mix. A call
+is written as Python, optionally followed by @weight:
+
+    python rpc_load.py --driver pdxc --clients 1 4 16 --duration 20 \\
+        --call "status()@10" --call "status(max_age=0)@1" --call "axes@5" --call "read_profile()@1"
+
+Names are checked against the driver API: properties are read, methods are
+called, blocking or not (non-blocking calls wait for their result, as the
+clients do by default). Every level of --clients runs for --duration seconds
+after --warmup seconds. By default each client calls as fast as it can; with
+--rate each client sends calls at that rate, and latencies are measured from
+the scheduled send time (queueing behind a slow call counts).
+
+Every call has a deadline (--deadline). A call still running at its deadline
+counts as failed (DeadlineExceeded) and its client is abandoned: it is
+reported as stuck, and the level goes on with the other clients. lclib
+clients can lose the result of a non-blocking call that returns at once and
+then wait forever, so the default mixes only use blocking calls and
+properties.
+
+For each call and in total the report gives calls/s, failures by error type
+and the p50/p90/p99/p99.9/max latency. --server-stats resets and fetches the
+server's call_stats, which splits the latency into queueing (lock contention),
+execution and dll time.
+
+The clients are not admin: admin-only calls fail unless --admin makes the
+first client ask for it (which takes it away from the current admin).
+"""
+import os
+import sys
+import ast
+import json
+import time
+import random
+import threading
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for d in ('PDXC', 'PSCamera', 'common'):
+    sys.path.insert(0, os.path.join(HERE, '..', d))
+
+from callstats import Histogram
+
+# --driver: (server module, driver class, default mix of blocking calls and properties)
+DRIVERS = {
+    'pdxc': ('PDXCServer', 'PDXCDriver', ['status()@10', 'axes@5', 'move_stats()@2', 'read_profile()@1']),
+    'pscamera': ('PSCameraServer', 'PSCameraDriver', ['fetch_stats()@10', 'writer_stats()@5', 'writer_policy@2']),
+}
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class DeadlineExceeded(Exception):
+    """
+    A call did not return within --deadline.
+    """
+
+
+class Call:
+    """
+    One entry of the call mix.
+    """
+
+    def __init__(self, spec, api):
+        expression, _, weight = spec.partition('@')
+        self.spec = expression.strip()
+        self.weight = float(weight) if weight else 1.
+        node = ast.parse(self.spec, mode='eval').body
+        if isinstance(node, ast.Call):
+            self.name = node.func.id
+            self.args = [ast.literal_eval(a) for a in node.args]
+            self.kwargs = {k.arg: ast.literal_eval(k.value) for k in node.keywords}
+        else:
+            self.name = node.id
+            self.args, self.kwargs = None, None
+        info = api.get(self.name)
+        if info is None:
+            raise ValueError(f'{self.name} is not part of the driver API.')
+        self.property = info['property']
+        if self.property and self.args is not None:
+            raise ValueError(f'{self.name} is a property: write it without arguments.')
+        if not self.property and self.args is None:
+            raise ValueError(f'{self.name} is a method: write {self.name}(...).')
+        self.kind = 'property' if self.property else ('blocking' if info['block'] else 'non-blocking')
+
+    def __call__(self, client):
+        if self.property:
+            return getattr(client, self.name)
+        return getattr(client, self.name)(*self.args, **self.kwargs)
+
+
+class Recorder:
+    """
+    Latencies and failures of each call, shared by the client threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.failures = {}
+        self.recording = False
+
+    def record(self, spec, latency, error=None):
+        if not self.recording:
+            return
+        with self.lock:
+            if spec not in self.histograms:
+                self.histograms[spec] = Histogram()
+                self.failures[spec] = Counter()
+            self.histograms[spec].add(latency)
+            if error is not None:
+                self.failures[spec][type(error).__name__] += 1
+
+    def report(self, duration):
+        def summary(h, failures):
+            n = h.count
+            out = {'calls': n, 'calls_per_second': n / duration,
+                   'failures': sum(failures.values()), 'failure_rate': sum(failures.values()) / n if n else 0.,
+                   'errors': dict(failures), 'mean': h.total / n if n else None, 'max': h.max if n else None}
+            out.update({f'p{p:g}': h.percentile(p) for p in PERCENTILES})
+            return out
+
+        with self.lock:
+            total = Histogram()
+            total_failures = Counter()
+            for spec, h in self.histograms.items():
+                total.merge(h)
+                total_failures.update(self.failures[spec])
+            return {'total': summary(total, total_failures),
+                    'calls': {spec: summary(h, self.failures[spec]) for spec, h in self.histograms.items()}}
+
+
+def client_loop(driver, index, calls, recorder, stop, args, ready, stuck):
+    try:
+        client = driver.Client(admin=args.admin and index == 0, address=args.address)
+    except Exception as error:
+        print(f'client {index}: connection failed: {error}')
+        ready.release()
+        return
+    ready.release()
+    # The calls run on a helper thread, so that a call that never returns can be given up
+    caller = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'rpc-load-{index}')
+    rng = random.Random(args.seed + index)
+    weights = [c.weight for c in calls]
+    period = 1. / args.rate if args.rate else 0.
+    next_call = time.perf_counter()
+    try:
+        while not stop.is_set():
+            call = rng.choices(calls, weights)[0]
+            if period:
+                # Open loop: the latency counts from the scheduled time
+                delay = next_call - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                t0 = next_call
+                next_call += period
+            else:
+                t0 = time.perf_counter()
+            future = caller.submit(call, client)
+            try:
+                future.result(timeout=max(0., t0 + args.deadline - time.perf_counter()))
+                recorder.record(call.spec, time.perf_counter() - t0)
+            except FutureTimeout:
+                recorder.record(call.spec, time.perf_counter() - t0, DeadlineExceeded())
+                stuck[index] = call.spec
+                return  # the client is blocked in the call: abandon it
+            except Exception as error:
+                recorder.record(call.spec, time.perf_counter() - t0, error)
+    finally:
+        caller.shutdown(wait=False)
+        if index not in stuck:
+            client.disconnect()
+
+
+def run_level(driver, n_clients, calls, args):
+    """
+    Run n_clients clients for warmup + duration seconds. Returns the report.
+    """
+    recorder = Recorder()
+    stop = threading.Event()
+    ready = threading.Semaphore(0)
+    stuck = {}
+    threads = [threading.Thread(target=client_loop, args=(driver, i, calls, recorder, stop, args, ready, stuck),
+                                daemon=True)
+               for i in range(n_clients)]
+    for t in threads:
+        t.start()
+    for _ in threads:
+        ready.acquire()
+    time.sleep(args.warmup)
+    recorder.recording = True
+    t0 = time.perf_counter()
+    time.sleep(args.duration)
+    recorder.recording = False
+    duration = time.perf_counter() - t0
+    stop.set()
+    t_end = time.perf_counter() + args.deadline + 5.
+    for i, t in enumerate(threads):
+        t.join(max(0., t_end - time.perf_counter()))
+        if t.is_alive():
+            stuck.setdefault(i, 'disconnect')
+    report = recorder.report(duration)
+    report.update({'clients': n_clients, 'duration': duration,
+                   'stuck_clients': {str(i): spec for i, spec in sorted(stuck.items())}})
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['clients']} client(s), {report['duration']:.1f} s")
+    print(f"{'call':<32}{'calls/s':>10}{'fail %':>8}" + ''.join(f"{'p' + format(p, 'g'):>10}" for p in PERCENTILES) +
+          f"{'max':>10}  (ms)")
+    rows = list(report['calls'].items()) + [('total', report['total'])]
+    for spec, r in rows:
+        line = f"{spec:<32}{r['calls_per_second']:>10.1f}{r['failure_rate'] * 100:>8.2f}"
+        for p in PERCENTILES:
+            v = r[f'p{p:g}']
+            line += f"{v * 1e3:>10.2f}" if v is not None else f"{'-':>10}"
+        line += f"{r['max'] * 1e3:>10.2f}" if r['max'] is not None else f"{'-':>10}"
+        print(line)
+    for spec, r in report['calls'].items():
+        if r['errors']:
+            print(f"  {spec}: {r['errors']}")
+    for i, spec in report['stuck_clients'].items():
+        print(f"  client {i} stuck in {spec}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--driver', choices=DRIVERS, default='pdxc', help='driver whose server is loaded')
+    parser.add_argument('--address', default=None, help='server address host:port (default: the driver ADDRESS)')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4], help='numbers of concurrent clients')
+    parser.add_argument('--call', action='append', default=None, help='call of the mix, e.g. "status(max_age=0)@5"')
+    parser.add_argument('--duration', type=float, default=10., help='measured time (s) per level')
+    parser.add_argument('--warmup', type=float, default=1., help='unmeasured time (s) before each level')
+    parser.add_argument('--rate', type=float, default=None, help='calls per second per client (default: max)')
+    parser.add_argument('--deadline', type=float, default=10., help='time (s) after which a call counts as failed')
+    parser.add_argument('--admin', action='store_true', help='the first client asks for admin rights')
+    parser.add_argument('--server-stats', action='store_true', help="reset and fetch the server's call_stats")
+    parser.add_argument('--seed', type=int, default=0, help='seed of the call choice')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    args = parser.parse_args()
+    if args.address is not None:
+        host, port = args.address.rsplit(':', 1)
+        args.address = (host, int(port))
+
+    module, name, default_mix = DRIVERS[args.driver]
+    driver = getattr(__import__(module), name)
+    calls = [Call(spec, driver.Client.API) for spec in (args.call or default_mix)]
+    print('mix: ' + ', '.join(f'{c.spec} ({c.kind}, weight {c.weight:g})' for c in calls))
+    if any(c.kind == 'non-blocking' for c in calls):
+        print(f'note: non-blocking calls that return at once can hang a client; they fail after {args.deadline} s')
+
+    monitor = driver.Client(admin=False, address=args.address) if args.server_stats else None
+    levels = []
+    for n in args.clients:
+        if monitor is not None:
+            monitor.call_stats(reset=True)
+        report = run_level(driver, n, calls, args)
+        if monitor is not None:
+            report['server'] = monitor.call_stats()
+        levels.append(report)
+        print_report(report)
+    if monitor is not None:
+        monitor.disconnect()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'driver': args.driver, 'address': args.address or driver.Client.ADDRESS,
+                       'mix': [{'call': c.spec, 'kind': c.kind, 'weight': c.weight} for c in calls],
+                       'rate': args.rate, 'levels': levels}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+asyncio variant of the proxy clients.
+
+The clients generated by `proxydevice` are synchronous: non-blocking calls
+"fake-block" by polling a flag until the server notifies the result. Driving a
+stage and a camera at the same time therefore needs threads. `async_client`
+builds a client where every exposed method is a coroutine, so that a single
+event loop can drive several devices:
+
+    stage = async_client(PDXCDriver)
+    camera = async_client(PSCameraDriver)
+
+    async def step(i):
+        await stage.move_forward(5000)
+        await camera.Camera_Acquisition(f'test{i}.tif')
+
+    async def main():
+        await asyncio.gather(stage.move_forward(100), camera.Camera_Configuration(1000))
+
+Cancelling a task awaiting a non-blocking call sends the server `abort` and
+waits (up to ABORT_TIMEOUT) for the interrupted call to return, so the device
+is free again when the cancellation propagates.
+
+Properties are read and written with `await c.get(name)` and
+`await c.set(name, value)`.
+"""
+import asyncio
+import time
+
+from lclib.proxydevice import _m, _um
+
+
+class NotifyHookMixin:
+    """
+    Mixin for generated proxy clients: route the server's "non-blocking call
+    finished" notification to `self._on_result`. By default it sets the result
+    flag, as lclib does; subclasses extend it.
+    """
+
+    def _create_service(self):
+        service = super()._create_service()
+        client = self
+
+        class HookedClientService(service):
+            def exposed_notify_result(self, result_and_error):
+                client._on_result(_um(result_and_error))
+
+        return HookedClientService
+
+    def _on_result(self, reply):
+        """
+        Called from the rpyc serving thread when a non-blocking call finishes.
+        """
+        self.awaited_result = reply
+        self.result_flag.set()
+
+    def _send(self, name, args, kwargs):
+        """
+        Send a call to the server and return the unpickled reply (synchronous).
+        """
+        t0 = time.time()
+        reply = _um(getattr(self.conn.root, name)(_m(args), _m(kwargs)))
+        self._update_stats(t0, time.time())
+        return reply
+
+    def _abort_remote(self):
+        """
+        Call the server interrupt method (synchronous).
+        """
+        if 'abort' in self.API:
+            # The driver's own abort call replaces the generic one on the server
+            self._send('abort', (), {})
+        else:
+            self.conn.root.abort()
+
+
+class AsyncClientMixin(NotifyHookMixin):
+    """
+    Coroutine versions of the proxy calls.
+    """
+
+    ABORT_TIMEOUT = 10.   # Time (s) to wait for an aborted call to return
+
+    def __init__(self, *args, **kwargs):
+        self._pending = None
+        self._call_lock = None
+        super().__init__(*args, **kwargs)
+
+    def _on_result(self, reply):
+        """
+        Called from the rpyc serving thread when a non-blocking call finishes.
+        """
+        pending = self._pending
+        if pending is None:
+            # Call made with the usual (fake-blocking) methods
+            super()._on_result(reply)
+            return
+        loop, future = pending
+
+        def resolve():
+            if not future.done():
+                future.set_result(reply)
+        loop.call_soon_threadsafe(resolve)
+
+    async def _call_blocking(self, name, args, kwargs):
+        loop = asyncio.get_running_loop()
+        reply = await loop.run_in_executor(None, self._send, name, args, kwargs)
+        return reply['result']
+
+    async def _call_nonblocking(self, name, args, kwargs):
+        loop = asyncio.get_running_loop()
+        if self._call_lock is None:
+            self._call_lock = asyncio.Lock()
+
+        # The server runs only one non-blocking call at a time
+        async with self._call_lock:
+            future = loop.create_future()
+            self._pending = (loop, future)
+            try:
+                await loop.run_in_executor(None, self._send, name, args, kwargs)
+                try:
+                    reply = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    self.logger.info(f'{name} cancelled: aborting.')
+                    await loop.run_in_executor(None, self._abort_remote)
+                    try:
+                        await asyncio.wait_for(future, self.ABORT_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        self.logger.error(f'{name} did not return after abort.')
+                    raise
+            finally:
+                self._pending = None
+
+        error = reply.pop('error', None)
+        if error:
+            raise error
+        return reply['result']
+
+    async def get(self, name):
+        """
+        Read property `name`.
+        """
+        loop = asyncio.get_running_loop()
+        reply = await loop.run_in_executor(None, lambda: _um(getattr(self.conn.root, f'_get_{name}')()))
+        return reply['result']
+
+    async def set(self, name, value):
+        """
+        Set property `name` to `value`.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: getattr(self.conn.root, f'_set_{name}')(_m(value)))
+
+
+def _async_method(name, doc, signature, block):
+    """
+    Coroutine calling the remote method `name`.
+    """
+    if block:
+        async def method(self, *args, **kwargs):
+            return await self._call_blocking(name, args, kwargs)
+    else:
+        async def method(self, *args, **kwargs):
+            return await self._call_nonblocking(name, args, kwargs)
+    method.__name__ = name
+    method.__doc__ = f"{name}{signature}\n" + (doc or "")
+    return method
+
+
+def async_client_class(driver_cls):
+    """
+    Create the asyncio client class for a class decorated with `proxydevice`.
+    """
+    client_cls = driver_cls.Client
+    namespace = {}
+    for name, api_info in client_cls.API.items():
+        if api_info["property"]:
+            continue
+        namespace[name] = _async_method(name, api_info["doc"], api_info["signature"] or "(*args, **kwargs)",
+                                        block=api_info["block"])
+    return type(f"{driver_cls.__name__}AsyncClient", (AsyncClientMixin, client_cls), namespace)
+
+
+def async_client(driver_cls, *args, **kwargs):
+    """
+    Connect an asyncio client to the server of `driver_cls`. args and kwargs are
+    passed to the client constructor (admin, name, address, ...).
+    """
+    return async_client_class(driver_cls)(*args, **kwargs)
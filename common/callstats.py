@@ -0,0 +1,374 @@
+"""
+Server-side latency statistics of the proxy calls.
+
+`instrument` is a class decorator for drivers, placed below `proxydevice`:
+
+    @register_driver
+    @proxydevice(address=ADDRESS)
+    @instrument
+    class PDXCDriver(SocketDriverBase):
+        ...
+
+Every `proxycall` method then records, in log-binned histograms:
+
+* queue: time between the arrival of the request on the server and the start
+  of the method (waiting for the server lock, thread start). Only measured
+  when the server is created with `instrumented_server(Driver)()`;
+* exec: execution time of the method;
+* dll: part of the execution spent in library calls, as reported by
+  `dll_timer` / `timed_library` in the thread running the method (use
+  `propagate` for work handed over to other threads);
+* wait: part of the execution spent waiting for a shared resource before a
+  library call (e.g. the PDXC serial handle), reported with `charge`.
+
+Two calls are added to the driver: `call_stats(reset=False)` returns the
+statistics, `call_stats_dump(path=None, fmt='text')` formats them as a text
+table or JSON, written to `path` on the server if given.
+"""
+import json
+import math
+import time
+import threading
+import functools
+
+from lclib import proxycall
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Log-binned histogram of durations (20 bins per decade from 0.1 µs to 1000 s).
+    Percentiles are accurate to the bin width (~12%).
+    """
+    MIN = 1e-7
+    BINS_PER_DECADE = 20
+    DECADES = 10
+
+    def __init__(self):
+        self.nbins = self.BINS_PER_DECADE * self.DECADES + 2
+        self.counts = [0] * self.nbins
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, t):
+        if t <= self.MIN:
+            i = 0
+        else:
+            i = min(self.nbins - 1, 1 + int(math.log10(t / self.MIN) * self.BINS_PER_DECADE))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += t
+        if t > self.max:
+            self.max = t
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram to this one.
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Upper edge of the bin containing the p-th percentile (capped by the max).
+        """
+        if not self.count:
+            return None
+        rank = p / 100. * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= rank and c:
+                return min(self.max, self.MIN * 10 ** (i / self.BINS_PER_DECADE))
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean': self.total / self.count,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class CallStats:
+    """
+    Queue / exec / dll / wait histograms of each method of a driver.
+    """
+    PARTS = ('queue', 'exec', 'dll', 'wait')
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.errors = {}
+            self.t_start = time.time()
+
+    def arrived(self, name, block):
+        """
+        Called by the server when a request for `name` arrives.
+        """
+        t = time.perf_counter()
+        if block:
+            _local.arrival = t
+        else:
+            # lclib runs one non-blocking call at a time, on a new thread
+            self.pending[name] = t
+
+    def discard(self, name, block):
+        """
+        Called by the server when a request failed before reaching the method.
+        """
+        if block:
+            _local.arrival = None
+        else:
+            self.pending.pop(name, None)
+
+    def _arrival(self, name):
+        t = getattr(_local, 'arrival', None)
+        if t is not None:
+            _local.arrival = None
+            return t
+        return self.pending.pop(name, None)
+
+    def record(self, name, queue, exec_time, dll, wait, error):
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = {part: Histogram() for part in self.PARTS}
+            if queue is not None:
+                h['queue'].add(queue)
+            h['exec'].add(exec_time)
+            h['dll'].add(dll)
+            h['wait'].add(wait)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self):
+        """
+        {method: {'calls', 'errors', 'queue', 'exec', 'dll', 'wait'}}, times in s.
+        """
+        with self.lock:
+            return {name: {'calls': h['exec'].count,
+                           'errors': self.errors.get(name, 0),
+                           **{part: h[part].summary() for part in self.PARTS}}
+                    for name, h in sorted(self.histograms.items())}
+
+    def text(self):
+        """
+        The report as a text table (times in ms).
+        """
+        lines = [f"{self.name} call statistics since {time.ctime(self.t_start)} (ms)",
+                 f"{'method':<28}{'calls':>7}{'err':>5}" +
+                 ''.join(f"{part + ' ' + q:>13}" for part in self.PARTS for q in ('p50', 'p99', 'max'))]
+
+        def ms(v):
+            return f"{v * 1e3:>13.3f}" if v is not None else f"{'-':>13}"
+        for name, r in self.report().items():
+            line = f"{name:<28}{r['calls']:>7}{r['errors']:>5}"
+            for part in self.PARTS:
+                s = r[part]
+                line += ms(s.get('p50')) + ms(s.get('p99')) + ms(s.get('max'))
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def dump(self, path=None, fmt='text'):
+        """
+        Format the statistics as 'text' or 'json', and write them to `path` if given.
+        """
+        if fmt == 'json':
+            out = json.dumps({'driver': self.name, 'since': self.t_start, 'methods': self.report()}, indent=2)
+        elif fmt == 'text':
+            out = self.text()
+        else:
+            raise ValueError(f"Unknown format {fmt}. Should be 'text' or 'json'.")
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(out + '\n')
+        return out
+
+
+class _Times:
+    """
+    dll and wait time of one call. Threads working for the call (see propagate) add to it concurrently.
+    """
+    __slots__ = ('dll', 'wait', 'lock')
+
+    def __init__(self):
+        self.dll = 0.
+        self.wait = 0.
+        self.lock = threading.Lock()
+
+    def add(self, part, t):
+        with self.lock:
+            setattr(self, part, getattr(self, part) + t)
+
+
+def charge(part, t):
+    """
+    Add `t` seconds to the 'dll' or 'wait' time of the call running in this thread (if any).
+    """
+    acc = getattr(_local, 'acc', None)
+    if acc is not None:
+        acc.add(part, t)
+
+
+class dll_timer:
+    """
+    Context manager adding the time spent in the block to the dll time of the current call.
+    """
+    __slots__ = ('t0',)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        charge('dll', time.perf_counter() - self.t0)
+
+
+def timed(fn):
+    """
+    Wrap `fn` so that its execution time counts as dll time.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            charge('dll', time.perf_counter() - t0)
+    return wrapper
+
+
+class timed_library:
+    """
+    Proxy of a ctypes library whose function calls count as dll time.
+    """
+
+    def __init__(self, lib):
+        self._lib = lib
+
+    def __getattr__(self, name):
+        f = timed(getattr(self._lib, name))
+        setattr(self, name, f)
+        return f
+
+
+def propagate(fn):
+    """
+    Wrap `fn` (to be run on another thread) so that its dll time is charged to the current call.
+    """
+    acc = getattr(_local, 'acc', None)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'acc', None)
+        _local.acc = acc
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.acc = previous
+    return wrapper
+
+
+def _instrumented(name, f):
+    @functools.wraps(f)
+    def method(self, *args, **kwargs):
+        stats = self.callstats  # looked up on the instance: subclasses may have their own
+        t0 = time.perf_counter()
+        arrival = stats._arrival(name)
+        acc = _Times()
+        previous = getattr(_local, 'acc', None)
+        _local.acc = acc
+        error = True
+        try:
+            result = f(self, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            _local.acc = previous
+            stats.record(name, None if arrival is None else t0 - arrival,
+                         time.perf_counter() - t0, acc.dll, acc.wait, error)
+    method.api_info = f.api_info
+    return method
+
+
+def instrument(cls):
+    """
+    Class decorator: record the latency of every proxycall method of `cls` and add
+    the call_stats / call_stats_dump calls. Must be applied before proxydevice.
+
+    The statistics are kept in `cls.callstats`; a subclass given its own
+    CallStats (e.g. one per controller, see PDXCMultiServer) records separately.
+    """
+    cls.callstats = CallStats(cls.__name__)
+    for name in dir(cls):
+        f = getattr(cls, name, None)
+        if isinstance(f, property) or not hasattr(f, 'api_info'):
+            continue
+        setattr(cls, name, _instrumented(name, f))
+
+    @proxycall()
+    def call_stats(self, reset=False):
+        """
+        Latency statistics (queue, exec, dll and wait time: count, mean, p50, p99, max in s) of each call.
+        """
+        report = self.callstats.report()
+        if reset:
+            self.callstats.reset()
+        return report
+
+    @proxycall()
+    def call_stats_dump(self, path=None, fmt='text'):
+        """
+        Call statistics as a 'text' table or 'json', also written to path on the server if given.
+        """
+        return self.callstats.dump(path, fmt)
+
+    cls.call_stats = call_stats
+    cls.call_stats_dump = call_stats_dump
+    return cls
+
+
+def instrumented_server(driver_cls):
+    """
+    Server class of `driver_cls` (decorated with instrument) that also records the queueing time:
+
+        s = instrumented_server(PDXCDriver)()
+
+    `driver_cls` may be a subclass of the decorated driver: the server then instantiates it.
+    """
+    stats = driver_cls.callstats
+
+    class InstrumentedServer(driver_cls.Server):
+        CLS = driver_cls
+
+        def _create_service(self):
+            service = super()._create_service()
+            for name, api_info in self.API.items():
+                if api_info['property']:
+                    continue
+                exposed = getattr(service, f'exposed_{name}')
+
+                def method(service_self, *args, _exposed=exposed, _name=name, _block=api_info['block']):
+                    stats.arrived(_name, _block)
+                    try:
+                        return _exposed(service_self, *args)
+                    except Exception:
+                        stats.discard(_name, _block)
+                        raise
+                setattr(service, f'exposed_{name}', method)
+            return service
+
+    InstrumentedServer.__name__ = driver_cls.Server.__name__
+    return InstrumentedServer
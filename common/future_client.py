@@ -0,0 +1,190 @@
+"""
+Proxy clients whose calls can also return futures.
+
+With the clients generated by `proxydevice`, a call returns only when the
+device is done (non-blocking calls fake-block until the server notifies the
+result), so a script can't have a stage move and a camera configuration in
+flight together without threads. `future_client` builds a client that keeps
+the usual methods and adds, for each of them, a form returning a
+`concurrent.futures.Future`:
+
+    stage = future_client(PDXCDriver)
+    camera = future_client(PSCameraDriver)
+
+    move = stage.futures.move_forward(5000)              # returns at once
+    config = camera.futures.Camera_Configuration(1000)
+    move.add_done_callback(lambda f: print('moved', f.result()))
+    config.result(timeout=5)
+    move.result(timeout=30)
+
+The futures work with `concurrent.futures.wait` / `as_completed`.
+`cancel()` withdraws a call that has not been sent yet. For a non-blocking
+call already running on the server, it sends `abort`; the future then ends
+with CancelledError once the interrupted call has returned. Blocking calls
+can't be cancelled once sent.
+
+The server runs one non-blocking call at a time: the calls of one client are
+sent in order by a worker thread, and a non-blocking call is only sent once
+the previous one has returned. Calls to different devices overlap.
+
+Done callbacks run on the client's receiving thread: they should be short,
+and must not call a method of the same client synchronously (they can submit
+futures).
+"""
+import threading
+from concurrent.futures import Future, CancelledError, ThreadPoolExecutor
+
+from async_client import NotifyHookMixin
+
+
+class CallFuture(Future):
+    """
+    Future of one proxy call.
+    """
+
+    def __init__(self, client, name, block):
+        super().__init__()
+        self.client = client
+        self.name = name
+        self.block = block
+        self.aborted = False
+
+    def cancel(self):
+        """
+        Withdraw the call if it has not been sent, else abort it if it is non-blocking.
+        """
+        if super().cancel():
+            return True
+        if self.done() or self.block:
+            return False
+        self.aborted = True
+        self.client._abort_remote()
+        return True
+
+    def cancelled(self):
+        return super().cancelled() or (self.aborted and self.done())
+
+
+class _Futures:
+    """
+    client.futures.<name>(...) is client.submit(name, ...).
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        if name not in self._client.API or self._client.API[name]['property']:
+            raise AttributeError(f'{name} is not a method of the driver API.')
+
+        def submit(*args, **kwargs):
+            return self._client.submit(name, *args, **kwargs)
+        submit.__name__ = name
+        submit.__doc__ = self._client.API[name]['doc']
+        return submit
+
+    def __dir__(self):
+        return [name for name, info in self._client.API.items() if not info['property']]
+
+
+class FutureClientMixin(NotifyHookMixin):
+    """
+    Future-returning calls for the generated proxy clients.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._pending = None                 # future of the non-blocking call running on the server
+        self._idle = threading.Event()       # no non-blocking call running
+        self._idle.set()
+        self._sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='future_client')
+        self.futures = _Futures(self)
+        super().__init__(*args, **kwargs)
+
+    def submit(self, name, *args, **kwargs):
+        """
+        Send the call name(*args, **kwargs) and return its CallFuture.
+        """
+        api_info = self.API.get(name)
+        if api_info is None or api_info['property']:
+            raise AttributeError(f'{name} is not a method of the driver API.')
+        future = CallFuture(self, name, api_info['block'])
+        self._sender.submit(self._run, future, args, kwargs)
+        return future
+
+    def _run(self, future, args, kwargs):
+        """
+        Send one call (worker thread).
+        """
+        if future.block:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                reply = self._send(future.name, args, kwargs)
+            except Exception as error:
+                future.set_exception(error)
+                return
+            self._resolve(future, reply)
+            return
+
+        self._idle.wait()
+        if not future.set_running_or_notify_cancel():
+            return
+        self._idle.clear()
+        self._pending = future  # before sending: the result may come back first
+        try:
+            self._send(future.name, args, kwargs)
+        except Exception as error:
+            self._pending = None
+            self._idle.set()
+            future.set_exception(error)
+
+    def _on_result(self, reply):
+        """
+        Called from the receiving thread when a non-blocking call finishes.
+        """
+        future = self._pending
+        if future is None:
+            # Call made with the usual (fake-blocking) methods
+            super()._on_result(reply)
+            return
+        self._pending = None
+        self._idle.set()
+        self._resolve(future, reply)
+
+    @staticmethod
+    def _resolve(future, reply):
+        error = reply.pop('error', None)
+        if future.aborted:
+            future.set_exception(CancelledError(f'{future.name} aborted'))
+        elif error:
+            future.set_exception(error)
+        else:
+            future.set_result(reply['result'])
+
+    def disconnect(self):
+        """
+        Fail the pending call, then disconnect.
+        """
+        self._sender.shutdown(wait=False, cancel_futures=True)
+        future = self._pending
+        if future is not None and not future.done():
+            self._pending = None
+            future.set_exception(ConnectionError(f'{future.name}: client disconnected'))
+        self._idle.set()
+        super().disconnect()
+
+
+def future_client_class(driver_cls):
+    """
+    Create the future-returning client class for a class decorated with `proxydevice`.
+    """
+    client_cls = driver_cls.Client
+    return type(f"{driver_cls.__name__}FutureClient", (FutureClientMixin, client_cls), {})
+
+
+def future_client(driver_cls, *args, **kwargs):
+    """
+    Connect a future-returning client to the server of `driver_cls`. args and kwargs are
+    passed to the client constructor (admin, name, address, ...).
+    """
+    return future_client_class(driver_cls)(*args, **kwargs)
@@ -0,0 +1,259 @@
+"""
+Versioned metadata cache: each source publishes its changes once, each frame takes a snapshot.
+
+lclib's `CameraBase.metadata_loop` asks the monitor for the metadata of every
+device (`request_meta`, one call per device) and rebuilds `get_meta()`,
+including three manager round trips (`scan_name`, `scan_path`,
+`get_counter`), for every acquisition. At high frame rates collecting the
+metadata takes longer than the frame.
+
+`MetadataCache` inverts this: the sources publish their values when they
+change, and `snapshot()` returns an immutable, versioned view of all of them.
+The version only increases when a value actually changes, and the same
+Snapshot object is returned as long as nothing changed: tagging a frame with
+its metadata is a reference, not a copy.
+
+    cache = MetadataCache()
+    cache.publish('camera', {'exposure_time': 0.1})
+    cache.refresh('manager', read_manager, interval=1.)   # background, shared scheduler
+    ...
+    snap = cache.tag(frame_number)      # snap.version, snap['camera'], snap.stale
+
+Values that can't be pushed are refreshed in the background by `refresh`, on
+the shared scheduler (see scheduler.py). A source is flagged stale, never
+re-fetched on the acquisition path, when it is older than its `max_age`, when
+its refresh failed, or when it was invalidated: the snapshot lists it in
+`stale` and keeps its last known values.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+
+from scheduler import shared_scheduler
+
+_EMPTY = MappingProxyType({})
+
+
+def _same(a, b):
+    try:
+        return bool(a == b)
+    except Exception:  # e.g. arrays
+        return False
+
+
+class Snapshot:
+    """
+    Immutable metadata of all the sources at one version.
+    """
+    __slots__ = ('version', 'time', 'values', 'stale')
+
+    def __init__(self, version, values, stale):
+        self.version = version
+        self.time = time.time()
+        self.values = values    # {source: {key: value}}, read-only
+        self.stale = stale      # frozenset of the stale sources
+
+    def __getitem__(self, source):
+        return self.values[source]
+
+    def __contains__(self, source):
+        return source in self.values
+
+    def get(self, source, key=None, default=None):
+        values = self.values.get(source, _EMPTY)
+        if key is None:
+            return values
+        return values.get(key, default)
+
+    def flat(self):
+        """
+        All the values in one (new) dict. Keys published by several sources: the last source wins.
+        """
+        meta = {}
+        for values in self.values.values():
+            meta.update(values)
+        return meta
+
+    def as_dict(self):
+        """
+        Plain dict (for proxycalls and JSON).
+        """
+        return {'version': self.version, 'time': self.time, 'stale': sorted(self.stale),
+                'values': {source: dict(values) for source, values in self.values.items()}}
+
+
+class _Source:
+    def __init__(self, max_age):
+        self.values = _EMPTY
+        self.updated = 0.         # never: stale until the first publish
+        self.max_age = max_age
+
+
+class MetadataCache:
+    """
+    Versioned store of the metadata published by several sources.
+    """
+
+    def __init__(self, max_age=None, keep=64, name='metadata'):
+        """
+        Args:
+            max_age: default age (s) after which a source is flagged stale (None: never).
+            keep: number of tagged snapshots kept (see tag).
+            name: prefix of the refresh task names.
+        """
+        self.max_age = max_age
+        self.keep = keep
+        self.name = name
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.invalid = set()
+        self.version = 0
+        self.tags = OrderedDict()
+        self.tasks = {}
+        self._snapshot = None
+        self._expires = math.inf  # next time a fresh source becomes stale
+        self._dirty = True        # staleness changed otherwise (invalidate, stale source published)
+        self.counts = {'publishes': 0, 'changes': 0, 'snapshots': 0, 'reused': 0}
+
+    def _source(self, name, max_age=None):
+        source = self.sources.get(name)
+        if source is None:
+            source = self.sources[name] = _Source(self.max_age if max_age is None else max_age)
+            self._dirty = True
+        elif max_age is not None:
+            source.max_age = max_age
+        return source
+
+    def publish(self, source, values, max_age=None):
+        """
+        Merge `values` ({key: value}) into the values of `source` and mark it fresh.
+        The version only increases if a value changed. Returns the current version.
+        """
+        t = time.time()
+        with self.lock:
+            entry = self._source(source, max_age)
+            current = entry.values
+            changed = {k: v for k, v in values.items() if k not in current or not _same(current[k], v)}
+            if changed:
+                entry.values = MappingProxyType({**current, **changed})
+                self.version += 1
+                self.counts['changes'] += 1
+            self.counts['publishes'] += 1
+            if source in self.invalid or (entry.max_age is not None and entry.updated + entry.max_age < t):
+                self._dirty = True  # was stale
+            self.invalid.discard(source)
+            entry.updated = t
+            if entry.max_age is not None:
+                self._expires = min(self._expires, t + entry.max_age)
+            return self.version
+
+    def invalidate(self, source):
+        """
+        Flag `source` as stale until its next publish (its values are kept).
+        """
+        with self.lock:
+            self._source(source)
+            self.invalid.add(source)
+            self._dirty = True
+
+    def snapshot(self):
+        """
+        The current Snapshot. The same object is returned while no value and no staleness changed.
+        """
+        t = time.time()
+        with self.lock:
+            snap = self._snapshot
+            if snap is not None and snap.version == self.version and not self._dirty and t < self._expires:
+                self.counts['reused'] += 1
+                return snap
+            stale, expires = set(self.invalid), math.inf
+            for name, source in self.sources.items():
+                if source.max_age is None or name in stale:
+                    continue
+                limit = source.updated + source.max_age
+                if t > limit:
+                    stale.add(name)
+                else:
+                    expires = min(expires, limit)
+            stale = frozenset(stale)
+            self._expires, self._dirty = expires, False
+            if snap is not None and snap.version == self.version and snap.stale == stale:
+                self.counts['reused'] += 1
+                return snap
+            if snap is not None and snap.version == self.version:
+                values = snap.values
+            else:
+                values = MappingProxyType({name: source.values for name, source in self.sources.items()})
+            self._snapshot = Snapshot(self.version, values, stale)
+            self.counts['snapshots'] += 1
+            return self._snapshot
+
+    def tag(self, key):
+        """
+        Take a snapshot for `key` (e.g. a frame number) and keep it for `tagged`.
+        """
+        snap = self.snapshot()
+        with self.lock:
+            self.tags[key] = snap
+            while len(self.tags) > self.keep:
+                self.tags.popitem(last=False)
+        return snap
+
+    def tagged(self, key):
+        """
+        The snapshot taken for `key`, or None if unknown or no longer kept.
+        """
+        with self.lock:
+            return self.tags.get(key)
+
+    def refresh(self, source, fn, interval, max_age=None):
+        """
+        Publish fn() (a dict, or None for no change) as `source` every `interval` seconds on the
+        shared scheduler. If fn raises, the source is flagged stale until a refresh succeeds.
+
+        Args:
+            max_age: age (s) after which the source is stale (default: 3 * interval).
+        """
+        if max_age is None:
+            max_age = 3 * interval
+        with self.lock:
+            self._source(source, max_age)
+
+        def beat():
+            try:
+                values = fn()
+            except Exception:
+                self.invalidate(source)
+                raise  # counted and logged by the scheduler
+            if values is not None:
+                self.publish(source, values)
+        old = self.tasks.get(source)
+        if old is not None:
+            old.cancel()
+        self.tasks[source] = shared_scheduler().add(beat, interval, name=f'{self.name}.{source}')
+        return self.tasks[source]
+
+    def stats(self):
+        """
+        Version, publish/snapshot counts and the age and staleness of each source.
+        """
+        snap = self.snapshot()
+        t = time.time()
+        with self.lock:
+            stats = dict(self.counts, version=self.version)
+            stats['sources'] = {name: {'age': t - source.updated if source.updated else None,
+                                       'max_age': source.max_age, 'stale': name in snap.stale,
+                                       'keys': len(source.values)}
+                                for name, source in self.sources.items()}
+        return stats
+
+    def close(self):
+        """
+        Stop the background refreshes.
+        """
+        for task in self.tasks.values():
+            task.cancel(wait=True)
+        self.tasks = {}
+
@@ -0,0 +1,283 @@
+"""
+One scheduler for the periodic calls of all the drivers of a process.
+
+lclib's `DriverBase.start_periodic_calls` starts one thread per periodic call,
+each sleeping in its own loop, and a slow call delays the following beats of
+its loop. `PeriodicScheduler` keeps every periodic task of the process in one
+heap, ordered by due time, served by a single dispatcher thread. The calls
+themselves run on a small pool of worker threads:
+
+* a slow call only holds its worker: the other tasks stay on time;
+* a task is never run twice at the same time: if it is still running when it
+  is due again, that beat is skipped and counted as an overrun;
+* beats are kept on the grid start + n * interval (no drift); beats missed by
+  more than one interval are skipped, not run in a burst.
+
+For each task the scheduler records the jitter (start delay after the due
+time) and run time histograms, the overruns, skipped beats and errors.
+
+    task = shared_scheduler().add(self.sample, 0.05, name='pdxc-telemetry')
+    ...
+    task.cancel(wait=True)
+    shared_scheduler().stats()
+
+`PeriodicCallsMixin` moves the lclib periodic calls (`self.periodic_calls`,
+{label: (method, interval)}) of a driver onto the shared scheduler:
+
+    class MyDriver(PeriodicCallsMixin, SocketDriverBase):
+        ...
+"""
+import heapq
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lclib import proxycall
+from lclib.base import DeviceException
+
+from callstats import Histogram
+
+
+class StopPeriodic(Exception):
+    """
+    Raised by a task to stop being called.
+    """
+
+
+class PeriodicTask:
+    """
+    A function called every `interval` seconds by a PeriodicScheduler.
+    """
+
+    def __init__(self, scheduler, fn, interval, name):
+        self.scheduler = scheduler
+        self.fn = fn
+        self.interval = interval
+        self.name = name
+        self.due = None
+        self.cancelled = False
+        self.running = False
+        self.thread = None
+        self.idle = threading.Event()
+        self.idle.set()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.runs = 0
+            self.overruns = 0
+            self.skipped = 0
+            self.errors = 0
+            self.last_error = None
+            self.jitter = Histogram()
+            self.run_time = Histogram()
+
+    def cancel(self, wait=False):
+        """
+        Stop calling the task. If wait, also wait for the current call to return.
+        """
+        self.cancelled = True
+        self.scheduler._forget(self)
+        if wait and threading.get_ident() != self.thread:  # not from within the task
+            self.idle.wait()
+
+    def _run(self, due):
+        self.thread = threading.get_ident()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            self.fn()
+        except StopPeriodic:
+            self.cancelled = True
+            self.scheduler._forget(self)
+        except Exception as e:
+            error = e
+            if repr(e) != self.last_error:  # don't flood the log with the same error at every beat
+                self.scheduler.logger.exception(f'Periodic task {self.name} failed.')
+        t1 = time.perf_counter()
+        with self.lock:
+            self.runs += 1
+            self.jitter.add(t0 - due)
+            self.run_time.add(t1 - t0)
+            if error is not None:
+                self.errors += 1
+                self.last_error = repr(error)
+        self.thread = None
+        self.running = False
+        self.idle.set()
+
+    def stats(self):
+        with self.lock:
+            return {'interval': self.interval, 'runs': self.runs, 'overruns': self.overruns,
+                    'skipped': self.skipped, 'errors': self.errors, 'last_error': self.last_error,
+                    'running': self.running, 'cancelled': self.cancelled,
+                    'jitter': self.jitter.summary(), 'run_time': self.run_time.summary()}
+
+
+class PeriodicScheduler:
+    """
+    Heap of periodic tasks, one dispatcher thread, a pool of workers for the calls.
+    """
+
+    def __init__(self, workers=8, name='periodic', logger=None):
+        """
+        Args:
+            workers: maximum number of calls running at the same time (threads are created on demand).
+            name: prefix of the thread names.
+            logger: logger for the task errors (default: lclib's root logger).
+        """
+        if logger is None:
+            from lclib.logs import logger as rootlogger
+            logger = rootlogger.getChild('scheduler')
+        self.logger = logger
+        self.name = name
+        self.heap = []
+        self.tasks = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.thread = None
+        self.stopped = False
+
+    def add(self, fn, interval, name=None, delay=0.):
+        """
+        Call fn() every `interval` seconds, starting after `delay`. Returns the PeriodicTask.
+        Names are made unique if needed.
+        """
+        if interval <= 0:
+            raise ValueError('The interval must be positive.')
+        name = name or getattr(fn, '__qualname__', 'task')
+        with self.cond:
+            unique, i = name, 1
+            while unique in self.tasks:
+                i += 1
+                unique = f'{name}#{i}'
+            task = PeriodicTask(self, fn, interval, unique)
+            task.due = time.perf_counter() + delay
+            self.tasks[unique] = task
+            heapq.heappush(self.heap, (task.due, next(self.counter), task))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._dispatch, name=f'{self.name}-dispatch', daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return task
+
+    def _dispatch(self):
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, _, task = self.heap[0]
+                now = time.perf_counter()
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                heapq.heappop(self.heap)
+                if task.cancelled:
+                    continue
+                if task.running:
+                    with task.lock:
+                        task.overruns += 1
+                else:
+                    task.running = True
+                    task.idle.clear()
+                    try:
+                        self.pool.submit(task._run, due)
+                    except RuntimeError:
+                        return  # pool shut down (interpreter exit)
+                # Next beat on the grid; skip the beats already missed
+                task.due = due + task.interval
+                if task.due <= now:
+                    missed = int((now - task.due) // task.interval) + 1
+                    task.due += missed * task.interval
+                    with task.lock:
+                        task.skipped += missed
+                heapq.heappush(self.heap, (task.due, next(self.counter), task))
+
+    def _forget(self, task):
+        with self.cond:
+            if self.tasks.get(task.name) is task:
+                del self.tasks[task.name]
+
+    def stats(self, reset=False):
+        """
+        {name: stats} of the tasks (see PeriodicTask.stats).
+        """
+        with self.cond:
+            tasks = list(self.tasks.values())
+        stats = {task.name: task.stats() for task in tasks}
+        if reset:
+            for task in tasks:
+                task.reset()
+        return stats
+
+    def shutdown(self, wait=True):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.pool.shutdown(wait=wait)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def shared_scheduler():
+    """
+    The scheduler shared by all the drivers of this process.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PeriodicScheduler()
+        return _scheduler
+
+
+class PeriodicCallsMixin:
+    """
+    Run the periodic calls of a lclib driver (self.periodic_calls) on the shared scheduler
+    instead of one thread each. Place it before the driver base class.
+    """
+
+    def start_periodic_calls(self):
+        """
+        Start periodic calls used as heartbeat and for data logging.
+        """
+        scheduler = shared_scheduler()
+        for label, (method, interval) in self.periodic_calls.items():
+            self.periodic_futures[label] = scheduler.add(self._periodic_task(method), interval,
+                                                         name=f'{self.name}.{label}')
+
+    def stop_periodic_calls(self, wait=True):
+        for task in self.periodic_futures.values():
+            task.cancel(wait)
+        self.periodic_futures = {}
+
+    def _periodic_task(self, method):
+        """
+        One beat of DriverBase._periodic_call: skipped until the device is initialized,
+        stopped on device timeout or disconnection.
+        """
+        def beat():
+            if not self.initialized:
+                return
+            try:
+                method()
+            except socket.timeout:
+                self.logger.exception(f'Socket Timeout after calling method {self.__class__.__name__}.{method.__name__}')
+                raise StopPeriodic
+            except DeviceException:
+                self.logger.exception('Device disconnected.')
+                raise StopPeriodic
+        return beat
+
+    @proxycall()
+    def periodic_stats(self):
+        """
+        Jitter, run time, overruns and errors of the periodic tasks of this process.
+        """
+        return shared_scheduler().stats()
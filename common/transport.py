@@ -0,0 +1,230 @@
+"""
+Buffered socket transport for drivers built on `SocketDriverBase`.
+
+In lclib's SocketDriverBase a listening thread reads the replies with
+`ret += sock.recv(1024)` until the end of line (quadratic in the reply size,
+one allocation per read), appends them to a shared buffer and wakes up
+`device_cmd`, which then collects them: two thread handoffs per command.
+
+`BufferedSocketDriverBase` is a drop-in replacement:
+
+* the replies are received with `recv_into` into one preallocated bytearray
+  (`ReplyBuffer`, grown only if a reply doesn't fit);
+* the end of line is searched only in the newly received bytes, and the
+  buffer is split into replies (several replies arriving in one packet are
+  kept for the next reads instead of being returned together);
+* `device_cmd` reads its reply on the calling thread: no listening thread;
+* `device_cmds` pipelines commands: up to PIPELINE_DEPTH commands are sent
+  in one write before their replies are read, so the round trips overlap.
+
+    class MyDriver(BufferedSocketDriverBase):
+        ...
+        reply = self.device_cmd(b'POS?\\n')
+        replies = self.device_cmds([b'POS?\\n', b'VEL?\\n', b'ERR?\\n'])
+
+Data that the device sends without being asked (there is no listening thread
+any more) is prepended to the reply of the next command, as with the base
+class. benchmark/bench_transport.py compares both transports.
+"""
+import os
+import time
+import socket
+from select import select
+
+from lclib.base import SocketDriverBase, DeviceException
+
+
+class ReplyBuffer:
+    """
+    Preallocated receive buffer split into EOL-terminated replies.
+    """
+
+    def __init__(self, size=65536):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0     # first byte not yet returned
+        self.end = 0       # end of the received bytes
+        self.scanned = 0   # bytes from start already searched for EOL
+        self.stats = {'replies': 0, 'recv_calls': 0, 'bytes': 0, 'grown': 0}
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _make_room(self):
+        n = self.end - self.start
+        if self.start > 0:
+            # Move the pending bytes to the front
+            self.view[:n] = bytes(self.view[self.start:self.end])
+        else:
+            # A reply larger than the buffer
+            self.view.release()
+            self.buf = self.buf + bytearray(len(self.buf))
+            self.view = memoryview(self.buf)
+            self.stats['grown'] += 1
+        self.start, self.end = 0, n
+
+    def fill(self, sock):
+        """
+        Receive once from sock. Returns the number of bytes received.
+        """
+        if self.end == len(self.buf):
+            self._make_room()
+        n = sock.recv_into(self.view[self.end:])
+        if n == 0:
+            raise DeviceException('Device closed the connection.')
+        self.end += n
+        self.stats['recv_calls'] += 1
+        self.stats['bytes'] += n
+        return n
+
+    def next_reply(self, eol):
+        """
+        The next complete reply (including eol), or None.
+        """
+        i = self.buf.find(eol, self.start + self.scanned, self.end)
+        if i < 0:
+            # eol may straddle the next read
+            self.scanned = max(0, self.end - self.start - len(eol) + 1)
+            return None
+        j = i + len(eol)
+        reply = bytes(self.view[self.start:j])
+        self.start, self.scanned = j, 0
+        if self.start == self.end:
+            self.start = self.end = 0
+        self.stats['replies'] += 1
+        return reply
+
+    def read_reply(self, sock, eol):
+        """
+        Receive until a complete reply is available and return it.
+        """
+        reply = self.next_reply(eol)
+        while reply is None:
+            self.fill(sock)
+            reply = self.next_reply(eol)
+        return reply
+
+    def take(self):
+        """
+        All the pending bytes (complete replies or not), emptying the buffer.
+        """
+        data = bytes(self.view[self.start:self.end])
+        self.start = self.end = self.scanned = 0
+        return data
+
+
+class BufferedSocketDriverBase(SocketDriverBase):
+    """
+    SocketDriverBase with a buffered, thread-free reply path and command pipelining.
+    """
+
+    RECV_BUFFER_SIZE = 65536            # initial size (bytes) of the receive buffer
+    PIPELINE_DEPTH = 16                 # maximum number of commands sent before reading their replies
+
+    def connect_device(self):
+        """
+        Device connection (no listening thread).
+        """
+        self.device_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket
+        self.device_sock.settimeout(self.DEVICE_TIMEOUT)
+
+        for retry_count in range(self.NUM_CONNECTION_RETRY):
+            conn_errno = self.device_sock.connect_ex(self.device_address)
+            if conn_errno == 0:
+                break
+
+            self.logger.critical(os.strerror(conn_errno))
+            time.sleep(.05)
+
+        if conn_errno != 0:
+            self.logger.critical("Can't connect to device")
+            raise DeviceException("Can't connect to device")
+
+        # Replies are read on the calling thread, within REPLY_TIMEOUT
+        self.device_sock.settimeout(self.REPLY_TIMEOUT)
+        self.device_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reply_buffer = ReplyBuffer(self.RECV_BUFFER_SIZE)
+
+        self.connected = True
+        self.logger.info(f'Driver {self.name} connected to {self.device_address[0]}:{self.device_address[1]}')
+
+    def _read_reply(self):
+        try:
+            return self.reply_buffer.read_reply(self.device_sock, self.REOL or self.EOL)
+        except socket.timeout:
+            raise TimeoutError('Device reply timed out.')
+
+    def device_cmd(self, cmd: bytes, reply=True) -> bytes:
+        """
+        Send command to the device, NOT adding EOL and return the reply.
+
+        Args:
+            cmd: (bytes) pre-formatted command to send.
+            reply: (bool) if False, do not wait for reply (default: True)
+
+        Returns:
+            reply (bytes) or None
+        """
+        if not self.connected:
+            raise RuntimeError('Device not connected.')
+        if not self.initialized:
+            self.logger.info('Device not (yet?) initialized.')
+
+        with self.cmd_lock:
+            # Flush the replies
+            response = self.get_recv_buffer()
+
+            if isinstance(cmd, str):
+                cmd = cmd.encode()
+            self.device_sock.sendall(cmd)
+
+            if not reply:
+                return None
+            if self.REPLY_WAIT_TIME:
+                time.sleep(self.REPLY_WAIT_TIME)
+            return response + self._read_reply()
+
+    def device_cmds(self, cmds, reply=True) -> list:
+        """
+        Send several commands (pre-formatted, NOT adding EOL), pipelined, and return their replies.
+
+        Args:
+            cmds: list of (bytes) commands. Each must produce exactly one reply if reply is True.
+            reply: (bool) if False, only send the commands.
+
+        Returns:
+            list of replies (bytes) in the order of cmds, or None
+        """
+        if not self.connected:
+            raise RuntimeError('Device not connected.')
+        cmds = [cmd.encode() if isinstance(cmd, str) else cmd for cmd in cmds]
+
+        with self.cmd_lock:
+            stale = self.get_recv_buffer()
+            if not reply:
+                self.device_sock.sendall(b''.join(cmds))
+                return None
+            replies = []
+            for i in range(0, len(cmds), self.PIPELINE_DEPTH):
+                window = cmds[i:i + self.PIPELINE_DEPTH]
+                self.device_sock.sendall(b''.join(window))
+                replies.extend(self._read_reply() for _ in window)
+        if replies and stale:
+            replies[0] = stale + replies[0]
+        return replies
+
+    def get_recv_buffer(self):
+        """
+        Read and reset the recv buffer, including the data waiting on the socket. This can be used
+        to flush the buffer.
+        """
+        with self.recv_lock:
+            while select([self.device_sock], [], [], 0)[0]:
+                self.reply_buffer.fill(self.device_sock)
+            return self.reply_buffer.take()
+
+    def transport_stats(self):
+        """
+        Receive buffer statistics: replies, recv calls, bytes received and buffer growths.
+        """
+        return dict(self.reply_buffer.stats, buffer_size=len(self.reply_buffer.buf))
@@ -1,6 +1,7 @@
 from PDXCServer import PDXCDriver
 from PSCameraServer import PSCameraDriver
 from config import *
+from scan_engine import StepScan
 import os
 def init_device():
     global c_PSCamera,c_PDXC
@@ -24,11 +25,11 @@ def acqui(index):
     os.makedirs(os.path.dirname(full_path), exist_ok=True)
     c_PSCamera.Camera_Acquisition(full_path)
     print('Camera_Acquisition pass')
-def step_and_acqui():
-    #step and acquire images
-    for i in range (0,5):# step 5 times
-        c_PDXC.move_forward(config["step_size"])#STEP_PULSE=5000
-        acqui(i)
+def step_and_acqui(n_steps=5):
+    #step and acquire images, the next move overlaps with the writing of the previous image
+    scan = StepScan(c_PDXC, c_PSCamera, config["step_size"], config["exposure_time"], config["data_path"])
+    scan.run(n_steps)
+    scan.summary()
 def close_device():
     c_PSCamera.Camera_Close()
     print('Camera_Close pass')
@@ -0,0 +1,185 @@
+"""
+Pipelined step-and-acquire scan.
+
+A step scan has three pieces that physically must happen in order: move the
+stage, let it settle, expose the detector. Everything else can overlap: once
+the exposure of frame i is over, the stage can already move to position i+1
+while frame i is being read out and written to disk.
+
+    stage   : [move 0]              [move 1]              [move 2]
+    camera  :         [exp 0|write 0]       [exp 1|write 1]       [exp 2|write 2]
+
+The stage and the camera are driven through their proxy clients
+(`PDXCDriver.Client()` and `PSCameraDriver.Client()`), or any object with the
+same methods.
+"""
+import os
+import time
+
+from lclib.util import Future
+
+
+def _result(future):
+    """
+    Wait for a Future and return its result, re-raising its error if any.
+    """
+    error = future.exception()
+    if error is not None:
+        raise error
+    return future.result()
+
+
+class StepScan:
+    """
+    Step-and-acquire scan that overlaps the next stage move with the readout
+    and writing of the previous frame.
+    """
+
+    def __init__(self, stage, camera, step_size, exposure_time, data_path,
+                 file_name='test{index}.tif', in_memory=False):
+        """
+        Args:
+            stage: PDXC client (or driver). Must provide move_forward and move_back.
+            camera: PSCamera client (or driver). Must provide Camera_Expose and Camera_Readout
+                (and Camera_Sequence for run_triggered).
+            step_size: pulses per step. Negative values move back.
+            exposure_time: exposure time in µs (as passed to Camera_Configuration).
+            data_path: directory in which the frames are saved.
+            file_name: file name template, formatted with the 1-based frame index.
+                None: the frames are not written (in memory only, requires in_memory).
+            in_memory: if True, frames are acquired in memory (as Camera_Snap) and written by
+                the camera's background writer, so the camera is free again as soon as the
+                frame is queued. Otherwise PS_camera.dll writes them (as Camera_Acquisition).
+        """
+        if file_name is None and not in_memory:
+            raise ValueError('PS_camera.dll always writes the frames: file_name=None requires in_memory=True.')
+        self.stage = stage
+        self.camera = camera
+        self.step_size = step_size
+        self.exposure_time = exposure_time
+        self.data_path = data_path
+        self.file_name = file_name
+        self.in_memory = in_memory
+        self.report = None
+        self.step_times = []    # duration (s) of each step of the last run
+
+    def frame_path(self, index):
+        """
+        Path of the frame with 0-based index `index` (None if the frames are not written).
+        """
+        if self.file_name is None:
+            return None
+        return os.path.join(self.data_path, self.file_name.format(index=index + 1))
+
+    def _move(self):
+        """
+        Move one step. Returns the move record of the stage.
+        """
+        if self.step_size >= 0:
+            return self.stage.move_forward(self.step_size)
+        return self.stage.move_back(-self.step_size)
+
+    def run(self, n_steps):
+        """
+        Run the scan: n_steps times move, settle and acquire.
+
+        Returns:
+            the scan report (dict), also stored in self.report.
+        """
+        if self.file_name is not None:
+            os.makedirs(self.data_path, exist_ok=True)
+
+        step_times = []
+        move_records = []
+
+        t_start = time.perf_counter()
+        move = Future(self._move)
+        for i in range(n_steps):
+            t_step = time.perf_counter()
+
+            # The stage must have settled before the exposure starts
+            move_records.append(_result(move))
+
+            # Returns when the camera reports the end of the exposure (after the readout of the
+            # previous frame); this frame is read out and written in the background
+            self.camera.Camera_Expose(self.frame_path(i), in_memory=self.in_memory)
+
+            # Move to the next position while the frame is read out and written
+            if i < n_steps - 1:
+                move = Future(self._move)
+            step_times.append(time.perf_counter() - t_step)
+
+        self.camera.Camera_Readout()
+        wall_time = time.perf_counter() - t_start
+        self.step_times = step_times
+
+        move_times = [r['duration'] for r in move_records if r]
+        self.report = {'steps': n_steps,
+                       'wall_time': wall_time,
+                       'steps_per_second': n_steps / wall_time if wall_time > 0 else 0.,
+                       'mean_step_time': sum(step_times) / len(step_times) if step_times else 0.,
+                       'max_step_time': max(step_times, default=0.),
+                       'mean_move_time': sum(move_times) / len(move_times) if move_times else None,
+                       'exposure_time': self.exposure_time * 1e-6}
+        return self.report
+
+    def run_triggered(self, n_steps, step, settle_time=0., rising=True, timeout=10.):
+        """
+        Run the scan with hardware triggering: the stage is armed in fixed-step external
+        trigger mode and moves by `step` on each trigger from the detector, while the camera
+        acquires n_steps frames in memory. No call goes through the network between frames.
+
+        The detector trigger output must be wired to the controller trigger input.
+
+        Args:
+            n_steps: number of frames (and steps).
+            step: step size in stage units (mm or °), unlike step_size which is in pulses.
+            settle_time: pause (s) after each frame, for the stage to settle before the next exposure.
+            rising: trigger edge used by the controller.
+            timeout: time (s) allowed for the last step after the last frame.
+
+        Returns:
+            the scan report (dict), also stored in self.report.
+        """
+        tif_path = None
+        if self.file_name is not None:
+            os.makedirs(self.data_path, exist_ok=True)
+            tif_path = os.path.join(self.data_path, self.file_name)
+        t_start = time.perf_counter()
+        self.stage.start_triggered_scan(step, n_steps, rising=rising)
+        stage_report = None
+        try:
+            sequence = self.camera.Camera_Sequence(n_steps, tif_path, settle_time=settle_time, first_index=1)
+            stage_report = self.stage.finish_triggered_scan(timeout)
+        finally:
+            if stage_report is None:
+                # Sequence failed or aborted: disarm the stage (manual mode) for the next scan
+                self.stage.abort()
+        wall_time = time.perf_counter() - t_start
+
+        self.report = {'steps': sequence['frames'],
+                       'wall_time': wall_time,
+                       'steps_per_second': sequence['frames'] / wall_time if wall_time > 0 else 0.,
+                       'mean_step_time': wall_time / sequence['frames'] if sequence['frames'] else 0.,
+                       'max_step_time': None,
+                       'mean_move_time': None,
+                       'exposure_time': self.exposure_time * 1e-6,
+                       'step_rate': stage_report['step_rate'],
+                       'steps_detected': stage_report['steps_detected'],
+                       'position_error': stage_report['position_error'],
+                       'position_ok': stage_report['position_ok']}
+        return self.report
+
+    def summary(self):
+        """
+        Print a short summary of the last run.
+        """
+        r = self.report
+        if r is None:
+            print('No scan run yet.')
+            return
+        print(f"{r['steps']} steps in {r['wall_time']:.2f} s: {r['steps_per_second']:.2f} steps/s "
+              f"(mean step {r['mean_step_time']*1e3:.1f} ms, exposure {r['exposure_time']*1e3:.1f} ms)")
+        if 'position_ok' in r:
+            print(f"triggered: {r['steps_detected']} steps detected, final position "
+                  f"{'ok' if r['position_ok'] else 'off'} (error {r['position_error']})")